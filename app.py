@@ -1,11 +1,19 @@
 import streamlit as st
 import os
 from dotenv import load_dotenv
-from utils.file_parser import parse_excel, parse_pdf
-from utils.analysis import analyze_report, scan_pdf_reports, scan_excel_reports
+from utils.parse_cache import cached_parse_excel, cached_parse_pdf
+from utils.csv_stream import IncrementalCsvDecoder
+from utils.history_store import get_history_store
+from utils.instrumentation import runs_to_jsonl, track_run
+from utils.openai_client import get_settings, set_rate_limits
+from utils.revisions import analyze_workbook_incremental, workbook_key
+from utils.scheduler import analyze_reports
+from utils.serializer import DEFAULT_SHEET_FORMAT, SERIALIZERS, sheet_size_stats
+from utils.analysis import (analyze_report, analyze_report_stream, scan_pdf_reports, scan_excel_reports,
+                            build_csv_output, parse_scan_result)
 import pandas as pd
 from datetime import datetime
-import json
+import time
 import re
 
 # Load environment variables
@@ -13,9 +21,122 @@ load_dotenv()
 
 st.set_page_config(page_title="Financial Analyst Agent", page_icon="📊", layout="wide")
 
-# Initialize session state for reports history and scan results
+
+@st.cache_data(show_spinner=False)
+def get_sheet_size_stats(file_id, sheet_name, sheet_format, _values):
+    # The upload and sheet name identify the values, which are left out of the cache
+    # key (leading underscore) so a rerun does not hash the whole sheet
+    return sheet_size_stats(_values, sheet_format)
+
+
+def render_analysis_stream(deltas, refresh_seconds=0.3):
+    """
+    Renders a streamed analysis live: the narrative as markdown and the CSV rows as a
+    growing table. Returns the response text and the CSV decoded from it; both are
+    partial if the stream was cut, and the CSV survives even without its closing fence.
+    """
+    text_placeholder = st.empty()
+    table_placeholder = st.empty()
+    decoder = IncrementalCsvDecoder()
+    parts = []
+    last_refresh = 0.0
+    new_rows = False
+    for delta in deltas:
+        parts.append(delta)
+        new_rows = bool(decoder.feed(delta)) or new_rows
+        if time.monotonic() - last_refresh >= refresh_seconds:
+            text_placeholder.markdown(decoder.narrative + ("\n\n⏳ *Generando CSV...*" if decoder.state == "inside" else ""))
+            if new_rows:
+                table_placeholder.dataframe(decoder.dataframe())
+                new_rows = False
+            last_refresh = time.monotonic()
+    decoder.finish()
+    text_placeholder.markdown(decoder.narrative)
+    if decoder.rows:
+        table_placeholder.dataframe(decoder.dataframe())
+    return "".join(parts), decoder.csv_text()
+
+
+HISTORY_PAGE_SIZE = 5
+# Instrumented runs kept per session for the performance panel
+PERF_RUNS_LIMIT = 50
+
+
+def record_run(run):
+    st.session_state.perf_runs = (st.session_state.perf_runs + [run.to_dict()])[-PERF_RUNS_LIMIT:]
+
+
+def render_perf_panel(container):
+    """
+    Sidebar panel with the stage timings, tokens and memory of the session's runs.
+    """
+    runs = st.session_state.perf_runs
+    with container.expander("⏱️ Rendimiento", expanded=False):
+        if not runs:
+            st.caption("Aún no hay ejecuciones medidas.")
+            return
+        labels = [f"{run['started_at'][11:]} · {run['name']} · {run['attrs'].get('file', '')}" for run in reversed(runs)]
+        run = list(reversed(runs))[labels.index(st.selectbox("Ejecución", labels))]
+        llm = run['llm']
+        st.metric("Latencia total", f"{run['seconds']:.2f} s")
+        if llm['requests']:
+            st.caption(
+                f"Modelo: {llm['requests']} llamadas ({llm['cache_hits']} desde caché) · "
+                f"{llm['latency_seconds']:.2f} s esperando respuesta"
+            )
+            cached_share = llm['cached_tokens'] / llm['prompt_tokens'] if llm['prompt_tokens'] else 0
+            st.caption(
+                f"Prompt: {llm['prompt_chars']:,} caracteres · ~{llm['estimated_input_tokens']:,} tokens estimados · "
+                f"{llm['prompt_tokens']:,} tokens reales ({llm['cached_tokens']:,} en caché del proveedor, "
+                f"{cached_share:.0%}) · {llm['completion_tokens']:,} tokens de salida"
+            )
+        if run['peak_rss_mb'] is not None:
+            memory = f"Memoria pico del proceso: {run['peak_rss_mb']:,.0f} MB (+{run['peak_rss_growth_mb']:,.0f} MB en esta ejecución)"
+            if run['peak_traced_mb'] is not None:
+                memory += f" · pico Python: {run['peak_traced_mb']:,.1f} MB"
+            st.caption(memory)
+        totals = {}
+        for span in run['spans']:
+            entry = totals.setdefault(span['name'], {"Etapa": span['name'], "Llamadas": 0, "Segundos": 0.0})
+            entry["Llamadas"] += 1
+            entry["Segundos"] += span['seconds']
+        if totals:
+            st.dataframe(pd.DataFrame(list(totals.values())).round({"Segundos": 3}), hide_index=True)
+        if run['error']:
+            st.error(run['error'])
+        st.download_button(
+            "📥 Exportar mediciones (JSONL)",
+            data=runs_to_jsonl(runs).encode("utf-8"),
+            file_name="mediciones.jsonl",
+            mime="application/jsonl",
+            use_container_width=True
+        )
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_history_entry(entry_id):
+    """
+    Loads a history entry from disk. Only the last few opened entries stay in memory.
+    """
+    store = get_history_store()
+    csv_content = store.load_csv(entry_id)
+    return {
+        'analysis': store.load_analysis(entry_id),
+        'csv_content': csv_content,
+        # Download payload (UTF-8 with BOM for Excel), encoded once per opened entry
+        'csv_bytes': csv_content.encode('utf-8-sig') if csv_content else b"",
+        'csv_df': store.load_table(entry_id) if csv_content else None,
+    }
+
+
+# Initialize session state for reports history and scan results.
+# The history keeps only entry metadata; analyses and tables live on disk (utils/history_store.py)
 if 'reports_history' not in st.session_state:
     st.session_state.reports_history = []
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 1
+if 'perf_runs' not in st.session_state:
+    st.session_state.perf_runs = []
 if 'scanned_reports' not in st.session_state:
     st.session_state.scanned_reports = None
 
@@ -28,6 +149,42 @@ with st.sidebar:
     api_key = st.text_input("OpenAI API Key", type="password", value=os.getenv("OPENAI_API_KEY", ""))
     if not api_key:
         st.warning("Please enter your OpenAI API Key to proceed.")
+    use_cache = st.checkbox(
+        "Usar caché de respuestas",
+        value=True,
+        help="Reutiliza respuestas previas del modelo para el mismo contenido. Desactívalo para forzar una nueva consulta."
+    )
+    sheet_formats = list(SERIALIZERS)
+    sheet_format = st.selectbox(
+        "Formato de hojas en el prompt",
+        sheet_formats,
+        index=sheet_formats.index(DEFAULT_SHEET_FORMAT) if DEFAULT_SHEET_FORMAT in sheet_formats else 0,
+        help="tsv: tabla compacta sin filas/columnas vacías · cells: celda=valor · rows: filas numeradas · table: formato original"
+    )
+    local_validation = st.checkbox(
+        "Validación local de totales y outliers",
+        value=True,
+        help="Verifica sumas y outliers sobre el CSV localmente en lugar de pedírselo al modelo (respuestas más cortas y rápidas)."
+    )
+    structured_output = st.checkbox(
+        "Salida estructurada compacta (JSON)",
+        value=False,
+        help="El modelo responde con JSON normalizado (contexto y jerarquía declarados una vez) que se expande "
+             "localmente al CSV: mucho menos texto generado en reportes grandes. La respuesta no se muestra en vivo."
+    )
+    with st.expander("Límites de la API", expanded=False):
+        settings = get_settings()
+        rpm_limit = st.number_input(
+            "Solicitudes por minuto (0 = sin límite)", min_value=0, step=10,
+            value=settings.requests_per_minute,
+            help="Las solicitudes esperan turno en lugar de ser rechazadas por la API (error 429)."
+        )
+        tpm_limit = st.number_input(
+            "Tokens por minuto (0 = sin límite)", min_value=0, step=10000,
+            value=settings.tokens_per_minute,
+            help="Cuenta el prompt más la salida máxima de cada solicitud, como la API."
+        )
+        set_rate_limits(rpm_limit, tpm_limit)
     
     st.divider()
     
@@ -42,8 +199,14 @@ with st.sidebar:
         st.info(f"📊 Reportes generados: {len(st.session_state.reports_history)}")
         
         if st.button("🗑️ Limpiar Historial", use_container_width=True):
+            for report in st.session_state.reports_history:
+                get_history_store().delete(report['id'])
             st.session_state.reports_history = []
+            st.session_state.history_page = 1
             st.rerun()
+    
+    # Filled at the end of the script, so it includes the runs of this rerun
+    perf_panel = st.container()
 
 # File Upload
 uploaded_file = st.file_uploader("Choose a file", type=["xlsx", "xls", "pdf"])
@@ -59,7 +222,10 @@ if uploaded_file and api_key:
     try:
         if file_extension in ["xlsx", "xls"]:
             with st.spinner("Parsing Excel file..."):
-                parsed_data = parse_excel(uploaded_file)
+                with track_run("parse", file=uploaded_file.name) as run:
+                    parsed_data = cached_parse_excel(uploaded_file)
+                if not run.find_span("parse")["attrs"]["cache_hit"]:
+                    record_run(run)
                 st.success("Excel file parsed successfully!")
                 
                 
@@ -85,17 +251,27 @@ if uploaded_file and api_key:
                             formulas = content.get('formulas', {})
                             if formulas:
                                 st.write(f"Fórmulas encontradas: {len(formulas)}")
+                            stats = get_sheet_size_stats(uploaded_file.file_id, sheet_name, sheet_format,
+                                                         content['values'])
+                            st.caption(
+                                f"Tamaño en el prompt ({stats['format']}): {stats['compact_chars']:,} caracteres "
+                                f"vs ~{stats['original_chars']:,} con to_string() (-{stats['reduction']:.0%})"
+                            )
                 
         elif file_extension == "pdf":
             with st.spinner("Extracting text from PDF..."):
-                parsed_data = parse_pdf(uploaded_file)
-                st.success("PDF text extracted successfully!")
+                with track_run("parse", file=uploaded_file.name) as run:
+                    parsed_data = cached_parse_pdf(uploaded_file)
+                if not run.find_span("parse")["attrs"]["cache_hit"]:
+                    record_run(run)
+                st.success(f"PDF loaded successfully ({parsed_data.n_pages} pages)!")
                 with st.expander("Extracted Text Preview"):
                     st.text(parsed_data[:1000] + "...")
         
         
         # --- DOC SCAN & SELECTION LOGIC ---
         selected_focus = None
+        selected_report = None
         
         # Enable scan for both PDF and Excel
         if file_extension in ['pdf', 'xlsx', 'xls']:
@@ -107,37 +283,26 @@ if uploaded_file and api_key:
                 with st.spinner("Analizando estructura del documento..."):
                     
                     scan_json = ""
-                    if file_extension == 'pdf':
-                        scan_json = scan_pdf_reports(parsed_data, api_key)
-                    else:
-                        # Excel
-                        scan_json = scan_excel_reports(parsed_data, api_key)
-                    
-                    # Extract JSON block
-                    json_match = re.search(r'```json\s*\n(.*?)\n```', scan_json, re.DOTALL)
-                    if not json_match:
-                         # Try without newlines or different format
-                         json_match = re.search(r'```json(.*?)```', scan_json, re.DOTALL)
+                    with track_run("scan", file=uploaded_file.name) as run:
+                        if file_extension == 'pdf':
+                            scan_json = scan_pdf_reports(parsed_data, api_key, use_cache=use_cache)
+                        else:
+                            # Excel
+                            scan_json = scan_excel_reports(parsed_data, api_key, use_cache=use_cache,
+                                                           sheet_format=sheet_format)
+                    record_run(run)
                     
-                    if json_match:
-                        try:
-                            st.session_state.scanned_reports = json.loads(json_match.group(1))
-                            st.success(f"Se encontraron {len(st.session_state.scanned_reports)} reportes posibles.")
-                        except json.JSONDecodeError as e:
-                            st.error(f"Error al procesar la lista de reportes: {str(e)}")
-                            st.text(scan_json)
+                    reports = parse_scan_result(scan_json)
+                    if reports is not None:
+                        st.session_state.scanned_reports = reports
+                        st.success(f"Se encontraron {len(reports)} reportes posibles.")
                     else:
-                         # Fallback if no JSON block found, try raw parse or show error
-                         try:
-                            # Sometimes models output raw JSON without markdown
-                            st.session_state.scanned_reports = json.loads(scan_json)
-                         except:
-                            st.warning("No se pudo estructurar la lista de reportes automáticamente.")
-                            st.text(scan_json)
+                        st.warning("No se pudo estructurar la lista de reportes automáticamente.")
+                        st.text(scan_json)
 
             # Display selection if reports are found
             if st.session_state.scanned_reports:
-                report_options = {f"{r['title']} ({r['location']}) - {r['description']}": r['title'] for r in st.session_state.scanned_reports}
+                report_options = {f"{r['title']} ({r['location']}) - {r['description']}": r for r in st.session_state.scanned_reports}
                 report_options["Todos / Análisis General"] = None
                 
                 selection = st.radio(
@@ -146,7 +311,8 @@ if uploaded_file and api_key:
                     index=0
                 )
                 
-                selected_focus = report_options[selection]
+                selected_report = report_options[selection]
+                selected_focus = selected_report['title'] if selected_report else None
                 
                 if selected_focus:
                     st.info(f"🎯 **Enfoque seleccionado**: {selected_focus}")
@@ -156,49 +322,103 @@ if uploaded_file and api_key:
         # --- END DOC SCAN LOGIC ---
 
         # Analysis Button
+        map_reduce = st.checkbox(
+            "Análisis completo por partes",
+            help="Para documentos grandes: analiza todas las hojas/páginas en paralelo en lugar de truncar el contenido."
+        )
+        stream_output = st.checkbox(
+            "Mostrar el análisis en vivo",
+            value=True,
+            help="Muestra el texto y las filas del CSV a medida que el modelo las genera."
+        )
+        incremental = False
+        if file_extension in ["xlsx", "xls"]:
+            incremental = st.checkbox(
+                "Análisis incremental de revisiones",
+                help="Analiza todos los reportes detectados del libro. Si ya se analizó una versión anterior "
+                     f"(mismo nombre de archivo, clave '{workbook_key(uploaded_file.name)}'), solo vuelve a analizar "
+                     "los reportes con celdas modificadas y reutiliza las filas del CSV del resto."
+            )
         if st.button("Analyze Report", type="primary"):
             with st.spinner("Analyzing with OpenAI..."):
                 try:
-                    # Pass selected_focus to analysis
-                    analysis_result = analyze_report(parsed_data, file_extension, api_key, focus_context=selected_focus)
-                    
-                    # Extract CSV from code block - try multiple patterns
-                    csv_content = None
-                    csv_df = None
-                    
-                    # Try different regex patterns to extract CSV
-                    patterns = [
-                        r'```csv\s*\n(.*?)\n```',  # Standard markdown with newlines
-                        r'```csv\s*\r?\n(.*?)\r?\n```',  # With optional carriage returns
-                        r'```csv(.*?)```',  # Without requiring newlines
-                    ]
+                    analysis_kwargs = dict(
+                        # Pass selected_focus to analysis
+                        focus_context=selected_focus, map_reduce=map_reduce, use_cache=use_cache,
+                        sheet_format=sheet_format, focus_location=selected_report,
+                        local_validation=local_validation, structured_output=structured_output
+                    )
+                    streamed_csv = None
+                    revision = None
+                    try:
+                        with track_run("analysis", file=uploaded_file.name, focus=selected_focus,
+                                       map_reduce=map_reduce, stream=stream_output, incremental=incremental,
+                                       structured=structured_output) as run:
+                            if incremental:
+                                revision = analyze_workbook_incremental(
+                                    parsed_data, uploaded_file.name, api_key, map_reduce=map_reduce,
+                                    use_cache=use_cache, sheet_format=sheet_format,
+                                    local_validation=local_validation, structured_output=structured_output
+                                )
+                                analysis_result = revision['analysis']
+                            elif stream_output:
+                                analysis_result, streamed_csv = render_analysis_stream(
+                                    analyze_report_stream(parsed_data, file_extension, api_key, **analysis_kwargs)
+                                )
+                            else:
+                                analysis_result = analyze_report(parsed_data, file_extension, api_key,
+                                                                 **analysis_kwargs)
+                            
+                            # Extract CSV from code block (a cut-off stream has no closing fence,
+                            # so fall back to the rows decoded while streaming)
+                            csv_output = build_csv_output(analysis_result, parsed_data,
+                                                          local_validation=local_validation,
+                                                          fallback_csv=streamed_csv)
+                    finally:
+                        record_run(run)
+                    csv_content = csv_output['csv_content']
+                    csv_df = csv_output['csv_df']
                     
-                    for pattern in patterns:
-                        csv_match = re.search(pattern, analysis_result, re.DOTALL)
-                        if csv_match:
-                            csv_content = csv_match.group(1).strip()
-                            break
+                    if revision is not None:
+                        if revision['previous']:
+                            st.info(
+                                f"♻️ Revisión: {revision['changed_cells']} celdas cambiadas · "
+                                f"{len(revision['reused'])} reportes reutilizados · "
+                                f"{len(revision['reanalyzed'])} re-analizados"
+                            )
+                        if revision['failed']:
+                            st.warning(f"⚠️ Fallaron {len(revision['failed'])} reportes; se reintentarán en la próxima versión")
+                        if revision['partial']:
+                            st.warning(f"⚠️ {len(revision['partial'])} reportes quedaron incompletos; "
+                                       "se reintentarán en la próxima versión")
                     
-                    # If CSV content was found, try to parse it
-                    if csv_content:
-                        try:
-                            from io import StringIO
-                            csv_df = pd.read_csv(StringIO(csv_content), on_bad_lines='skip', quotechar='"', skipinitialspace=True, encoding='utf-8')
-                            st.success(f"✅ CSV extraído correctamente ({len(csv_df)} filas)")
-                        except Exception as e:
-                            st.warning(f"CSV encontrado pero no se pudo parsear como DataFrame: {str(e)}")
+                    if csv_df is not None:
+                        st.success(f"✅ CSV extraído correctamente ({len(csv_df)} filas)")
+                        if csv_output['formula_rows']:
+                            st.info(f"🔗 {csv_output['formula_rows']} filas con jerarquía tomada de las fórmulas del Excel")
+                        validation = csv_output['validation']
+                        if validation:
+                            st.info(
+                                f"🧮 Validación local: {validation['totals']} totales "
+                                f"({validation['validated']} validados, {validation['discrepancies']} con discrepancias, "
+                                f"{validation['unverified']} sin componentes) · {validation['outliers']} outliers"
+                            )
+                    elif csv_content:
+                        st.warning(f"CSV encontrado pero no se pudo parsear como DataFrame: {csv_output['error']}")
                     else:
                         st.warning("⚠️ No se encontró un bloque CSV en la respuesta del análisis")
                     
-                    # Save to history
-                    report_entry = {
-                        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'filename': uploaded_file.name + (f" [{selected_focus}]" if selected_focus else ""),
-                        'analysis': analysis_result,
-                        'csv_content': csv_content,
-                        'csv_df': csv_df
-                    }
+                    # Save to history: content goes to disk, the session keeps the metadata
+                    report_entry = get_history_store().save(
+                        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        filename=uploaded_file.name + (" [incremental]" if incremental else
+                                                       f" [{selected_focus}]" if selected_focus else ""),
+                        analysis=analysis_result,
+                        csv_content=csv_content,
+                        csv_df=csv_df
+                    )
                     st.session_state.reports_history.append(report_entry)
+                    st.session_state.history_page = 1
                     st.success("Analysis complete!")
                     
                 except Exception as e:
@@ -207,6 +427,54 @@ if uploaded_file and api_key:
                     # import traceback
                     # st.text(traceback.format_exc())
                 st.rerun()
+        
+        # Analyze every detected report at once: one focused analysis per report, run
+        # concurrently within the API limits; each one joins the history when it finishes
+        if st.session_state.scanned_reports and not incremental:
+            reports = st.session_state.scanned_reports
+            if st.button(f"⚡ Analizar los {len(reports)} reportes detectados"):
+                progress = st.progress(0.0, text=f"Analizando {len(reports)} reportes en paralelo...")
+                finished = 0
+                failed = 0
+                incomplete = 0
+                with track_run("analysis_all", file=uploaded_file.name, reports=len(reports),
+                               map_reduce=map_reduce) as run:
+                    try:
+                        for result in analyze_reports(parsed_data, file_extension, api_key, reports,
+                                                      map_reduce=map_reduce, use_cache=use_cache,
+                                                      sheet_format=sheet_format, local_validation=local_validation,
+                                                      structured_output=structured_output):
+                            finished += 1
+                            title = result['report'].get('title', '')
+                            if result['error']:
+                                failed += 1
+                                st.warning(f"⚠️ {title}: {result['analysis']}")
+                            else:
+                                csv_output = result['csv_output']
+                                report_entry = get_history_store().save(
+                                    timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                    filename=f"{uploaded_file.name} [{title}]",
+                                    analysis=result['analysis'],
+                                    csv_content=csv_output['csv_content'],
+                                    csv_df=csv_output['csv_df']
+                                )
+                                st.session_state.reports_history.append(report_entry)
+                                n_rows = len(csv_output['csv_df']) if csv_output['csv_df'] is not None else 0
+                                if result['partial']:
+                                    incomplete += 1
+                                    st.warning(f"⚠️ {title}: análisis incompleto ({n_rows} filas), "
+                                               "algunas partes no se pudieron analizar")
+                                else:
+                                    st.write(f"✅ {title} ({n_rows} filas, {result['seconds']:.1f} s)")
+                            progress.progress(finished / len(reports),
+                                              text=f"{finished} de {len(reports)} reportes analizados")
+                    finally:
+                        record_run(run)
+                st.session_state.history_page = 1
+                if failed:
+                    st.error(f"❌ {failed} reportes no se pudieron analizar")
+                elif not incomplete:
+                    st.rerun()
                 
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
@@ -214,53 +482,77 @@ if uploaded_file and api_key:
 elif uploaded_file and not api_key:
     st.error("Please provide an API Key to analyze the file.")
 
-# Display all reports from history
+# Display reports from history, one page at a time
 if st.session_state.reports_history:
     st.divider()
     st.header("📚 Historial de Reportes")
     
-    for idx, report in enumerate(reversed(st.session_state.reports_history), 1):
-        report_num = len(st.session_state.reports_history) - idx + 1
+    history = st.session_state.reports_history
+    n_pages = (len(history) + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+    if n_pages > 1:
+        st.session_state.history_page = min(st.session_state.history_page, n_pages)
+        page = st.number_input(
+            f"Página (de {n_pages})", min_value=1, max_value=n_pages, key="history_page"
+        )
+    else:
+        page = 1
+    first = (page - 1) * HISTORY_PAGE_SIZE
+    newest_first = list(reversed(history))
+    
+    for idx, report in enumerate(newest_first[first:first + HISTORY_PAGE_SIZE], first + 1):
+        report_num = len(history) - idx + 1
         
         with st.expander(f"📄 Reporte #{report_num} - {report['filename']} ({report['timestamp']})", expanded=(idx == 1)):
+            # Entries are read from disk only when opened
+            if not st.toggle("Mostrar contenido", value=(idx == 1), key=f"show_{report['id']}"):
+                rows_note = f" · {report['n_rows']} filas" if report.get('n_rows') else ""
+                st.caption(f"Contenido guardado en disco{rows_note}")
+                continue
+            try:
+                entry = load_history_entry(report['id'])
+            except FileNotFoundError:
+                st.warning("⚠️ El contenido de este reporte ya no está disponible en disco")
+                continue
+            
             st.markdown("### 🤖 Análisis Financiero")
-            st.markdown(report['analysis'])
+            st.markdown(entry['analysis'])
             
-            if report['csv_content']:
+            if entry['csv_content']:
                 st.markdown("### 📋 Datos Estructurados (CSV)")
                 
-                if report['csv_df'] is not None:
-                    st.dataframe(report['csv_df'])
-                    st.info(f"📊 Total de filas: {len(report['csv_df'])}")
+                if entry['csv_df'] is not None:
+                    st.dataframe(entry['csv_df'])
+                    st.info(f"📊 Total de filas: {len(entry['csv_df'])}")
                 else:
-                    st.code(report['csv_content'], language='csv')
+                    st.code(entry['csv_content'], language='csv')
                 
                 # Validate CSV content before creating download button
-                if report['csv_content'] and len(report['csv_content'].strip()) > 0:
+                if len(entry['csv_content'].strip()) > 0:
                     try:
                         # Generate simple, clean filename
                         base_name = report['filename'].rsplit('.', 1)[0]  # Remove extension
                         # Clean the base name to remove special characters
-                        import re
                         clean_name = re.sub(r'[^\w\s-]', '', base_name).strip()
                         clean_name = re.sub(r'[-\s]+', '_', clean_name)
                         filename = f"{clean_name}_analisis.csv"
                         
-                        # Encode CSV content to UTF-8 with BOM for Excel compatibility
-                        csv_bytes = report['csv_content'].encode('utf-8-sig')
+                        # Size from the entry metadata; the bytes come encoded from load_history_entry
+                        csv_size = report.get('csv_bytes') or len(entry['csv_bytes'])
                         
                         st.download_button(
                             label=f"📥 Descargar {filename}",
-                            data=csv_bytes,
+                            data=entry['csv_bytes'],
                             file_name=filename,
                             mime="text/csv; charset=utf-8",
-                            key=f"dl_{report_num}",
-                            help=f"Descargar archivo CSV ({len(csv_bytes)} bytes)"
+                            key=f"dl_{report['id']}",
+                            help=f"Descargar archivo CSV ({csv_size} bytes)"
                         )
-                        st.caption(f"💡 **Nombre del archivo**: `{filename}` | **Tamaño**: {len(csv_bytes):,} bytes")
+                        st.caption(f"💡 **Nombre del archivo**: `{filename}` | **Tamaño**: {csv_size:,} bytes")
                     except Exception as e:
                         st.error(f"❌ Error al preparar la descarga: {str(e)}")
                 else:
                     st.error("❌ El contenido CSV está vacío")
             else:
                 st.info("No se generó un bloque CSV estructurado en esta respuesta.")
+
+render_perf_panel(perf_panel)
@@ -0,0 +1,59 @@
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+from utils.batch import run_batch
+from utils.serializer import SERIALIZERS
+
+# Load environment variables
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Procesa sin supervisión todos los reportes (Excel/PDF) de una carpeta."
+    )
+    parser.add_argument("input_dir", help="Carpeta con los reportes a procesar")
+    parser.add_argument("output_dir", help="Carpeta de resultados (incluye manifest.json para reanudar)")
+    parser.add_argument("--parse-workers", type=int, default=None,
+                        help="Procesos para leer archivos (por defecto, número de CPUs)")
+    parser.add_argument("--model-workers", type=int, default=4,
+                        help="Archivos analizados en paralelo por el modelo")
+    parser.add_argument("--per-report", action="store_true",
+                        help="Escanea cada archivo y analiza cada reporte detectado por separado")
+    parser.add_argument("--no-map-reduce", action="store_true",
+                        help="Trunca los documentos grandes en lugar de analizarlos por partes")
+    parser.add_argument("--no-cache", action="store_true", help="No reutiliza respuestas previas del modelo")
+    parser.add_argument("--sheet-format", choices=list(SERIALIZERS), default=None,
+                        help="Formato de las hojas en el prompt")
+    parser.add_argument("--model-validation", action="store_true",
+                        help="Deja la validación de totales y outliers al modelo en lugar de hacerla localmente")
+    parser.add_argument("--skip-failed", action="store_true",
+                        help="No reintenta los archivos que fallaron o quedaron incompletos en una ejecución anterior")
+    parser.add_argument("--no-recursive", action="store_true", help="No entra en subcarpetas")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        parser.error("OPENAI_API_KEY no está definido")
+
+    summary = run_batch(
+        args.input_dir,
+        args.output_dir,
+        api_key,
+        parse_workers=args.parse_workers,
+        model_workers=args.model_workers,
+        per_report=args.per_report,
+        map_reduce=not args.no_map_reduce,
+        use_cache=not args.no_cache,
+        sheet_format=args.sheet_format,
+        local_validation=not args.model_validation,
+        retry_failed=not args.skip_failed,
+        recursive=not args.no_recursive,
+    )
+    print("Resumen:", ", ".join(f"{status}: {count}" for status, count in sorted(summary.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CSV_HEADER = ("Hoja,Entidad,Año,Mes,Nivel_1,Nivel_2,Nivel_3,Nivel_4,Nivel_5,Concepto_Final,Valor,Moneda,"
+              "Es_Total,Origen_Dato,Relacion_Celdas,Ecuacion_Validacion,Explicacion_Validacion,Es_Outlier")
+
+
+def analysis_reply(n_rows=200):
+    """
+    A canned analysis response: narrative sections plus a ```csv block of `n_rows`
+    rows in the layout the analysis prompt asks for (sections of detail rows, each
+    closed by a total row).
+    """
+    rows = []
+    section = 0
+    while len(rows) < n_rows:
+        section += 1
+        first = len(rows) + 10
+        values = [1000.0 * (section + i) for i in range(8)]
+        for i, value in enumerate(values):
+            rows.append(f'"Entidad 1","Empresa","2023","Dic","Activos","Seccion {section}","","","",'
+                        f'"Cuenta {section}.{i + 1}",{value:.2f},"BOB","NO","Entidad 1:B{first + i}",'
+                        f'"Dato directo","","",""')
+        rows.append(f'"Entidad 1","Empresa","2023","Dic","Activos","Seccion {section}","","","",'
+                    f'"Total seccion {section}",{sum(values):.2f},"BOB","SI","Entidad 1:B{first + len(values)}",'
+                    f'"Suma(B{first}:B{first + len(values) - 1})","","",""')
+    return (
+        "## Resumen Ejecutivo\nReporte sintético generado por el servidor de pruebas.\n\n"
+        "## Análisis Estructural\nSecciones de activos con subtotales.\n\n"
+        f"```csv\n{CSV_HEADER}\n" + "\n".join(rows[:n_rows]) + "\n```\n"
+    )
+
+
+def structured_reply(n_rows=200):
+    """
+    The structured (JSON schema) counterpart of analysis_reply: the same rows in the
+    normalized shape of utils.structured_output.
+    """
+    nodes = [{"id": 1, "nombre": "Activos", "padre": None}]
+    rows = []
+    section = 0
+    while len(rows) < n_rows:
+        section += 1
+        nodes.append({"id": section + 1, "nombre": f"Seccion {section}", "padre": 1})
+        first = len(rows) + 10
+        values = [1000.0 * (section + i) for i in range(8)]
+        for i, value in enumerate(values):
+            rows.append({"c": 1, "n": section + 1, "k": f"Cuenta {section}.{i + 1}", "v": value, "t": False,
+                         "o": f"B{first + i}", "r": "Dato directo"})
+        rows.append({"c": 1, "n": section + 1, "k": f"Total seccion {section}", "v": sum(values), "t": True,
+                     "o": f"B{first + len(values)}", "r": f"Suma(B{first}:B{first + len(values) - 1})"})
+    return json.dumps({
+        "informe": "## Resumen Ejecutivo\nReporte sintético generado por el servidor de pruebas.\n\n"
+                   "## Análisis Estructural\nSecciones de activos con subtotales.",
+        "contextos": [{"id": 1, "hoja": "Entidad 1", "entidad": "Empresa", "anio": "2023", "mes": "Dic",
+                       "moneda": "BOB"}],
+        "nodos": nodes,
+        "filas": rows[:n_rows],
+    }, ensure_ascii=False, separators=(",", ":"))
+
+
+def scan_reply(n_reports=3):
+    reports = [
+        {"id": i, "title": f"REPORTE SINTÉTICO {i}", "location": f"Hoja: Entidad {i} - Filas 1-60",
+         "description": "Tabla sintética"}
+        for i in range(1, n_reports + 1)
+    ]
+    return "```json\n" + json.dumps(reports, ensure_ascii=False, indent=2) + "\n```"
+
+
+def common_prefix_length(a, b):
+    """
+    Length of the common prefix of two strings (binary search over C-level slice compares).
+    """
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class FakeLLMServer:
+    """
+    Local OpenAI-compatible chat completions endpoint for offline benchmarks.
+
+    Every request waits `latency` seconds (time to first token) plus the time to
+    "generate" the reply at `tokens_per_second` (~4 characters per token), then
+    answers with a canned scan JSON, analysis + CSV or structured analysis (when the
+    request has a json_schema response_format), streamed or not, including
+    usage counts. Point the app at it with OPENAI_BASE_URL=server.base_url or
+    utils.openai_client.configure(base_url=server.base_url).
+
+    Prompt caching is simulated like the API does it: the longest prefix shared with
+    a recent request counts as cached in blocks of 128 tokens, from 1024 tokens on.
+    """
+
+    def __init__(self, latency=0.5, tokens_per_second=0, csv_rows=200, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.csv_rows = csv_rows
+        self.requests = 0
+        self.prompt_chars = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._recent_prompts = deque(maxlen=16)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def cached_tokens_for(self, prompt):
+        """
+        Tokens of `prompt` a provider would serve from its prompt cache.
+        """
+        with self._lock:
+            recent = list(self._recent_prompts)
+            self._recent_prompts.append(prompt)
+        shared = max((common_prefix_length(prompt, previous) for previous in recent), default=0)
+        tokens = shared // 4 // 128 * 128
+        return tokens if tokens >= 1024 else 0
+
+    def reply_for(self, body):
+        system = next((m["content"] for m in body.get("messages", []) if m.get("role") == "system"), "")
+        if body.get("response_format", {}).get("type") == "json_schema":
+            return structured_reply(self.csv_rows)
+        if "JSON" in system:
+            return scan_reply()
+        return analysis_reply(self.csv_rows)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                prompt = "".join(m.get("content") or "" for m in body.get("messages", []))
+                cached_tokens = server.cached_tokens_for(prompt)
+                with server._lock:
+                    server.requests += 1
+                    server.prompt_chars += len(prompt)
+                    server.prompt_tokens += len(prompt) // 4
+                    server.cached_tokens += cached_tokens
+                content = server.reply_for(body)
+                usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                         "total_tokens": (len(prompt) + len(content)) // 4,
+                         "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+                time.sleep(server.latency)
+                generation_seconds = (len(content) / 4 / server.tokens_per_second
+                                      if server.tokens_per_second else 0)
+                if body.get("stream"):
+                    self._stream(body, content, usage, generation_seconds)
+                    return
+                time.sleep(generation_seconds)
+                payload = json.dumps({
+                    "id": "bench", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", ""), "usage": usage,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body, content, usage, generation_seconds):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                pieces = [content[i:i + 64] for i in range(0, len(content), 64)]
+                delay = generation_seconds / max(1, len(pieces))
+
+                def send(choices, **extra):
+                    chunk = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": body.get("model", ""), "choices": choices, **extra}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+
+                for piece in pieces:
+                    if delay:
+                        time.sleep(delay)
+                    send([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+                send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                if body.get("stream_options", {}).get("include_usage"):
+                    send([], usage=usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local compatible con OpenAI para pruebas sin conexión.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Segundos de espera por solicitud")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Velocidad de generación simulada")
+    parser.add_argument("--csv-rows", type=int, default=200, help="Filas del CSV de cada respuesta")
+    args = parser.parse_args()
+    server = FakeLLMServer(args.latency, args.tokens_per_second, args.csv_rows, port=args.port)
+    print(f"OPENAI_BASE_URL={server.base_url}")
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+SECTIONS = {
+    "Activos corrientes": ["Caja y bancos", "Inversiones temporarias", "Cuentas por cobrar", "Inventarios",
+                           "Gastos pagados por adelantado", "Otros activos corrientes"],
+    "Activos no corrientes": ["Inversiones permanentes", "Bienes de uso", "Depreciacion acumulada",
+                              "Activos intangibles", "Cargos diferidos"],
+    "Pasivos corrientes": ["Proveedores", "Obligaciones bancarias", "Impuestos por pagar",
+                           "Remuneraciones por pagar", "Otras cuentas por pagar"],
+    "Ingresos": ["Ventas", "Servicios", "Ingresos financieros", "Otros ingresos"],
+    "Gastos": ["Costo de ventas", "Gastos administrativos", "Gastos de comercializacion",
+               "Gastos financieros", "Impuestos"],
+}
+TABLE_TITLES = ["BALANCE GENERAL", "ESTADO DE RESULTADOS", "FLUJO DE EFECTIVO", "EVOLUCION MENSUAL"]
+MONTHS = ["Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
+
+
+def _column_letter(index):
+    """
+    1-based column index -> Excel letters (1 -> A, 28 -> AB).
+    """
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _period_label(index):
+    year, month = divmod(index, 12)
+    return f"{MONTHS[month]} {2023 + year}"
+
+
+def _table_rows(rng, title, n_detail_rows, n_columns):
+    """
+    One stacked financial table: title block, header, sections of detail rows each
+    closed by a SUM total, and a grand total adding the section totals.
+    Rows are lists of cells: None (blank), str, number or ("=FORMULA", cached value);
+    formulas use row offsets relative to the table start, resolved by the caller.
+    """
+    rows = [[title], ["(En bolivianos)"], [], ["Concepto"] + [_period_label(c) for c in range(n_columns)]]
+    section_names = list(SECTIONS)
+    section_totals = []
+    emitted = 0
+    while emitted < n_detail_rows:
+        section = section_names[len(section_totals) % len(section_names)]
+        rows.append([section])
+        first = len(rows)
+        size = min(rng.randint(4, 12), n_detail_rows - emitted)
+        column_sums = [0.0] * n_columns
+        for i in range(size):
+            concept = SECTIONS[section][i % len(SECTIONS[section])]
+            values = [round(rng.uniform(1_000, 5_000_000), 2) for _ in range(n_columns)]
+            column_sums = [total + value for total, value in zip(column_sums, values)]
+            rows.append([concept if i < len(SECTIONS[section]) else f"{concept} {i}"] + values)
+        last = len(rows) - 1
+        rows.append([f"Total {section.lower()}"] + [
+            (f"=SUM({{col{c}}}{{r{first}}}:{{col{c}}}{{r{last}}})", round(column_sums[c], 2))
+            for c in range(n_columns)
+        ])
+        section_totals.append((len(rows) - 1, column_sums))
+        emitted += size
+    rows.append(["TOTAL GENERAL"] + [
+        ("=" + "+".join(f"{{col{c}}}{{r{row}}}" for row, _ in section_totals),
+         round(sum(sums[c] for _, sums in section_totals), 2))
+        for c in range(n_columns)
+    ])
+    return rows
+
+
+def _cell_xml(ref, value):
+    if isinstance(value, tuple):
+        formula, cached = value
+        return f'<c r="{ref}"><f>{escape(formula[1:])}</f><v>{cached}</v></c>'
+    if isinstance(value, str):
+        return f'<c r="{ref}" t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+    return f'<c r="{ref}"><v>{value}</v></c>'
+
+
+def _sheet_xml(rng, sheet_index, tables_per_sheet, rows_per_table, n_columns, blank_gap):
+    columns = {f"col{c}": _column_letter(c + 2) for c in range(n_columns)}
+    parts = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+             '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>']
+    row_number = 1
+    n_formulas = 0
+    for t in range(tables_per_sheet):
+        title = f"{TABLE_TITLES[(sheet_index + t) % len(TABLE_TITLES)]} - SECTOR {sheet_index * tables_per_sheet + t + 1}"
+        table = _table_rows(rng, title, rows_per_table, n_columns)
+        start = row_number
+        offsets = {f"r{i}": start + i for i in range(len(table))}
+        for i, row in enumerate(table):
+            cells = []
+            for c, value in enumerate(row):
+                if value is None:
+                    continue
+                if isinstance(value, tuple):
+                    value = (value[0].format(**columns, **offsets), value[1])
+                    n_formulas += 1
+                cells.append(_cell_xml(f"{_column_letter(c + 1)}{start + i}", value))
+            if cells:
+                parts.append(f'<row r="{start + i}">{"".join(cells)}</row>')
+        # Blank rows between stacked tables, as left by merged title cells and spacing
+        row_number = start + len(table) + blank_gap
+    parts.append("</sheetData></worksheet>")
+    return "".join(parts), n_formulas
+
+
+def make_workbook(path, n_sheets=3, tables_per_sheet=2, rows_per_table=60, n_columns=6, blank_gap=3, seed=0):
+    """
+    Writes a synthetic financial workbook to `path` and returns its formula count.
+
+    Every sheet holds `tables_per_sheet` stacked tables separated by `blank_gap` empty
+    rows, with SUM subtotals and a grand total per column. The sheet XML is written
+    directly (with cached formula values, like a workbook saved by Excel), which is
+    much faster than openpyxl for large tiers.
+    """
+    rng = random.Random(seed)
+    sheet_names = [f"Entidad {i + 1}" for i in range(n_sheets)]
+    n_formulas = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + "".join(
+                f'<Override PartName="/xl/worksheets/sheet{i + 1}.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                for i in range(n_sheets)
+            )
+            + '</Types>'
+        ))
+        zf.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>'
+        ))
+        zf.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + "".join(f'<sheet name="{escape(name)}" sheetId="{i + 1}" r:id="rId{i + 1}"/>'
+                      for i, name in enumerate(sheet_names))
+            + '</sheets></workbook>'
+        ))
+        zf.writestr("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(
+                f'<Relationship Id="rId{i + 1}" '
+                'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                f'Target="worksheets/sheet{i + 1}.xml"/>'
+                for i in range(n_sheets)
+            )
+            + '</Relationships>'
+        ))
+        for i in range(n_sheets):
+            xml, count = _sheet_xml(rng, i, tables_per_sheet, rows_per_table, n_columns, blank_gap)
+            zf.writestr(f"xl/worksheets/sheet{i + 1}.xml", xml)
+            n_formulas += count
+    return n_formulas
+
+
+def _pdf_string(text):
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def _page_lines(rng, page_number, lines_per_page):
+    """
+    Text lines of one report page: a title, a header and table rows with totals.
+    """
+    title = TABLE_TITLES[page_number % len(TABLE_TITLES)]
+    lines = [f"{title} - CUADRO {page_number}", "(Expresado en bolivianos)",
+             f"{'Concepto':<32}" + "".join(f"{month:>16}" for month in MONTHS[:4])]
+    sections = list(SECTIONS)
+    section = sections[page_number % len(sections)]
+    column_sums = [0.0] * 4
+    for i in range(lines_per_page - 4):
+        concept = SECTIONS[section][i % len(SECTIONS[section])]
+        values = [rng.uniform(1_000, 5_000_000) for _ in range(4)]
+        column_sums = [total + value for total, value in zip(column_sums, values)]
+        lines.append(f"{concept:<32}" + "".join(f"{value:>16,.2f}" for value in values))
+    lines.append(f"{'Total ' + section.lower():<32}" + "".join(f"{value:>16,.2f}" for value in column_sums))
+    return lines
+
+
+def make_pdf(path, n_pages=50, lines_per_page=60, seed=0):
+    """
+    Writes a synthetic multi-page PDF of financial tables to `path` (text drawn with
+    the standard Helvetica font, so no font files or extra packages are needed).
+    """
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(n_pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {n_pages} >>")
+    font = 3 + 2 * n_pages
+    for i in range(n_pages):
+        lines = _page_lines(rng, i + 1, lines_per_page)
+        content = "BT /F1 8 Tf 30 810 Td 12 TL " + " ".join(f"{_pdf_string(line)} '" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {4 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+    return n_pages
@@ -0,0 +1,238 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.fake_llm import FakeLLMServer
+from benchmarks.generators import make_pdf, make_workbook
+from utils import openai_client
+from utils.analysis import (analyze_report, build_analysis_prompt, build_csv_output, scan_excel_reports,
+                            scan_pdf_reports)
+from utils.file_parser import parse_excel, parse_pdf
+from utils.formula_graph import workbook_structure
+from utils.retrieval import build_index
+
+API_KEY = "bench"
+
+TIERS = {
+    "small": {"sheets": 3, "tables": 2, "rows": 60, "columns": 6, "pdf_pages": 20},
+    "medium": {"sheets": 10, "tables": 4, "rows": 150, "columns": 12, "pdf_pages": 150},
+    "large": {"sheets": 30, "tables": 6, "rows": 300, "columns": 12, "pdf_pages": 500},
+}
+
+
+def measure(fn, repeat=1, track_memory=True):
+    """
+    Runs `fn` `repeat` times and returns (result, median seconds, peak MB).
+    Peak memory is measured with tracemalloc in one extra run, so its overhead does
+    not distort the timings. Only this process is traced: memory used by worker
+    processes (parallel PDF extraction) is not included.
+    """
+    timings = []
+    result = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    peak_mb = None
+    if track_memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return result, statistics.median(timings), peak_mb
+
+
+def prepare_files(data_dir, tier, spec):
+    """
+    Generates (or reuses) the synthetic workbook and PDF of a tier.
+    """
+    stem = f"{tier}_{spec['sheets']}x{spec['tables']}x{spec['rows']}x{spec['columns']}"
+    xlsx_path = os.path.join(data_dir, f"{stem}.xlsx")
+    pdf_path = os.path.join(data_dir, f"{tier}_{spec['pdf_pages']}p.pdf")
+    if not os.path.exists(xlsx_path):
+        make_workbook(xlsx_path, spec["sheets"], spec["tables"], spec["rows"], spec["columns"])
+    if not os.path.exists(pdf_path):
+        make_pdf(pdf_path, spec["pdf_pages"])
+    return xlsx_path, pdf_path
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        file = io.BytesIO(f.read())
+    file.name = os.path.basename(path)
+    return file
+
+
+def _excel_prompt(data):
+    return build_analysis_prompt(data, "xlsx")
+
+
+def _focused_pdf_prompt(document, title):
+    # No location: the report is found by retrieval alone (the index is kept on the document)
+    report = {"title": title, "location": "", "description": ""}
+    return build_analysis_prompt(document, "pdf", focus_context=title, focus_location=report)
+
+
+def _end_to_end(data, file_type, server, structured_output=False):
+    """
+    Returns the CSV output, the requests made and the share of prompt tokens the
+    (simulated) provider prompt cache served.
+    """
+    before = (server.requests, server.prompt_tokens, server.cached_tokens)
+    analysis_text = analyze_report(data, file_type, API_KEY, map_reduce=True, use_cache=False,
+                                   structured_output=structured_output)
+    prompt_tokens = server.prompt_tokens - before[1]
+    cached_share = (server.cached_tokens - before[2]) / prompt_tokens if prompt_tokens else 0.0
+    return build_csv_output(analysis_text, data), server.requests - before[0], cached_share
+
+
+def run_tier(tier, spec, data_dir, server, latency, repeat, track_memory, structured_output=False):
+    """
+    Benchmarks the stages of one size tier and returns a list of result rows.
+    Local stages run with the fake server answering instantly; the end-to-end runs
+    use the configured model latency.
+    """
+    xlsx_path, pdf_path = prepare_files(data_dir, tier, spec)
+    rows = []
+
+    def record(stage, fn, detail_fn, stage_repeat=repeat):
+        result, seconds, peak_mb = measure(fn, stage_repeat, track_memory)
+        rows.append({"tier": tier, "stage": stage, "seconds": round(seconds, 4),
+                     "peak_mb": round(peak_mb, 1) if peak_mb is not None else None,
+                     "detail": detail_fn(result)})
+        print(f"  {tier:<7} {stage:<22} {seconds:9.3f} s  {rows[-1]['detail']}")
+        return result
+
+    server.latency = 0
+    data = record("parse_excel", lambda: parse_excel(_read(xlsx_path)),
+                  lambda d: f"{sum(len(s['values']) for s in d.values())} filas, "
+                            f"{sum(len(s['formulas']) for s in d.values())} fórmulas")
+    # workbook_structure caches per parsed workbook, so each run gets a fresh parse
+    parsed_copies = [parse_excel(_read(xlsx_path)) for _ in range(max(1, repeat) + int(track_memory))]
+    record("formula_structure", lambda: workbook_structure(parsed_copies.pop()),
+           lambda s: f"{len(s) if s is not None else 0} celdas")
+    record("scan_excel", lambda: scan_excel_reports(data, API_KEY, use_cache=False),
+           lambda text: f"{len(text):,} caracteres")
+    record("analysis_prompt_excel", lambda: _excel_prompt(data), lambda prompt: f"{len(prompt):,} caracteres")
+
+    def parse_full_pdf():
+        document = parse_pdf(_read(pdf_path))
+        document.extract_all()
+        return document
+
+    pdf = record("parse_pdf", parse_full_pdf, lambda d: f"{d.n_pages} páginas, {len(d):,} caracteres")
+    record("scan_pdf", lambda: scan_pdf_reports(pdf, API_KEY, use_cache=False),
+           lambda text: f"{len(text):,} caracteres")
+    record("retrieval_index_pdf", lambda: build_index(pdf),
+           lambda index: f"{len(index)} fragmentos, {len(index.postings)} términos")
+    title = pdf.page(pdf.n_pages // 2).splitlines()[0]
+    pdf.retrieval_index()
+    record("focused_prompt_pdf", lambda: _focused_pdf_prompt(pdf, title),
+           lambda prompt: f"{len(prompt):,} caracteres ({title})")
+
+    server.latency = latency
+    for stage, document, file_type in (("end_to_end_excel", data, "xlsx"), ("end_to_end_pdf", pdf, "pdf")):
+        record(stage, lambda: _end_to_end(document, file_type, server, structured_output),
+               lambda result: f"{len(result[0]['csv_df']) if result[0]['csv_df'] is not None else 0} filas CSV, "
+                              f"{result[1]} solicitudes, {result[2]:.0%} del prompt en caché",
+               stage_repeat=1)
+    return rows
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def results_table(rows, baseline=None):
+    """
+    Markdown table of the results; with a baseline (a previous results file), adds
+    the time ratio per tier/stage (< 1.00 is faster).
+    """
+    base = {(row["tier"], row["stage"]): row for row in (baseline or {}).get("results", [])}
+    header = "| Tier | Etapa | Tiempo (s) | Memoria pico (MB) | Detalle |"
+    divider = "|---|---|---:|---:|---|"
+    if base:
+        header += " vs. base |"
+        divider += "---:|"
+    lines = [header, divider]
+    for row in rows:
+        peak = f"{row['peak_mb']:.1f}" if row["peak_mb"] is not None else "-"
+        line = f"| {row['tier']} | {row['stage']} | {row['seconds']:.3f} | {peak} | {row['detail']} |"
+        if base:
+            previous = base.get((row["tier"], row["stage"]))
+            ratio = row["seconds"] / previous["seconds"] if previous and previous["seconds"] else None
+            line += f" {ratio:.2f}x |" if ratio is not None else " - |"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mide el rendimiento del pipeline (lectura, prompts y análisis completo) sin conexión, "
+                    "con archivos sintéticos y un servidor local compatible con OpenAI."
+    )
+    parser.add_argument("--tiers", nargs="+", choices=list(TIERS), default=["small", "medium"],
+                        help="Tamaños a medir")
+    parser.add_argument("--latency", type=float, default=0.5, help="Latencia simulada del modelo (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Velocidad de generación simulada")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de las etapas locales (mediana)")
+    parser.add_argument("--no-memory", action="store_true", help="No mide la memoria pico (más rápido)")
+    parser.add_argument("--data-dir", default=None, help="Carpeta donde generar/reutilizar los archivos sintéticos")
+    parser.add_argument("--structured", action="store_true",
+                        help="Análisis completo con salida estructurada (JSON normalizado) en lugar de CSV")
+    parser.add_argument("--output", default=None, help="Guarda los resultados en este archivo JSON")
+    parser.add_argument("--compare", default=None, help="Archivo JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    # Keep caches out of the measurements
+    os.environ["LLM_CACHE_DISABLED"] = "1"
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="bench_data_")
+    os.makedirs(data_dir, exist_ok=True)
+
+    rows = []
+    with FakeLLMServer(latency=args.latency, tokens_per_second=args.tokens_per_second) as server:
+        openai_client.configure(base_url=server.base_url, max_retries=0)
+        try:
+            for tier in args.tiers:
+                rows.extend(run_tier(tier, TIERS[tier], data_dir, server, args.latency, args.repeat,
+                                     not args.no_memory, args.structured))
+        finally:
+            openai_client.configure()
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {"latency": args.latency, "tokens_per_second": args.tokens_per_second,
+                     "repeat": args.repeat, "structured": args.structured, "tiers": {tier: TIERS[tier] for tier in args.tiers}},
+        "results": rows,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print()
+    print(results_table(rows, baseline))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import pandas as pd
+
+from benchmarks.generators import make_pdf
+from utils import analysis
+from utils.analysis import (CONSOLIDATION_SYSTEM_PROMPT, ERROR_PREFIX, _pdf_page_blocks, analyze_report_map_reduce,
+                            extract_csv_block, is_partial, is_throttled)
+from utils.pdf_document import PdfDocument
+from utils.token_budget import MIN_BLOCK_TOKENS
+
+THROTTLED = f"{ERROR_PREFIX}: Error code: 429 - Rate limit reached"
+
+
+def _workbook():
+    return {
+        sheet: {"values": pd.DataFrame({0: ["Concepto", "Caja", "Bancos"], 1: ["Monto", 100, 250]}),
+                "formulas": {}}
+        for sheet in ("Hoja1", "Hoja2", "Hoja3")
+    }
+
+
+def _fake_requests(monkeypatch, failing=None, error=None):
+    system_prompts = []
+
+    def request(api_key, full_prompt, use_cache=True, local_validation=True, structured_output=False,
+                system_prompt=None):
+        if failing and failing in full_prompt:
+            return error
+        if "INFORME FINAL CONSOLIDADO" in full_prompt:
+            system_prompts.append(system_prompt)
+            # The model writes a CSV of its own despite the instructions
+            return "## Resumen\n\n```csv\nHoja,Valor\nResumen,999\n```"
+        return "Parte\n\n```csv\nHoja,Valor\nH,1\n```"
+    monkeypatch.setattr(analysis, "_request_analysis", request)
+    return system_prompts
+
+
+def test_consolidated_csv_survives_a_csv_in_the_summary(monkeypatch):
+    system_prompts = _fake_requests(monkeypatch)
+    result = analyze_report_map_reduce(_workbook(), "xlsx", "key", max_chunk_chars=80, use_cache=False)
+    assert system_prompts == [CONSOLIDATION_SYSTEM_PROMPT]
+    assert "Resumen,999" not in result
+    csv_content = extract_csv_block(result)
+    assert csv_content.splitlines() == ["Hoja,Valor", "H,1", "H,1", "H,1"]
+
+
+def test_throttled_chunk_fails_map_reduce(monkeypatch):
+    _fake_requests(monkeypatch, "PARTE 2 DE 3", THROTTLED)
+    result = analyze_report_map_reduce(_workbook(), "xlsx", "key", max_chunk_chars=80, use_cache=False)
+    assert is_throttled(result)
+
+
+def test_failed_chunk_marks_the_result_partial(monkeypatch):
+    _fake_requests(monkeypatch, "PARTE 2 DE 3", f"{ERROR_PREFIX}: invalid request")
+    result = analyze_report_map_reduce(_workbook(), "xlsx", "key", max_chunk_chars=80, use_cache=False)
+    assert is_partial(result)
+    assert "1 de 3 partes" in result
+    assert extract_csv_block(result).splitlines() == ["Hoja,Valor", "H,1", "H,1"]
+
+
+def test_pdf_prompt_extracts_only_the_pages_that_fit(tmp_path):
+    path = tmp_path / "report.pdf"
+    make_pdf(str(path), n_pages=12, lines_per_page=40)
+    document = PdfDocument(path.read_bytes())
+    blocks = _pdf_page_blocks(document, budget=2 * 3 * MIN_BLOCK_TOKENS)
+    kept = len(blocks) - 1
+    extracted = [i for i, text in enumerate(document._pages) if text is not None]
+    # Pages are measured in batches: the one that no longer fits was extracted, later ones were not
+    assert extracted == list(range(len(extracted)))
+    assert 0 < kept <= len(extracted) < document.n_pages
+    assert "OMITIDAS" in blocks[-1] and f"{kept + 1}-12" in blocks[-1]
+
+    assert len(_pdf_page_blocks(document)) == 12
+    assert None not in document._pages
@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from utils import batch
+from utils.analysis import ERROR_PREFIX, PARTIAL_PREFIX
+from utils.batch import JobManifest, process_parsed_file
+
+PARTIAL = f"{PARTIAL_PREFIX}: 1 de 2 partes sin analizar\n\nResumen\n\n```csv\nHoja,Valor\nH,1\n```"
+
+
+def _workbook():
+    return {"Hoja1": {"values": pd.DataFrame({0: ["Caja"], 1: [100]}), "formulas": {}}}
+
+
+def test_partial_analysis_is_not_done(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "analyze_report", lambda *args, **kwargs: PARTIAL)
+    manifest = JobManifest(str(tmp_path / "manifest.json"))
+    result = process_parsed_file("a.xlsx", _workbook(), str(tmp_path / "a"), "key", manifest,
+                                 local_validation=False)
+    assert result["partial"] and result["rows"] == 1
+
+
+def test_partial_report_is_recorded(tmp_path, monkeypatch):
+    scan = '[{"title": "Balance", "location": "Hoja1", "description": ""}]'
+    monkeypatch.setattr(batch, "scan_excel_reports", lambda *args, **kwargs: scan)
+    monkeypatch.setattr(batch, "analyze_report", lambda *args, **kwargs: PARTIAL)
+    manifest = JobManifest(str(tmp_path / "manifest.json"))
+    result = process_parsed_file("a.xlsx", _workbook(), str(tmp_path / "a"), "key", manifest,
+                                 per_report=True, local_validation=False)
+    assert result["partial"]
+    assert [report["status"] for report in manifest.entry("a.xlsx")["reports"].values()] == ["partial"]
+
+
+def test_model_error_fails_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "analyze_report", lambda *args, **kwargs: f"{ERROR_PREFIX}: boom")
+    manifest = JobManifest(str(tmp_path / "manifest.json"))
+    with pytest.raises(RuntimeError, match="boom"):
+        process_parsed_file("a.xlsx", _workbook(), str(tmp_path / "a"), "key", manifest)
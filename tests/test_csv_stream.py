@@ -0,0 +1,55 @@
+from utils.csv_stream import IncrementalCsvDecoder
+
+RESPONSE = (
+    "## Resumen Ejecutivo\nTexto previo.\n\n"
+    "```csv\n"
+    "Hoja,Concepto_Final,Valor,Relacion_Celdas\n"
+    "H1,Caja,100,Dato directo\n"
+    "H1,\"Nota con, coma\",200,\"Suma(B10:B19)\"\n"
+    "H1,\"Concepto en\ndos líneas\",300,Dato directo\n"
+    "```\n"
+    "Texto final.\n"
+)
+
+
+def _decode(deltas):
+    decoder = IncrementalCsvDecoder()
+    rows = []
+    for delta in deltas:
+        rows.extend(decoder.feed(delta))
+    rows.extend(decoder.finish())
+    return decoder, rows
+
+
+def test_rows_do_not_depend_on_delta_boundaries():
+    expected_rows = [
+        ["H1", "Caja", "100", "Dato directo"],
+        ["H1", "Nota con, coma", "200", "Suma(B10:B19)"],
+        ["H1", "Concepto en\ndos líneas", "300", "Dato directo"],
+    ]
+    for size in (1, 2, 3, 7, len(RESPONSE)):
+        decoder, rows = _decode([RESPONSE[i:i + size] for i in range(0, len(RESPONSE), size)])
+        assert decoder.header == ["Hoja", "Concepto_Final", "Valor", "Relacion_Celdas"]
+        assert rows == expected_rows
+        assert decoder.narrative == "## Resumen Ejecutivo\nTexto previo.\n\nTexto final.\n"
+
+
+def test_rows_are_returned_as_their_lines_complete():
+    decoder = IncrementalCsvDecoder()
+    assert decoder.feed("Intro\n```csv\nA,B\n1,") == []
+    assert decoder.feed("2\n3") == [["1", "2"]]
+    assert decoder.feed(",4\n") == [["3", "4"]]
+
+
+def test_cut_stream_keeps_complete_rows():
+    decoder, rows = _decode(["```csv\nA,B\n1,2\n3,4"])
+    assert rows == [["1", "2"], ["3", "4"]]
+    assert decoder.csv_text() == "A,B\n1,2\n3,4"
+    df = decoder.dataframe()
+    assert list(df.columns) == ["A", "B"]
+    assert df.shape == (2, 2)
+
+
+def test_short_rows_are_padded_to_the_header():
+    decoder, _ = _decode(["```csv\nA,B,C\n1,2\n```"])
+    assert decoder.dataframe().iloc[0].tolist() == ["1", "2", None]
@@ -0,0 +1,70 @@
+import datetime
+import io
+
+import openpyxl
+import pandas as pd
+
+from utils import file_parser
+from utils.file_parser import parse_excel
+
+
+def _workbook_file():
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Balance"
+    ws.append(["BALANCE GENERAL"])
+    ws.append([])
+    ws.append(["Concepto", "Monto", "Fecha"])
+    ws.append(["Caja", 100, datetime.datetime(2023, 12, 31)])
+    ws.append(["Bancos", 250.5, datetime.datetime(2024, 1, 31)])
+    ws.append(["Total", "=SUM(B4:B5)"])
+    file = io.BytesIO()
+    wb.save(file)
+    file.seek(0)
+    return file
+
+
+def test_values_and_formulas():
+    data = parse_excel(_workbook_file())
+    values = data["Balance"]["values"]
+    assert data["Balance"]["formulas"] == {"B6": "=SUM(B4:B5)"}
+    assert values.shape == (6, 3)
+    assert values.iloc[1].isna().all()
+    assert values.iloc[3, 0] == "Caja"
+    assert values.iloc[4, 1] == 250.5
+
+
+def test_public_reader_fallback(monkeypatch):
+    expected = parse_excel(_workbook_file())
+    monkeypatch.setattr(file_parser, "_private_reader_available", lambda wb: False)
+    data = parse_excel(_workbook_file())
+    assert data["Balance"]["formulas"] == expected["Balance"]["formulas"]
+    pd.testing.assert_frame_equal(data["Balance"]["values"], expected["Balance"]["values"])
+
+
+def _mixed_workbook_file():
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Balance"
+    ws.append(["BALANCE GENERAL", None, None, "Nota"])
+    ws.append([])
+    ws.append(["Concepto", "Monto", "Fecha"])
+    for i in range(12):
+        # A code stored as text ("12") among the amounts, and a date column
+        ws.append([f"Cuenta {i}", "12" if i == 3 else (None if i == 5 else i * 10),
+                   datetime.datetime(2023, 1 + i, 1) if i < 8 else None])
+    ws.append(["Total", 660.5, "Fecha"])
+    file = io.BytesIO()
+    wb.save(file)
+    file.seek(0)
+    return file
+
+
+def test_chunking_does_not_change_types():
+    expected = parse_excel(_mixed_workbook_file())["Balance"]["values"]
+    assert expected.iloc[6, 1] == "12"
+    assert expected.iloc[3, 1] == 0 and type(expected.iloc[3, 1]) is int
+    for chunk_rows in (2, 4):
+        values = parse_excel(_mixed_workbook_file(), chunk_rows=chunk_rows)["Balance"]["values"]
+        pd.testing.assert_frame_equal(values, expected)
+        assert [type(value) for value in values[1]] == [type(value) for value in expected[1]]
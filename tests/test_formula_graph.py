@@ -0,0 +1,81 @@
+import gc
+
+import numpy as np
+import pandas as pd
+
+from utils import formula_graph
+from utils.formula_graph import (FormulaGraph, FormulaStructure, apply_formula_structure, structure_hint,
+                                  workbook_structure)
+from utils.validation import validate_report
+
+
+def _workbook():
+    values = pd.DataFrame({
+        0: ["Estado", None, None, None, "Ingresos", "Costos", "Utilidad", None, None,
+            "Ventas", "Otros ingresos", "Descuentos", "Ingresos netos"],
+        1: [None, None, None, None, 100.0, 40.0, 60.0, None, None, 500.0, 20.0, 70.0, 450.0],
+    })
+    formulas = {"B7": "=B5-B6", "B13": "=B10+B11-B12"}
+    return {"H1": {"values": values, "formulas": formulas}}
+
+
+def test_relation_text_keeps_minus_signs():
+    assert list(FormulaGraph.relation_text(["=$B$5-$B$6", "=SUM(B10:B12)"])) == ["B5-B6", "Suma(B10:B12)"]
+
+
+def test_structure_of_differences_validates():
+    data = _workbook()
+    structure = FormulaGraph(data).structure()
+    totals = structure[structure["Es_Total"] == "SI"].set_index("Celda")
+    assert totals.loc["B7", "Relacion_Celdas"] == "B5-B6"
+    assert totals.loc["B13", "Relacion_Celdas"] == "B10+B11-B12"
+
+    rows = structure.assign(Concepto_Final=structure["Concepto"], Origen_Dato="H1:" + structure["Celda"])
+    csv_df, matched = apply_formula_structure(rows.drop(columns=["Padre"]), FormulaStructure(FormulaGraph(data)))
+    assert matched == len(structure)
+    validated, summary = validate_report(csv_df)
+    assert summary["totals"] == summary["validated"] == 2
+
+
+def test_structure_cache_follows_the_workbook():
+    formula_graph._STRUCTURE_CACHE.clear()
+    data = _workbook()
+    structure = workbook_structure(data)
+    assert workbook_structure(data) is structure
+    assert len(formula_graph._STRUCTURE_CACHE) == 1
+    del data
+    gc.collect()
+    assert not formula_graph._STRUCTURE_CACHE
+    # A new workbook never gets the structure of a collected one
+    other = _workbook()
+    other["H1"]["values"].loc[4, 1] = np.nan
+    assert workbook_structure(other) is not structure
+
+
+def test_formulas_of_one_shape_keep_their_own_references():
+    values = pd.DataFrame({0: ["a", "b", "c"], 1: [1.0, 2.0, 3.0]})
+    data = {
+        "Hoja1": {"values": values, "formulas": {}},
+        "Hoja2": {"values": values.copy(), "formulas": {}},
+        "Resumen": {"values": values.copy(), "formulas": {"B1": "=Hoja1!B1+Hoja2!B2", "B2": "=Hoja2!B3-Hoja1!B2"}},
+    }
+    graph = FormulaGraph(data)
+    assert graph.precedents("Resumen", "B1") == [("Hoja1", 1, 2, 1, 2, 1), ("Hoja2", 2, 2, 2, 2, 1)]
+    assert graph.precedents("Resumen", "B2") == [("Hoja2", 3, 2, 3, 2, 1), ("Hoja1", 2, 2, 2, 2, -1)]
+
+
+def test_structure_rows_are_built_for_the_cells_asked_for():
+    data = _workbook()
+    structure = workbook_structure(data)
+    assert len(structure) == len(FormulaGraph(data).structure())
+    assert structure_hint(structure, "H1").splitlines() == [
+        "B7 Utilidad = B5-B6 | Niveles: Utilidad",
+        "B13 Ingresos netos = B10+B11-B12 | Niveles: Ingresos netos",
+    ]
+    assert structure_hint(structure, "H1", rows=range(9, 13)).splitlines() == [
+        "B13 Ingresos netos = B10+B11-B12 | Niveles: Ingresos netos",
+    ]
+    positions = structure.positions([" h1", "H1", "Otra"], ["B11", "A1", "B11"])
+    assert positions[1:].tolist() == [-1, -1]
+    row = structure.frame(positions[:1]).iloc[0]
+    assert (row["Celda"], row["Concepto"], row["Padre"]) == ("B11", "Otros ingresos", "B13")
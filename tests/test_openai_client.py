@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from benchmarks.fake_llm import FakeLLMServer
+from utils import openai_client
+from utils.rate_limit import RateLimiter
+from utils.response_cache import ResponseCache
+
+MESSAGES = [{"role": "user", "content": "Analiza el reporte"}]
+
+
+def _completion(content="Listo"):
+    return {"id": "prueba", "object": "chat.completion", "created": int(time.time()), "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}]}
+
+
+class ScriptedServer:
+    """
+    OpenAI-compatible endpoint that answers each request with the next scripted
+    reply: (status, body, headers) for a JSON response, or a list of stream chunks.
+    """
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.times = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                server.times.append(time.monotonic())
+                reply = server.replies.pop(0)
+                if isinstance(reply, list):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    for chunk in reply:
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                    return
+                status, body, headers = reply
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    monkeypatch.setattr(openai_client, "get_response_cache", lambda: cache)
+    yield cache
+    openai_client.configure()
+
+
+def _error(status, **headers):
+    return status, {"error": {"message": "Rate limit reached", "type": "requests", "code": None}}, headers
+
+
+def test_throttled_and_server_errors_are_retried_with_the_server_delay(cache):
+    with ScriptedServer([_error(429, **{"retry-after-ms": "200"}), _error(500, **{"retry-after-ms": "100"}),
+                         (200, _completion(), {})]) as server:
+        openai_client.configure(base_url=server.base_url, max_retries=2)
+        response = openai_client.chat_completion("key", model="gpt-4o", messages=MESSAGES)
+    assert response.choices[0].message.content == "Listo"
+    assert len(server.times) == 3
+    assert server.times[1] - server.times[0] >= 0.2
+    assert server.times[2] - server.times[1] >= 0.1
+
+
+def test_throttling_is_raised_once_the_retries_run_out(cache):
+    with ScriptedServer([_error(429, **{"retry-after-ms": "10"})] * 2) as server:
+        openai_client.configure(base_url=server.base_url, max_retries=1)
+        with pytest.raises(openai.RateLimitError):
+            openai_client.chat_completion("key", model="gpt-4o", messages=MESSAGES)
+    assert len(server.times) == 2
+
+
+def test_finished_stream_is_cached(cache):
+    with FakeLLMServer(latency=0, csv_rows=5) as server:
+        openai_client.configure(base_url=server.base_url, max_retries=0)
+        text = "".join(openai_client.chat_completion_stream("key", model="gpt-4o", messages=MESSAGES))
+        again = "".join(openai_client.chat_completion_stream("key", model="gpt-4o", messages=MESSAGES))
+    assert server.requests == 1
+    assert again == text
+    assert "```csv" in text
+
+
+def test_truncated_stream_is_not_cached(cache):
+    def chunk(content):
+        return {"id": "prueba", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+                "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]}
+
+    with ScriptedServer([[chunk("Resumen "), chunk("incom")], (200, _completion("Resumen completo"), {})]) as server:
+        openai_client.configure(base_url=server.base_url, max_retries=0)
+        parts = []
+        with pytest.raises(ConnectionError):
+            for part in openai_client.chat_completion_stream("key", model="gpt-4o", messages=MESSAGES):
+                parts.append(part)
+        assert parts == ["Resumen ", "incom"]
+        key = ResponseCache.make_key(model="gpt-4o", messages=MESSAGES)
+        assert cache.get(key) is None
+        response = openai_client.chat_completion("key", model="gpt-4o", messages=MESSAGES)
+    assert response.choices[0].message.content == "Resumen completo"
+    assert len(server.times) == 2
+
+
+def test_rate_limiter_waits_for_a_request_to_leave_the_window():
+    limiter = RateLimiter(requests_per_minute=2, window=0.3)
+    assert limiter.acquire() < 0.05
+    assert limiter.acquire() < 0.05
+    assert limiter.acquire() >= 0.25
+
+
+def test_rate_limiter_waits_for_token_budget():
+    limiter = RateLimiter(tokens_per_minute=100, window=0.3)
+    limiter.acquire(80)
+    assert limiter.acquire(20) < 0.05
+    assert limiter.acquire(30) >= 0.25
+    assert limiter.usage() == (1, 30)
+    # A request over the whole budget still goes through on an empty window
+    time.sleep(0.35)
+    assert limiter.acquire(500) < 0.05
+    assert limiter.usage() == (1, 100)
+
+
+def test_rate_limits_are_applied_to_the_token_count_of_the_request(cache):
+    with FakeLLMServer(latency=0, csv_rows=5) as server:
+        openai_client.configure(base_url=server.base_url, max_retries=0, tokens_per_minute=1000)
+        openai_client.chat_completion("key", use_cache=False, model="gpt-4o", messages=MESSAGES, max_tokens=300)
+        requests, tokens = openai_client._rate_limiter.usage()
+    assert requests == 1
+    assert 300 < tokens < 320
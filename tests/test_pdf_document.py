@@ -0,0 +1,41 @@
+import io
+
+from benchmarks.generators import make_pdf
+from utils.file_parser import parse_pdf
+from utils.parse_cache import ParseCache
+from utils.pdf_document import PdfDocument, _page_runs
+
+
+def test_page_runs():
+    assert _page_runs([]) == []
+    assert _page_runs([2, 3, 4, 7, 9, 10]) == [(2, 5), (7, 8), (9, 11)]
+
+
+def test_parallel_extraction_skips_cached_pages(tmp_path):
+    path = tmp_path / "report.pdf"
+    make_pdf(str(path), n_pages=12, lines_per_page=20)
+    pdf_bytes = path.read_bytes()
+    expected = PdfDocument(pdf_bytes)
+    expected.extract_all()
+
+    document = PdfDocument(pdf_bytes, workers=2, parallel_min_pages=2)
+    for i in (0, 1, 5, 11):
+        document.page(i)
+    document.extract_all()
+    assert str(document) == str(expected)
+    assert document._grids == expected._grids
+
+
+def test_retrieval_index_is_stored_in_the_disk_cache(tmp_path):
+    path = tmp_path / "report.pdf"
+    make_pdf(str(path), n_pages=4, lines_per_page=20)
+    file = io.BytesIO(path.read_bytes())
+    cache = ParseCache(disk_dir=str(tmp_path / "cache"))
+    document = cache.get_or_parse(file, parse_pdf, "pdf")
+    index = document.retrieval_index()
+
+    # A new process only has the disk tier
+    restored = ParseCache(disk_dir=str(tmp_path / "cache")).get_or_parse(file, parse_pdf, "pdf")
+    assert None in restored._indexes
+    assert len(restored.retrieval_index()) == len(index)
+    assert str(restored) == str(document)
@@ -0,0 +1,49 @@
+from utils.pdf_layout import page_grid, parse_number
+
+
+def test_parse_number():
+    assert parse_number("1.234,56") == 1234.56
+    assert parse_number("1,234.56") == 1234.56
+    assert parse_number("1,234") == 1234
+    assert parse_number("12,5") == 12.5
+    assert parse_number("(500)") == -500
+    assert parse_number("-3.2") == -3.2
+    assert parse_number("2023") == 2023
+    assert parse_number("1.234.567") == 1234567
+    assert parse_number("$ 1,500") == 1500
+    for text in ("Total", "Nota 3", "2023-12", ""):
+        assert parse_number(text) == text
+
+
+def _runs(rows, size=10.0):
+    # Labels printed word by word, right-aligned amounts, one baseline per row
+    runs = []
+    for i, (label, *amounts) in enumerate(rows):
+        y = 700 - i * 14
+        x = 50
+        for word in label.split():
+            runs.append((x, y, size, word))
+            x += (len(word) + 1) * size * 0.5
+        for j, amount in enumerate(amounts):
+            runs.append((300 + j * 100 - len(amount) * size * 0.5, y, size, amount))
+    return runs
+
+
+def test_page_grid():
+    grid = page_grid(_runs([
+        ("Concepto", "2023", "2022"),
+        ("Caja", "1.500", "900"),
+        ("Bancos", "12.345,50", "(200)"),
+        ("Total Activo", "13.845,50", "700"),
+    ]))
+    assert grid == [
+        ["Concepto", 2023, 2022],
+        ["Caja", 1500, 900],
+        ["Bancos", 12345.5, -200],
+        ["Total Activo", 13845.5, 700],
+    ]
+
+
+def test_page_grid_without_table():
+    runs = [(50, 700 - i * 14, 10.0, text) for i, text in enumerate(["Informe anual", "Notas", "Página 3"])]
+    assert page_grid(runs) is None
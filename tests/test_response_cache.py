@@ -0,0 +1,59 @@
+from utils import response_cache
+from utils.response_cache import ResponseCache
+
+MESSAGES = [{"role": "user", "content": "Analiza el reporte"}]
+
+
+def test_entries_expire_after_the_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60)
+    cache.put("a", "respuesta")
+    now[0] += 59
+    assert cache.get("a") == "respuesta"
+    now[0] += 2
+    assert cache.get("a") is None
+    # Reading an entry does not extend its life
+    cache.put("b", "otra")
+    now[0] += 40
+    assert cache.get("b") == "otra"
+    now[0] += 40
+    assert cache.get("b") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=250)
+    for key in "abc":
+        now[0] += 1
+        cache.put(key, key * 100)
+    assert cache.get("a") is None
+    now[0] += 1
+    assert cache.get("b") == "b" * 100
+    now[0] += 1
+    cache.put("d", "d" * 100)
+    assert cache.get("c") is None
+    assert cache.get("b") == "b" * 100
+    assert cache.get("d") == "d" * 100
+
+
+def test_key_depends_on_every_request_parameter():
+    base = ResponseCache.make_key(model="gpt-4o", messages=MESSAGES, temperature=0, max_tokens=4096)
+    assert base == ResponseCache.make_key(max_tokens=4096, temperature=0, messages=list(MESSAGES), model="gpt-4o")
+    others = {
+        ResponseCache.make_key(model="gpt-4o", messages=MESSAGES, temperature=0, max_tokens=8192),
+        ResponseCache.make_key(model="gpt-4o", messages=MESSAGES, temperature=0),
+        ResponseCache.make_key(model="gpt-4o", messages=MESSAGES, temperature=0, max_tokens=4096,
+                               response_format={"type": "json_object"}),
+        ResponseCache.make_key(model="gpt-4o", messages=MESSAGES, temperature=0, max_tokens=4096,
+                               response_format={"type": "json_schema", "json_schema": {"name": "informe"}}),
+        ResponseCache.make_key(model="gpt-4o-mini", messages=MESSAGES, temperature=0, max_tokens=4096),
+    }
+    assert base not in others
+    assert len(others) == 5
+
+
+def test_disabled_cache(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_DISABLED", "1")
+    assert response_cache.get_response_cache() is None
@@ -0,0 +1,61 @@
+from benchmarks.generators import make_pdf
+from utils.pdf_document import PdfDocument
+from utils.retrieval import MIN_SCORE_RATIO, RetrievalIndex, tokenize
+
+
+def _index(texts):
+    return RetrievalIndex([{"page": page, "label": f"Página {page + 1}", "text": text, "terms": text, "table": False}
+                           for page, text in enumerate(texts)])
+
+
+def test_tokenize_folds_accents_and_plurals():
+    assert tokenize("Balance General de las Compañías, año 2023") == ["balance", "general", "compania", "ano", "2023"]
+    assert tokenize("Estados Financieros: ACTIVOS corrientes") == ["estado", "financiero", "activo", "corriente"]
+    # Amounts and one-letter words are not terms; short plurals keep their "s"
+    assert tokenize("Total Bs 1.234,56 y 12345 en 5 mes") == ["total", "bs", "5", "mes"]
+    assert tokenize("Nota 12: gastos") == ["nota", "12", "gasto"]
+
+
+def test_weak_matches_are_cut_off():
+    index = _index([
+        "Estado de resultados\nIngresos por ventas\nCosto de ventas\nUtilidad bruta",
+        "Estado de flujo de efectivo\nActividades de operación",
+        "Notas a los estados financieros",
+    ])
+    query = "Estado de resultados: ingresos y costo de ventas"
+    scores = index.scores(query)
+    # The other statements only share "estado" with the query
+    assert 0 < scores[1] < scores[0] * MIN_SCORE_RATIO
+    assert 0 < scores[2] < scores[0] * MIN_SCORE_RATIO
+    assert index.search(query) == [0]
+    assert index.search("inventario") == []
+
+
+def test_selected_chunks_include_neighbours_and_located_pages():
+    texts = [f"Página de relleno número {i}\nTexto general" for i in range(10)]
+    texts[4] = "Balance general\nActivo corriente\nDisponibilidades"
+    index = _index(texts)
+    assert index.search("Balance general: activo corriente") == [4]
+    assert index.select("Balance general: activo corriente") == [3, 4, 5]
+    assert index.select("Balance general: activo corriente", neighbours=0, pages=(9,)) == [4, 9]
+    assert index.select("Balance general: activo corriente", neighbours=2, pages=(0,)) == [0, 1, 2, 3, 4, 5, 6]
+
+
+def test_document_index_is_built_once_per_sheet_format(tmp_path):
+    path = tmp_path / "report.pdf"
+    make_pdf(str(path), n_pages=3, lines_per_page=20)
+    document = PdfDocument(path.read_bytes())
+    updates = []
+    document.on_update = updates.append
+
+    index = document.retrieval_index()
+    assert len(index) >= 3
+    assert updates == [document]
+    assert document.retrieval_index() is index
+    assert updates == [document]
+
+    cells_index = document.retrieval_index("cells")
+    assert cells_index is not index
+    assert len(updates) == 2
+    assert document.retrieval_index("cells") is cells_index
+    assert set(document._indexes) == {None, "cells"}
@@ -0,0 +1,34 @@
+import pandas as pd
+
+from utils import revisions
+from utils.analysis import ERROR_PREFIX, PARTIAL_PREFIX
+from utils.revisions import RevisionStore, analyze_workbook_incremental
+
+
+def _workbook():
+    return {
+        sheet: {"values": pd.DataFrame({0: ["Caja", "Bancos"], 1: [100, 250]}), "formulas": {}}
+        for sheet in ("Activos", "Pasivos", "Ventas")
+    }
+
+
+def test_failed_and_partial_reports_are_retried(tmp_path, monkeypatch):
+    replies = {"Activos": "Resumen\n\n```csv\nHoja,Valor\nA,1\n```",
+               "Pasivos": f"{PARTIAL_PREFIX}: 1 de 2 partes sin analizar\n\n```csv\nHoja,Valor\nP,1\n```",
+               "Ventas": f"{ERROR_PREFIX}: invalid request"}
+    analyzed = []
+
+    def analyze(data, file_type, api_key, focus_context=None, **kwargs):
+        analyzed.append(focus_context)
+        return replies[focus_context]
+    monkeypatch.setattr(revisions, "analyze_report", analyze)
+    store = RevisionStore(str(tmp_path))
+
+    first = analyze_workbook_incremental(_workbook(), "balance.xlsx", "key", store=store, max_workers=1)
+    assert first["failed"] == ["Ventas"] and first["partial"] == ["Pasivos"]
+    assert [report["title"] for report in store.load(first["key"])["reports"]] == ["Activos"]
+
+    analyzed.clear()
+    second = analyze_workbook_incremental(_workbook(), "balance.xlsx", "key", store=store, max_workers=1)
+    assert second["reused"] == ["Activos"]
+    assert sorted(analyzed) == ["Pasivos", "Ventas"]
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from utils import scheduler
+from utils.analysis import ERROR_PREFIX
+from utils.scheduler import analyze_reports
+
+THROTTLED = f"{ERROR_PREFIX}: Error code: 429 - Rate limit reached"
+ANALYSIS = "## Resumen\n\n```csv\nHoja,Valor\nHoja1,100\n```"
+
+
+def _workbook():
+    return {"Hoja1": {"values": pd.DataFrame({0: ["Concepto", "Caja"], 1: ["Monto", 100]}), "formulas": {}}}
+
+
+def _fake_analyzer(monkeypatch, replies):
+    calls = []
+    sleeps = []
+
+    def analyze_report(data, file_type, api_key, focus_context=None, **kwargs):
+        calls.append(focus_context)
+        return replies[focus_context].pop(0)
+    monkeypatch.setattr(scheduler, "analyze_report", analyze_report)
+    monkeypatch.setattr(scheduler.time, "sleep", sleeps.append)
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: 1.0)
+    return calls, sleeps
+
+
+def test_throttled_report_is_retried_with_backoff(monkeypatch):
+    calls, sleeps = _fake_analyzer(monkeypatch, {"Balance": [THROTTLED, THROTTLED, ANALYSIS]})
+    [result] = analyze_reports(_workbook(), "xlsx", "key", [{"id": 1, "title": "Balance"}], local_validation=False)
+    assert calls == ["Balance"] * 3
+    assert sleeps == [scheduler.RETRY_BASE_SECONDS, scheduler.RETRY_BASE_SECONDS * 2]
+    assert result["attempts"] == 3
+    assert not result["error"]
+    assert result["analysis"] == ANALYSIS
+    assert result["csv_output"] is not None
+
+
+def test_report_throttled_on_every_attempt_fails(monkeypatch):
+    calls, sleeps = _fake_analyzer(monkeypatch, {"Balance": [THROTTLED] * 2, "Resultados": [ANALYSIS]})
+    results = analyze_reports(_workbook(), "xlsx", "key", [{"id": 1, "title": "Balance"},
+                                                           {"id": 2, "title": "Resultados"}],
+                              max_attempts=2, local_validation=False)
+    results = {result["report"]["title"]: result for result in results}
+    assert calls.count("Balance") == 2
+    assert len(sleeps) == 1
+    assert results["Balance"]["error"]
+    assert results["Balance"]["csv_output"] is None
+    assert results["Balance"]["attempts"] == 2
+    assert not results["Resultados"]["error"]
+    assert results["Resultados"]["attempts"] == 1
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from utils.serializer import estimate_table_chars, serialize_table, sheet_size_stats
+
+
+def _sheet(n_rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        0: [f"Concepto {i % 40}" for i in range(n_rows)],
+        1: rng.normal(1e6, 2e5, n_rows).round(2),
+        2: rng.integers(0, 1000, n_rows),
+    })
+
+
+def test_small_sheets_are_measured_exactly():
+    df = _sheet(50)
+    assert estimate_table_chars(df) == len(serialize_table(df))
+
+
+def test_large_sheets_are_estimated():
+    df = _sheet(5000)
+    actual = len(serialize_table(df))
+    assert abs(estimate_table_chars(df) - actual) <= 0.02 * actual
+
+
+def test_sheet_size_stats():
+    stats = sheet_size_stats(_sheet(5000), "tsv")
+    assert stats["format"] == "tsv"
+    assert 0 < stats["compact_chars"] < stats["original_chars"]
+    assert 0 < stats["reduction"] < 1
@@ -0,0 +1,81 @@
+import json
+
+from benchmarks.fake_llm import structured_reply
+from utils.structured_output import CSV_COLUMNS, _load_payload, expand_rows, expand_structured
+
+LEVELS = slice(CSV_COLUMNS.index("Nivel_1"), CSV_COLUMNS.index("Nivel_5") + 1)
+ORIGIN = CSV_COLUMNS.index("Origen_Dato")
+
+
+def _payload(nodes, rows):
+    return {"informe": "## Resumen", "contextos": [{"id": 1, "hoja": "Hoja1", "entidad": "Empresa", "anio": "2023",
+                                                   "mes": "Dic", "moneda": "BOB"}],
+            "nodos": nodes, "filas": rows}
+
+
+def _row(node, origin="B10", **fields):
+    return {"c": 1, "n": node, "k": "Caja", "v": 100.0, "t": False, "o": origin, "r": "Dato directo", **fields}
+
+
+def test_rows_take_their_context_and_path():
+    nodes = [{"id": 1, "nombre": "Activos", "padre": None}, {"id": 2, "nombre": "Corrientes", "padre": 1}]
+    [row] = expand_rows(_payload(nodes, [_row(2)]))
+    assert row == ["Hoja1", "Empresa", "2023", "Dic", "Activos", "Corrientes", "", "", "", "Caja", 100.0, "BOB",
+                   "NO", "Hoja1:B10", "Dato directo", "", "", ""]
+
+
+def test_parent_cycles_stop_at_the_repeated_node():
+    nodes = [{"id": 1, "nombre": "Activos", "padre": 3}, {"id": 2, "nombre": "Corrientes", "padre": 1},
+             {"id": 3, "nombre": "Caja", "padre": 2}, {"id": 4, "nombre": "Propio", "padre": 4}]
+    rows = expand_rows(_payload(nodes, [_row(3), _row(4), _row(9)]))
+    assert rows[0][LEVELS] == ["Activos", "Corrientes", "Caja", "", ""]
+    assert rows[1][LEVELS] == ["Propio", "", "", "", ""]
+    assert rows[2][LEVELS] == ["", "", "", "", ""]
+
+
+def test_deep_paths_are_joined_in_the_last_level():
+    nodes = [{"id": i, "nombre": f"N{i}", "padre": i - 1 if i > 1 else None} for i in range(1, 8)]
+    [row] = expand_rows(_payload(nodes, [_row(7)]))
+    assert row[LEVELS] == ["N1", "N2", "N3", "N4", "N5 > N6 > N7"]
+
+
+def test_origin_gets_the_sheet_once():
+    rows = expand_rows(_payload([], [_row(None, "B10"), _row(None, "Hoja1:B11"), _row(None, "Hoja1!B12"),
+                                     _row(None, "")]))
+    assert [row[ORIGIN] for row in rows] == ["Hoja1:B10", "Hoja1:B11", "Hoja1!B12", ""]
+
+
+def test_truncated_rows_are_kept_up_to_the_last_complete_one():
+    text = structured_reply(20)
+    cut = text.index('"k":"Cuenta 2.3"')
+    payload, truncated = _load_payload(text[:cut])
+    assert truncated
+    assert payload["filas"] == json.loads(text)["filas"][:11]
+    result = expand_structured(text[:cut])
+    assert "Respuesta interrumpida" in result
+    assert "Cuenta 2.2" in result and "Cuenta 2.3" not in result
+
+
+def test_truncated_nodes_keep_the_report():
+    text = structured_reply(20)
+    cut = text.index('"nombre":"Seccion 2"')
+    payload, truncated = _load_payload(text[:cut])
+    assert truncated
+    assert payload["informe"] == json.loads(text)["informe"]
+    assert payload["nodos"] == json.loads(text)["nodos"][:2]
+    assert "filas" not in payload
+    assert expand_rows(payload) == []
+
+    # Cut inside the contexts, or in the middle of a string with brackets in it
+    payload, _ = _load_payload(text[:text.index('"entidad"')])
+    assert payload == {"informe": json.loads(text)["informe"]}
+    payload, _ = _load_payload('{"informe": "Resumen", "nodos": [{"id": 1, "nombre": "Activos {corrientes}, ]"}, '
+                               '{"id": 2, "nombre": "Otros [ingresos')
+    assert payload == {"informe": "Resumen", "nodos": [{"id": 1, "nombre": "Activos {corrientes}, ]"}]}
+
+
+def test_complete_and_unreadable_responses():
+    text = structured_reply(5)
+    assert _load_payload(text) == (json.loads(text), False)
+    assert _load_payload('{"informe": "Res') == (None, True)
+    assert expand_structured("Sin JSON") == "Sin JSON"
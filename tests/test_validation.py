@@ -0,0 +1,46 @@
+import pandas as pd
+
+from utils.validation import validate_report
+
+
+def _report(rows):
+    columns = ["Hoja", "Nivel_1", "Concepto_Final", "Valor", "Es_Total", "Origen_Dato", "Relacion_Celdas"]
+    return pd.DataFrame([dict(zip(columns, row)) for row in rows])
+
+
+def test_dash_between_cells_is_a_difference():
+    df = _report([
+        ("H1", "Resultados", "Ingresos", 100, "NO", "H1:B5", "Dato directo"),
+        ("H1", "Resultados", "Costos", 40, "NO", "H1:B6", "Dato directo"),
+        ("H1", "Resultados", "Utilidad", 60, "SI", "H1:B7", "B5-B6"),
+    ])
+    validated, summary = validate_report(df)
+    assert summary["discrepancies"] == 0
+    assert validated.loc[2, "Explicacion_Validacion"] == "Suma validada"
+    assert validated.loc[2, "Ecuacion_Validacion"] == "Ingresos (100) - Costos (40) = 60"
+
+
+def test_mixed_signs():
+    df = _report([
+        ("H1", "Resultados", "Ventas", 500, "NO", "H1:B10", "Dato directo"),
+        ("H1", "Resultados", "Otros ingresos", 20, "NO", "H1:B11", "Dato directo"),
+        ("H1", "Resultados", "Descuentos", 70, "NO", "H1:B12", "Dato directo"),
+        ("H1", "Resultados", "Ingresos netos", 450, "SI", "H1:B13", "B10+B11-B12"),
+    ])
+    validated, summary = validate_report(df)
+    assert summary["discrepancies"] == 0
+    assert validated.loc[3, "Explicacion_Validacion"] == "Suma validada"
+
+
+def test_ranges_are_summed():
+    df = _report([
+        ("H1", "Activos", "Caja", 10, "NO", "H1:B10", "Dato directo"),
+        ("H1", "Activos", "Bancos", 20, "NO", "H1:B11", "Dato directo"),
+        ("H1", "Activos", "Inversiones", 30, "NO", "H1:B12", "Dato directo"),
+        ("H1", "Activos", "Total", 60, "SI", "H1:B13", "Suma(B10:B12)"),
+        ("H1", "Activos", "Total (texto)", 61, "SI", "H1:B14", "Suma de B10 a B12"),
+    ])
+    validated, summary = validate_report(df)
+    assert validated.loc[3, "Explicacion_Validacion"] == "Suma validada"
+    assert validated.loc[4, "Explicacion_Validacion"].startswith("ADVERTENCIA: Suma calculada 60")
+    assert summary["discrepancies"] == 1
@@ -1,18 +1,59 @@
-from openai import OpenAI
 import pandas as pd
+import contextvars
+import json
+import re
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from utils.chunking import split_document
+from utils.focus import focus_query, slice_for_focus
+from utils.formula_graph import apply_formula_structure, structure_hint, workbook_structure
+from utils.instrumentation import span
+from utils.openai_client import chat_completion, chat_completion_stream
+from utils.serializer import format_legend, serialize_sheet
+from utils.structured_output import (STRUCTURED_SYSTEM_NOTE, expand_structured, response_format,
+                                     structured_prompt_section)
+from utils.table_detector import detect_reports
+from utils.token_budget import (MIN_BLOCK_TOKENS, chars_for_tokens, count_tokens, fit_blocks, fit_text,
+                                input_budget, output_limit)
+from utils.validation import validate_report
+
+MODEL = "gpt-4o"
+# Room reserved for the answer of a scan (the JSON list of reports)
+SCAN_OUTPUT_TOKENS = 8192
+# Closes the prompt text of a PDF whose later pages did not fit in the budget
+PAGES_OMITTED_MARKER = "\n... [PÁGINAS {first}-{last} OMITIDAS POR LÍMITE DE CONTEXTO] ...\n"
+ERROR_PREFIX = "Error comunicándose con OpenAI API"
+SCAN_ERROR_PREFIX = "Error al escanear"
+# Start of a map-reduce response some of whose parts could not be analyzed
+PARTIAL_PREFIX = "⚠️ Análisis incompleto"
+THROTTLED_PATTERN = re.compile(r"\b429\b|rate.?limit|too many requests|overloaded|\b503\b", re.IGNORECASE)
+
+
+def is_throttled(analysis_text):
+    """
+    True when an analysis failed because the API throttled or shed the request.
+    """
+    return analysis_text.startswith(ERROR_PREFIX) and bool(THROTTLED_PATTERN.search(analysis_text))
 
 
-def scan_pdf_reports(data, api_key):
+def is_partial(analysis_text):
+    """
+    True when a map-reduce analysis left some parts of the document out (see
+    analyze_report_map_reduce); the CSV holds the rows of the other parts only.
+    """
+    return analysis_text.startswith(PARTIAL_PREFIX)
+
+
+def scan_pdf_reports(data, api_key, use_cache=True):
     """
     Scans a PDF document to identify distinct reports contained within it.
     Returns a list of identified reports with their page ranges and descriptions.
+
+    The pages that fit in the context window are sent (see _pdf_page_blocks), and only
+    those are extracted: a long PDF is scanned up to the page where the budget runs out.
     """
-    client = OpenAI(api_key=api_key)
-    
-    # Truncate if too long, but try to keep enough to identify headers
-    max_chars = 100000
-    scan_data = data[:max_chars] + ("..." if len(data) > max_chars else "")
-    
     prompt = """
     Analiza el siguiente texto extraído de un documento PDF que puede contener múltiples reportes, tablas o cuadros financieros INDEPENDIENTES.
     
@@ -47,41 +88,96 @@ def scan_pdf_reports(data, api_key):
     ```
     
     Texto del documento:
-    """ + scan_data
+    """
+    system_prompt = "Eres un asistente experto en indexación de documentos financieros. Devuelve solo JSON válido."
+
+    # The document is shared out across its pages within the context window (see
+    # utils.token_budget)
+    with span("scan_pdf.prompt") as attrs:
+        budget = input_budget(MODEL, (system_prompt, prompt), SCAN_OUTPUT_TOKENS)
+        if hasattr(data, "n_pages"):
+            # Lazy PdfDocument: mark page boundaries so reported locations are real page numbers
+            blocks = _pdf_page_blocks(data, budget)
+        else:
+            blocks = [str(data)]
+        scan_data = "".join(fit_blocks(blocks, budget, MODEL))
+        attrs["budget"] = budget
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = chat_completion(
+            api_key,
+            use_cache=use_cache,
+            model=MODEL,
             messages=[
-                {"role": "system", "content": "Eres un asistente experto en indexación de documentos financieros. Devuelve solo JSON válido."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt + scan_data}
             ],
-            temperature=0
+            temperature=0,
+            max_tokens=output_limit(MODEL, SCAN_OUTPUT_TOKENS)
         )
         return response.choices[0].message.content
     except Exception as e:
-        return f"Error al escanear el PDF: {str(e)}"
+        return f"{SCAN_ERROR_PREFIX} el PDF: {str(e)}"
 
-def scan_excel_reports(data, api_key):
+def parse_scan_result(scan_json):
+    """
+    Extracts the list of reports from a scan response (```json block or raw JSON).
+    Returns None when no list can be parsed.
+    """
+    json_match = re.search(r'```json\s*\n(.*?)\n```', scan_json, re.DOTALL)
+    if not json_match:
+        # Try without newlines or different format
+        json_match = re.search(r'```json(.*?)```', scan_json, re.DOTALL)
+    # Sometimes models output raw JSON without markdown
+    raw = json_match.group(1) if json_match else scan_json
+    try:
+        reports = json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+    return reports if isinstance(reports, list) else None
+
+
+def _format_scan_result(reports):
+    """
+    Renders report records as the ```json block the model scan returns.
+    """
+    records = [{k: v for k, v in report.items() if k != "ambiguous"} for report in reports]
+    return "```json\n" + json.dumps(records, ensure_ascii=False, indent=2, default=str) + "\n```"
+
+
+def scan_excel_reports(data, api_key, use_cache=True, local_detection=True, sheet_format=None):
     """
     Scans an Excel dictionary (sheets -> values) to identify distinct reports.
     Handles multiple sheets and multiple tables within a single sheet.
+    With local_detection (the default), report blocks are first found locally over the
+    full sheets (see utils.table_detector); the model is only asked about the sheets
+    whose blocks could not be named, or about everything if nothing was detected.
+    """
+    if not local_detection:
+        return _scan_excel_with_model(data, api_key, use_cache, sheet_format)
+
+    with span("scan_excel.detect") as attrs:
+        reports = detect_reports(data)
+        attrs["reports"] = len(reports)
+    if not reports:
+        return _scan_excel_with_model(data, api_key, use_cache, sheet_format)
+
+    ambiguous_sheets = list(dict.fromkeys(r["sheet"] for r in reports if r["ambiguous"]))
+    if ambiguous_sheets:
+        model_reports = parse_scan_result(_scan_excel_with_model(
+            {sheet: data[sheet] for sheet in ambiguous_sheets}, api_key, use_cache, sheet_format
+        ))
+        if model_reports:
+            reports = [r for r in reports if r["sheet"] not in ambiguous_sheets] + model_reports
+            for i, report in enumerate(reports, 1):
+                report["id"] = i
+    return _format_scan_result(reports)
+
+
+def _scan_excel_with_model(data, api_key, use_cache=True, sheet_format=None):
+    """
+    Asks the model to identify the reports from a sample of each sheet.
     """
-    client = OpenAI(api_key=api_key)
-    
-    # Prepare data summary for scanning
-    scan_text = ""
-    for sheet_name, content in data.items():
-        scan_text += f"\n--- HOJA: {sheet_name} ---\n"
-        df = content['values']
-        
-        # Add dimensions to help model understand scope
-        scan_text += f"(Dimensiones totales: {df.shape[0]} filas, {df.shape[1]} columnas)\n"
-        
-        # Increase sample size to capture stacked tables (vertical arrangement)
-        # We take up to 400 rows to ensure we see multiple sections if they exist
-        scan_text += df.head(400).to_string() + "\n"
-        
     prompt = """
     Analiza la muestra de datos de un archivo EXCEL (las primeras filas de cada hoja). 
     
@@ -128,73 +224,55 @@ def scan_excel_reports(data, api_key):
     ```
     
     Data del Excel:
-    """ + scan_text[:80000]
+    """
+    system_prompt = "Eres un auditor de datos experto en Excel. Identificas tablas y estructuras independientes."
+
+    # Prepare data summary for scanning: one block per sheet, shared out within the
+    # context window so every sheet is represented (see utils.token_budget)
+    blocks = []
+    with span("scan_excel.serialize") as attrs:
+        for sheet_name, content in data.items():
+            block = f"\n--- HOJA: {sheet_name} ---\n"
+            df = content['values']
+            
+            # Add dimensions to help model understand scope
+            block += f"(Dimensiones totales: {df.shape[0]} filas, {df.shape[1]} columnas)\n"
+            
+            # Increase sample size to capture stacked tables (vertical arrangement)
+            # We take up to 400 rows to ensure we see multiple sections if they exist
+            legend = format_legend(sheet_format)
+            if legend:
+                block += legend + "\n"
+            blocks.append(block + serialize_sheet(df.head(400), sheet_format) + "\n")
+        budget = input_budget(MODEL, (system_prompt, prompt), SCAN_OUTPUT_TOKENS)
+        scan_text = "".join(fit_blocks(blocks, budget, MODEL))
+        attrs["budget"] = budget
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = chat_completion(
+            api_key,
+            use_cache=use_cache,
+            model=MODEL,
             messages=[
-                {"role": "system", "content": "Eres un auditor de datos experto en Excel. Identificas tablas y estructuras independientes."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt + scan_text}
             ],
-            temperature=0
+            temperature=0,
+            max_tokens=output_limit(MODEL, SCAN_OUTPUT_TOKENS)
         )
         return response.choices[0].message.content
     except Exception as e:
-        return f"Error al escanear Excel: {str(e)}"
-
-def analyze_report(data, file_type, api_key, focus_context=None):
-    """
-    Analyzes the parsed data using OpenAI.
-    If focus_context is provided, limits the analysis to that specific report/section.
-    """
-    client = OpenAI(api_key=api_key)
-    
-    # --- PRE-PROCESSING & TRUNCATION ---
-    prompt_data = ""
-    
-    if isinstance(data, dict):
-        # Convert Excel dict to string representation for the prompt
-        # Use a compact representation to save tokens
-        for sheet, content in data.items():
-            prompt_data += f"\n--- SHEET: {sheet} ---\n"
-            # Use to_string() of dataframe
-            prompt_data += content['values'].to_string() + "\n"
-    else:
-        # PDF / Text
-        prompt_data = str(data)
-
-    # --- TRUNCATION TO PREVENT TOKEN OVERFLOW ---
-    # Limit reduced to 120k chars because numeric tables have high token density (1 token ~ 2 chars)
-    SAFE_CHAR_LIMIT = 120000
-    
-    if len(prompt_data) > SAFE_CHAR_LIMIT:
-        head_chars = 100000
-        tail_chars = 20000
-        prompt_data = prompt_data[:head_chars] + "\n\n... [DATOS TRUNCADOS POR EXCESO DE LONGITUD] ...\n\n" + prompt_data[-tail_chars:]
-    # ----------------------------------------------
-
-    # Context injection if focus is selected
-    focus_instruction = ""
-    if focus_context:
-        focus_instruction = f"""
-        ⚠️ **ENFOQUE OBLIGATORIO**:
-        El usuario ha seleccionado analizar ÚNICAMENTE el siguiente reporte específico dentro del documento:
-        
-        >>> **{focus_context}** <<<
-        
-        - IGNORA cualquier otro reporte, tabla o dato que NO pertenezca a este reporte específico.
-        - Si el documento tiene "Balance" y "Resultados", y el usuario eligió "Balance", SOLO procesa el Balance.
-        - Extrae datos SOLO de esta sección.
-        """
-
-    prompt = """
+        return f"{SCAN_ERROR_PREFIX} Excel: {str(e)}"
+
+# The analysis prompt is laid out for the provider's automatic prompt caching, which
+# reuses the longest identical prefix of recent requests: the static instructions
+# (identical for every call in a validation mode) come first and everything that
+# changes per call (file type, focused report, data) goes in ANALYSIS_REQUEST_TEMPLATE
+# at the end.
+ANALYSIS_PROMPT_TEMPLATE = """
     Actúa como un Analista Financiero Senior y Auditor de Datos con capacidad de DETECCIÓN ESTRUCTURAL AVANZADA.
     Tu tarea es analizar, validar y estructurar los datos del reporte financiero proporcionado con PRECISIÓN QUIRÚRGICA.
-    
-    {focus_instruction}
-
-    Los datos provienen de un archivo {file_type}.
+    Las instrucciones específicas de esta solicitud (tipo de archivo y enfoque) y los datos están al final.
 
     ═══════════════════════════════════════════════════════════════════════════════
     FASE 1: RECONOCIMIENTO Y ESTRUCTURA (MEJORADO)
@@ -259,14 +337,7 @@ def analyze_report(data, file_type, api_key, focus_context=None):
          * Todos los valores numéricos deben ser PUROS (float/int) en el CSV.
          * La moneda y la unidad ("Millones", "Miles") van en columnas separadas.
 
-    4. **VERIFICACIÓN DE VALORES (AUDITORÍA)**:
-       - **REGLA DE ORO**: "Un total debe ser igual a la suma de sus partes".
-       - Para CADA total identificado en el documento:
-         1. Calcula la suma de sus supuestos componentes.
-         2. Compara con el valor del total impreso.
-         3. Si hay discrepancia > 1% → MARCA COMO ERROR DE VALIDACIÓN en "Explicacion_Validacion".
-         4. Si coincide → Documenta la fórmula exacta en "Ecuacion_Validacion".
-
+{verification_section}
     ═══════════════════════════════════════════════════════════════════════════════
     FASE 2: EXTRACCIÓN Y TRAZABILIDAD
     ═══════════════════════════════════════════════════════════════════════════════
@@ -281,10 +352,7 @@ def analyze_report(data, file_type, api_key, focus_context=None):
        - **Relacion_Celdas**: Explicación lógica ("Suma de B10 a B40").
        - **Es_Total**: "SI" si es un agregado, "NO" si es detalle base.
     
-    7. **DETECCIÓN DE OUTLIERS Y ANOMALÍAS**:
-       - Calcula estadísticas básicas si hay series temporales.
-       - Marca en "Es_Outlier" si un valor se desvía más de 2 sigmas o es económicamente ilógico (ej. Activos negativos).
-
+{outlier_section}
     ═══════════════════════════════════════════════════════════════════════════════
     FASE 3: GENERACIÓN DEL CSV (PRODUCTO FINAL)
     ═══════════════════════════════════════════════════════════════════════════════
@@ -304,9 +372,7 @@ def analyze_report(data, file_type, api_key, focus_context=None):
 
     **EJEMPLO DE FILA IDEAL**:
     ```csv
-    "H1","Empresa ABC","2023","Dic","Activos","Corrientes","Caja y Bancos","","","Caja General",50000.00,"USD","NO","H1:B10","Dato directo","","Valor base reportado","NO"
-    "H1","Empresa ABC","2023","Dic","Activos","Corrientes","","","","Total Activos Corrientes",1200000.00,"USD","SI","H1:B20","Suma(B10:B19)","Caja + Cuentas x Cobrar + ...","Suma validada","NO"
-    ```
+{example_rows}    ```
 
     ═══════════════════════════════════════════════════════════════════════════════
     FASE 4: INFORME DE RESULTADOS
@@ -316,25 +382,20 @@ def analyze_report(data, file_type, api_key, focus_context=None):
     1. **Resumen Ejecutivo**: Hallazgos clave, contexto y calidad de datos.
     2. **Análisis Estructural**: Explica cómo dedujiste la jerarquía (Método Aritmético vs Visual).
     3. **BLOQUE CSV**: El código CSV listo para copiar.
-    4. **Validación**: Reporte de cualquier inconsistencia aritmética encontrada.
-    **INSTRUCCIÓN FINAL**:
-    Prioriza la COHERENCIA MATEMÁTICA. Si el documento dice "Total = 100" pero los sumandos dan "90", REPORTA la discrepancia en el campo `Explicacion_Validacion` (ej: "ADVERTENCIA: Suma calculada 90 vs Valor reportado 100").
-    
+{final_section}    """
+
+ANALYSIS_REQUEST_TEMPLATE = """
+    ═══════════════════════════════════════════════════════════════════════════════
+    SOLICITUD ACTUAL
+    ═══════════════════════════════════════════════════════════════════════════════
+
+    Los datos provienen de un archivo {file_type}.
+    {focus_instruction}
     Data:
     {data}
     """
-    
-    full_prompt = prompt.format(
-        focus_instruction=focus_instruction,
-        file_type=file_type,
-        data=prompt_data
-    )
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o", # Using a capable model
-            messages=[
-                {"role": "system", "content": """Eres un asistente analista financiero senior experto en TODOS los tipos de reportes financieros. 
+
+ANALYSIS_SYSTEM_PROMPT = """Eres un asistente analista financiero senior experto en TODOS los tipos de reportes financieros. 
                 
 Capacidades principales:
 - Analizas CUALQUIER tipo de reporte: empresarial, bancario, gubernamental, macroeconómico, sectorial, de inversión, etc.
@@ -392,10 +453,547 @@ REGLAS CRÍTICAS OBLIGATORIAS:
    - Calcula SOLO los indicadores relevantes para el tipo de reporte específico
    - NO calcules indicadores de comercio exterior para un balance empresarial
    - NO calcules ratios bancarios para un reporte macroeconómico
-   - Adapta tu análisis al contexto del documento"""},
-                {"role": "user", "content": full_prompt}
-            ]
+   - Adapta tu análisis al contexto del documento"""
+
+FORMULA_STRUCTURE_HEADER = (
+    "(Estructura EXACTA derivada de las fórmulas de la hoja: celda, concepto, fórmula y niveles. "
+    "Úsala para Es_Total, Niveles y Relacion_Celdas)\n"
+)
+
+# Sections of the analysis prompt that change when the totals/outlier validation runs
+# locally on the resulting CSV (utils.validation) instead of being done by the model
+MODEL_VALIDATION_SECTIONS = {
+    "verification_section": """    4. **VERIFICACIÓN DE VALORES (AUDITORÍA)**:
+       - **REGLA DE ORO**: "Un total debe ser igual a la suma de sus partes".
+       - Para CADA total identificado en el documento:
+         1. Calcula la suma de sus supuestos componentes.
+         2. Compara con el valor del total impreso.
+         3. Si hay discrepancia > 1% → MARCA COMO ERROR DE VALIDACIÓN en "Explicacion_Validacion".
+         4. Si coincide → Documenta la fórmula exacta en "Ecuacion_Validacion".
+""",
+    "outlier_section": """    7. **DETECCIÓN DE OUTLIERS Y ANOMALÍAS**:
+       - Calcula estadísticas básicas si hay series temporales.
+       - Marca en "Es_Outlier" si un valor se desvía más de 2 sigmas o es económicamente ilógico (ej. Activos negativos).
+""",
+    "example_rows": """    "H1","Empresa ABC","2023","Dic","Activos","Corrientes","Caja y Bancos","","","Caja General",50000.00,"USD","NO","H1:B10","Dato directo","","Valor base reportado","NO"
+    "H1","Empresa ABC","2023","Dic","Activos","Corrientes","","","","Total Activos Corrientes",1200000.00,"USD","SI","H1:B20","Suma(B10:B19)","Caja + Cuentas x Cobrar + ...","Suma validada","NO"
+""",
+    "final_section": """    4. **Validación**: Reporte de cualquier inconsistencia aritmética encontrada.
+    **INSTRUCCIÓN FINAL**:
+    Prioriza la COHERENCIA MATEMÁTICA. Si el documento dice "Total = 100" pero los sumandos dan "90", REPORTA la discrepancia en el campo `Explicacion_Validacion` (ej: "ADVERTENCIA: Suma calculada 90 vs Valor reportado 100").
+""",
+}
+
+LOCAL_VALIDATION_SECTIONS = {
+    "verification_section": """    4. **VERIFICACIÓN DE VALORES (AUTOMÁTICA)**:
+       - La verificación de totales se ejecuta AUTOMÁTICAMENTE sobre tu CSV: NO sumes componentes ni compares totales.
+       - Depende de que marques bien "Es_Total", los Niveles jerárquicos y "Relacion_Celdas" (ej. "Suma(B10:B19)").
+""",
+    "outlier_section": """    7. **OUTLIERS**: Se calculan automáticamente sobre el CSV; deja "Es_Outlier" VACÍO.
+""",
+    "example_rows": """    "H1","Empresa ABC","2023","Dic","Activos","Corrientes","Caja y Bancos","","","Caja General",50000.00,"USD","NO","H1:B10","Dato directo","","",""
+    "H1","Empresa ABC","2023","Dic","Activos","Corrientes","","","","Total Activos Corrientes",1200000.00,"USD","SI","H1:B20","Suma(B10:B19)","","",""
+""",
+    "final_section": """    **INSTRUCCIÓN FINAL**:
+    Deja VACÍAS las columnas "Ecuacion_Validacion", "Explicacion_Validacion" y "Es_Outlier": se llenan automáticamente después. Prioriza la COMPLETITUD de las filas y la exactitud de "Es_Total", Niveles, "Origen_Dato" y "Relacion_Celdas".
+""",
+}
+
+
+def _pdf_page_blocks(document, budget=None, sheet_format=None):
+    """
+    Prompt blocks (one per page) of a PdfDocument. With a token `budget`, only the
+    leading pages that can each keep their minimum share of it (MIN_BLOCK_TOKENS, see
+    utils.token_budget.allocate) are extracted and returned, followed by a marker
+    naming the pages left out; without one, every page is.
+    """
+    if budget is None:
+        document.extract_all()
+        return [document.pages_layout_text(i, i + 1, sheet_format) for i in range(document.n_pages)]
+    blocks = []
+    room = budget // 2  # allocate hands out at most half the budget as minimum shares
+    while len(blocks) < document.n_pages:
+        # Extracted in batches of the pages that fit even if every one is large
+        start = len(blocks)
+        stop = start + max(1, room // MIN_BLOCK_TOKENS)
+        document.extract_pages(start, stop)
+        for i in range(start, min(stop, document.n_pages)):
+            block = document.pages_layout_text(i, i + 1, sheet_format)
+            need = min(count_tokens(block, MODEL), MIN_BLOCK_TOKENS)
+            if need > room and blocks:
+                return blocks + [PAGES_OMITTED_MARKER.format(first=i + 1, last=document.n_pages)]
+            room -= need
+            blocks.append(block)
+    return blocks
+
+
+def _prompt_blocks(data, sheet_format=None, structure=None, page_budget=None):
+    """
+    Serializes parsed Excel (dict of sheets) or PDF/text data for the analysis prompt,
+    as a list of blocks (one per sheet or page) that the token budget shares out.
+    Sheets use the compact serializer named by `sheet_format` (see utils.serializer).
+    `structure` (utils.formula_graph.workbook_structure) adds the totals derived from
+    the workbook formulas after each sheet, so the model does not have to infer them.
+    With `page_budget` (tokens), a PDF only contributes the pages that fit in it
+    (see _pdf_page_blocks).
+    """
+    if isinstance(data, dict):
+        # Convert Excel dict to string representation for the prompt
+        legend = format_legend(sheet_format)
+        blocks = []
+        for sheet, content in data.items():
+            parts = [f"\n--- SHEET: {sheet} ---\n"]
+            if legend:
+                parts.append(legend + "\n")
+            parts.append(serialize_sheet(content['values'], sheet_format) + "\n")
+            hint = structure_hint(structure, sheet, rows=content['values'].index)
+            if hint:
+                parts.append(FORMULA_STRUCTURE_HEADER + hint + "\n")
+            blocks.append("".join(parts))
+        return blocks
+    # PDF (pages of a lazy PdfDocument, tables as grids like the sheets) / Text
+    if hasattr(data, "n_pages"):
+        return _pdf_page_blocks(data, page_budget, sheet_format)
+    return [str(data)]
+
+
+def _build_prompt_data(data, sheet_format=None, structure=None):
+    return "".join(_prompt_blocks(data, sheet_format, structure))
+
+
+@lru_cache(maxsize=None)
+def _analysis_prompt_prefix(local_validation=True, structured_output=False):
+    sections = LOCAL_VALIDATION_SECTIONS if local_validation else MODEL_VALIDATION_SECTIONS
+    prefix = ANALYSIS_PROMPT_TEMPLATE.format(**sections)
+    if structured_output:
+        prefix += structured_prompt_section(local_validation)
+    return prefix
+
+
+def _build_analysis_prompt(prompt_data, file_type, focus_context=None, local_validation=True,
+                           structured_output=False):
+    """
+    Builds the analysis prompt for the (already truncated) data: the static, cacheable
+    instructions followed by this request's file type, focus and data.
+    With local_validation=True the model is told to leave the validation columns
+    empty, since utils.validation fills them from the CSV. With structured_output=True
+    the CSV is asked for as normalized JSON (see utils.structured_output).
+    """
+    # Context injection if focus is selected
+    focus_instruction = ""
+    if focus_context:
+        focus_instruction = f"""
+        ⚠️ **ENFOQUE OBLIGATORIO**:
+        El usuario ha seleccionado analizar ÚNICAMENTE el siguiente reporte específico dentro del documento:
+        
+        >>> **{focus_context}** <<<
+        
+        - IGNORA cualquier otro reporte, tabla o dato que NO pertenezca a este reporte específico.
+        - Si el documento tiene "Balance" y "Resultados", y el usuario eligió "Balance", SOLO procesa el Balance.
+        - Extrae datos SOLO de esta sección.
+        """
+
+    return _analysis_prompt_prefix(local_validation, structured_output) + ANALYSIS_REQUEST_TEMPLATE.format(
+        focus_instruction=focus_instruction,
+        file_type=file_type,
+        data=prompt_data,
+    )
+
+
+def _system_prompt(structured_output=False):
+    return ANALYSIS_SYSTEM_PROMPT + STRUCTURED_SYSTEM_NOTE if structured_output else ANALYSIS_SYSTEM_PROMPT
+
+
+def _analysis_messages(full_prompt, structured_output=False, system_prompt=None):
+    return [
+        {"role": "system", "content": system_prompt or _system_prompt(structured_output)},
+        {"role": "user", "content": full_prompt}
+    ]
+
+
+def _request_analysis(api_key, full_prompt, use_cache=True, local_validation=True, structured_output=False,
+                      system_prompt=None):
+    """
+    Sends one analysis request. A structured response is expanded locally into the
+    regular markdown + ```csv layout. `system_prompt` replaces the analysis system prompt.
+    """
+    options = {"response_format": response_format(local_validation)} if structured_output else {}
+    try:
+        response = chat_completion(
+            api_key,
+            use_cache=use_cache,
+            model=MODEL,
+            messages=_analysis_messages(full_prompt, structured_output, system_prompt),
+            max_tokens=output_limit(MODEL),
+            **options
         )
-        return response.choices[0].message.content
+        message = response.choices[0].message
+        if not structured_output:
+            return message.content
+        if getattr(message, "refusal", None):
+            return f"⚠️ El modelo rechazó la solicitud: {message.refusal}"
+        with span("analysis.expand_structured"):
+            return expand_structured(message.content or "")
+    except Exception as e:
+        return f"{ERROR_PREFIX}: {str(e)}"
+
+
+def _prepare_prompt_data(data, focus_context, focus_location, sheet_format, page_budget=None):
+    """
+    Applies the focused slice (if any) and serializes the data.
+    Returns the (possibly sliced) data and its untruncated prompt blocks (for a PDF,
+    those of the pages that fit in `page_budget`, see _prompt_blocks).
+    """
+    # Totals and hierarchy read from the formulas of the whole workbook
+    with span("analysis.formula_structure"):
+        structure = workbook_structure(data)
+
+    # --- FOCUSED SLICE ---
+    if focus_context and (focus_location or hasattr(data, "n_pages")):
+        with span("analysis.focus_slice"):
+            focused_data = slice_for_focus(data, focus_location, sheet_format=sheet_format,
+                                           query=focus_query(focus_location, focus_context))
+        if focused_data is not None:
+            data = focused_data
+
+    # --- PRE-PROCESSING ---
+    with span("analysis.serialize") as attrs:
+        blocks = _prompt_blocks(data, sheet_format, structure, page_budget)
+        attrs["chars"] = sum(map(len, blocks))
+    return data, blocks
+
+
+def _analysis_budget(file_type, focus_context=None, local_validation=True, extra_text="", structured_output=False):
+    """
+    Tokens available for the data of one analysis request: the context window minus
+    the room reserved for the response (CSV included) and the prompts themselves.
+    """
+    template = _build_analysis_prompt(extra_text, file_type, focus_context, local_validation, structured_output)
+    return input_budget(MODEL, (_system_prompt(structured_output), template))
+
+
+def _fit_prompt_data(blocks, file_type, focus_context=None, local_validation=True, map_reduce=False,
+                     structured_output=False):
+    """
+    --- TOKEN BUDGET TO PREVENT CONTEXT OVERFLOW ---
+    Returns the prompt data for a single request. When the blocks do not fit, the
+    budget is shared out across sheets/pages in proportion to their size and each
+    one is cut to its share (see utils.token_budget), or None is returned with
+    map_reduce=True so the document is analyzed in chunks instead.
+    """
+    with span("analysis.budget") as attrs:
+        budget = _analysis_budget(file_type, focus_context, local_validation, structured_output=structured_output)
+        sizes = [count_tokens(block, MODEL) for block in blocks]
+        attrs.update(budget=budget, tokens=sum(sizes))
+        if sum(sizes) <= budget:
+            return "".join(blocks)
+        if map_reduce:
+            return None
+        attrs["truncated"] = True
+        return "".join(fit_blocks(blocks, budget, MODEL, sizes=sizes))
+
+
+def build_analysis_prompt(data, file_type, focus_context=None, focus_location=None, sheet_format=None,
+                          local_validation=True, structured_output=False):
+    """
+    The analysis prompt analyze_report sends for `data` in a single request, with the
+    same focused slice and serialization, cut per sheet/page when it does not fit.
+    """
+    page_budget = _analysis_budget(file_type, focus_context, local_validation, structured_output=structured_output)
+    data, blocks = _prepare_prompt_data(data, focus_context, focus_location, sheet_format, page_budget)
+    prompt_data = _fit_prompt_data(blocks, file_type, focus_context, local_validation,
+                                   structured_output=structured_output)
+    return _build_analysis_prompt(prompt_data, file_type, focus_context, local_validation, structured_output)
+
+
+def analyze_report(data, file_type, api_key, focus_context=None, map_reduce=False, max_workers=4,
+                   use_cache=True, sheet_format=None, focus_location=None, local_validation=True,
+                   structured_output=False):
+    """
+    Analyzes the parsed data using OpenAI.
+    If focus_context is provided, limits the analysis to that specific report/section.
+    If focus_location (a scan location string or record) is also provided, only the
+    sheet rows / pages it points to (plus a small margin) are sent; when it cannot be
+    resolved the whole document is used. For PDFs, the page and table-block chunks
+    that best match the report's title and description (a BM25 index kept with the
+    parsed document, see utils.retrieval) are sent with their neighbours instead.
+    use_cache=False bypasses the persistent response cache.
+    sheet_format selects the sheet serializer (utils.serializer, compact TSV by default).
+    With local_validation=True (default) the model skips the totals/outlier checks and
+    leaves the validation columns empty for utils.validation.validate_report to fill.
+    Documents larger than the model's context window allows are cut per sheet/page
+    to fit, or with map_reduce=True analyzed in chunks instead of being truncated
+    (see analyze_report_map_reduce).
+    With structured_output=True the model answers with normalized JSON (shared context
+    and hierarchy declared once, rows carrying only what changes), a fraction of the
+    output tokens of the CSV, which is expanded locally into the same response layout.
+    """
+    # Map-reduce needs every page to tell whether the document fits; otherwise only the pages that do
+    page_budget = None if map_reduce else _analysis_budget(file_type, focus_context, local_validation,
+                                                           structured_output=structured_output)
+    data, blocks = _prepare_prompt_data(data, focus_context, focus_location, sheet_format, page_budget)
+    prompt_data = _fit_prompt_data(blocks, file_type, focus_context, local_validation, map_reduce,
+                                   structured_output)
+
+    if prompt_data is None:
+        return analyze_report_map_reduce(data, file_type, api_key, focus_context=focus_context,
+                                         max_workers=max_workers, use_cache=use_cache,
+                                         sheet_format=sheet_format, local_validation=local_validation,
+                                         structured_output=structured_output)
+
+    full_prompt = _build_analysis_prompt(prompt_data, file_type, focus_context, local_validation, structured_output)
+    return _request_analysis(api_key, full_prompt, use_cache, local_validation, structured_output)
+
+
+def analyze_report_stream(data, file_type, api_key, focus_context=None, map_reduce=False, max_workers=4,
+                          use_cache=True, sheet_format=None, focus_location=None, local_validation=True,
+                          structured_output=False):
+    """
+    Streaming variant of analyze_report: yields the response text as it arrives.
+
+    Takes the same arguments. A map-reduce or structured analysis is not streamed and
+    is yielded in one piece once complete (partial JSON cannot be rendered). If the stream fails midway (timeout, dropped
+    connection), the error is yielded as a final note so the partial text is kept.
+    """
+    # Map-reduce needs every page to tell whether the document fits; otherwise only the pages that do
+    page_budget = None if map_reduce else _analysis_budget(file_type, focus_context, local_validation,
+                                                           structured_output=structured_output)
+    data, blocks = _prepare_prompt_data(data, focus_context, focus_location, sheet_format, page_budget)
+    prompt_data = _fit_prompt_data(blocks, file_type, focus_context, local_validation, map_reduce,
+                                   structured_output)
+
+    if prompt_data is None:
+        yield analyze_report_map_reduce(data, file_type, api_key, focus_context=focus_context,
+                                        max_workers=max_workers, use_cache=use_cache,
+                                        sheet_format=sheet_format, local_validation=local_validation,
+                                        structured_output=structured_output)
+        return
+
+    full_prompt = _build_analysis_prompt(prompt_data, file_type, focus_context, local_validation, structured_output)
+    if structured_output:
+        yield _request_analysis(api_key, full_prompt, use_cache, local_validation, structured_output)
+        return
+    received = []
+    try:
+        for delta in chat_completion_stream(
+            api_key,
+            use_cache=use_cache,
+            model=MODEL,
+            messages=_analysis_messages(full_prompt),
+            max_tokens=output_limit(MODEL)
+        ):
+            received.append(delta)
+            yield delta
     except Exception as e:
-        return f"Error comunicándose con OpenAI API: {str(e)}"
+        if not received:
+            yield f"{ERROR_PREFIX}: {str(e)}"
+            return
+        # Close a code block left open by the cut so the partial CSV stays extractable
+        fence = "\n```" if "".join(received).count("```") % 2 else ""
+        yield f"{fence}\n\n⚠️ [Respuesta interrumpida: {str(e)}]"
+
+
+CSV_BLOCK_PATTERNS = [
+    r'```csv\s*\n(.*?)\n```',  # Standard markdown with newlines
+    r'```csv\s*\r?\n(.*?)\r?\n```',  # With optional carriage returns
+    r'```csv(.*?)```',  # Without requiring newlines
+]
+
+
+def extract_csv_block(text):
+    """
+    Returns the content of the first ```csv block in a model response, or None.
+    """
+    for pattern in CSV_BLOCK_PATTERNS:
+        csv_match = re.search(pattern, text, re.DOTALL)
+        if csv_match:
+            return csv_match.group(1).strip()
+    return None
+
+
+def merge_csv_blocks(csv_blocks):
+    """
+    Concatenates per-chunk CSV blocks under a single header line.
+    """
+    header = None
+    rows = []
+    for block in csv_blocks:
+        lines = [line for line in block.splitlines() if line.strip()]
+        if not lines:
+            continue
+        if header is None:
+            header = lines[0]
+        if lines[0].replace('"', '').replace(' ', '') == header.replace('"', '').replace(' ', ''):
+            lines = lines[1:]
+        rows.extend(lines)
+    if header is None:
+        return None
+    return "\n".join([header] + rows)
+
+
+def build_csv_output(analysis_text, data=None, local_validation=True, fallback_csv=None):
+    """
+    Turns an analysis response into its final CSV.
+
+    The ```csv block (or `fallback_csv`, e.g. the rows decoded from a cut stream) is
+    parsed into a DataFrame, rows backed by workbook formulas take their hierarchy from
+    them and, with local_validation, totals and outliers are validated locally.
+    Returns a dict with csv_content, csv_df, formula_rows, validation and error.
+    """
+    result = {"csv_content": extract_csv_block(analysis_text) or fallback_csv, "csv_df": None,
+              "formula_rows": 0, "validation": None, "error": None}
+    if not result["csv_content"]:
+        return result
+    try:
+        with span("csv.parse"):
+            csv_df = pd.read_csv(StringIO(result["csv_content"]), on_bad_lines='skip', quotechar='"',
+                                 skipinitialspace=True, encoding='utf-8')
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+
+    # Exact hierarchy for the rows that come from formula cells
+    with span("csv.formula_structure"):
+        csv_df, result["formula_rows"] = apply_formula_structure(csv_df, workbook_structure(data))
+    if local_validation:
+        with span("csv.validation", rows=len(csv_df)):
+            csv_df, result["validation"] = validate_report(csv_df)
+    if result["formula_rows"] or local_validation:
+        result["csv_content"] = csv_df.to_csv(index=False)
+    result["csv_df"] = csv_df
+    return result
+
+
+# The analysis system prompt makes a CSV block mandatory; the consolidation must not write one
+CONSOLIDATION_SYSTEM_PROMPT = """Eres un asistente analista financiero senior. Consolidas en un informe final los análisis \
+parciales de un documento extenso que fue procesado por partes.
+
+- Escribes en español de forma clara y profesional, en markdown
+- NO generas bloques CSV: el CSV consolidado de todas las partes se adjunta automáticamente
+- Señalas las contradicciones entre partes y las inconsistencias aritméticas que reportaron"""
+
+CONSOLIDATION_PROMPT_TEMPLATE = """
+    Actúa como un Analista Financiero Senior. Un documento {file_type} demasiado extenso fue dividido en {n_chunks} partes y cada parte fue analizada por separado.
+    {focus_instruction}
+    A continuación tienes el análisis de cada parte (sin sus bloques CSV, que ya fueron consolidados automáticamente en un solo CSV de {n_rows} filas).
+
+    Tu tarea es producir el INFORME FINAL CONSOLIDADO:
+    1. **Resumen Ejecutivo**: Hallazgos clave del documento completo, contexto y calidad de datos.
+    2. **Análisis Estructural**: Cómo se organiza la jerarquía a lo largo de todas las partes.
+    3. **Validación**: Une y depura las inconsistencias aritméticas reportadas por las partes.
+
+    - NO generes un bloque CSV: el CSV consolidado se adjunta automáticamente.
+    - Si dos partes se contradicen, indícalo explícitamente.
+
+    Análisis por parte:
+    {partial_analyses}
+    """
+
+
+# Room left in each chunk for the note that tells the model which part it is reading
+PART_NOTE_TOKENS = 100
+
+
+def _part_note(label, index, n_chunks):
+    return (
+        f"\n[PARTE {index} DE {n_chunks} DEL DOCUMENTO - {label}. "
+        "Analiza y extrae TODAS las filas de esta parte; las demás partes se procesan por separado.]\n"
+    )
+
+
+def _analyze_chunk(api_key, label, text, index, n_chunks, file_type, focus_context, use_cache,
+                   local_validation=True, structured_output=False):
+    part_note = _part_note(label, index, n_chunks)
+    # Chunks are sized by the average density of the document; a denser one is cut to fit
+    budget = _analysis_budget(file_type, focus_context, local_validation, part_note, structured_output)
+    full_prompt = _build_analysis_prompt(part_note + fit_text(text, budget, MODEL), file_type, focus_context,
+                                         local_validation, structured_output)
+    return _request_analysis(api_key, full_prompt, use_cache, local_validation, structured_output)
+
+
+def analyze_report_map_reduce(data, file_type, api_key, focus_context=None, max_workers=4,
+                              max_chunk_chars=None, use_cache=True, sheet_format=None,
+                              local_validation=True, structured_output=False):
+    """
+    Analyzes a large document completely instead of truncating it.
+
+    Map: the document is split along sheet, table or page boundaries into chunks of
+    at most `max_chunk_chars` (by default, the characters that fill the token budget
+    of one request at the document's density) and each chunk is analyzed concurrently.
+    Reduce: the per-chunk CSV blocks are merged locally into a single CSV and a final
+    consolidation call writes the overall summary from the per-chunk narratives.
+    Returns a response with the same shape as analyze_report (markdown + ```csv block).
+    When a part is throttled its error is returned instead, so the caller can retry;
+    when parts fail otherwise, the response starts with PARTIAL_PREFIX (see is_partial)
+    and lists them.
+    """
+    with span("analysis.split") as attrs:
+        if max_chunk_chars is None:
+            budget = _analysis_budget(file_type, focus_context, local_validation,
+                                      structured_output=structured_output) - PART_NOTE_TOKENS
+            max_chunk_chars = chars_for_tokens(_build_prompt_data(data, sheet_format), budget, MODEL)
+        chunks = split_document(data, max_chunk_chars, sheet_format)
+        attrs["chunks"] = len(chunks)
+    n_chunks = len(chunks)
+
+    # Each worker runs in a copy of the caller's context, so model calls made in the
+    # threads are recorded in the caller's instrumentation run
+    with span("analysis.map", chunks=n_chunks):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, n_chunks))) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, _analyze_chunk, api_key, label, text, i,
+                                n_chunks, file_type, focus_context, use_cache, local_validation,
+                                structured_output)
+                for i, (label, text) in enumerate(chunks, 1)
+            ]
+            results = [future.result() for future in futures]
+
+    for result in results:
+        if is_throttled(result):
+            # A throttled part fails the whole analysis, so callers retry it (see
+            # utils.scheduler) instead of keeping a CSV without that part's rows
+            return result
+
+    csv_blocks = []
+    partial_analyses = []
+    failed = []
+    for (label, _), result in zip(chunks, results):
+        if result.startswith(ERROR_PREFIX):
+            failed.append(f"- {label}: {result}")
+            continue
+        csv_block = extract_csv_block(result)
+        if csv_block:
+            csv_blocks.append(csv_block)
+        narrative = result
+        for pattern in CSV_BLOCK_PATTERNS:
+            narrative = re.sub(pattern, "[CSV consolidado]", narrative, flags=re.DOTALL)
+        partial_analyses.append(f"\n### {label}\n{narrative}\n")
+
+    merged_csv = merge_csv_blocks(csv_blocks)
+    n_rows = merged_csv.count("\n") if merged_csv else 0
+
+    focus_instruction = ""
+    if focus_context:
+        focus_instruction = f"El análisis se limitó al reporte: >>> {focus_context} <<<\n"
+
+    prompt_fields = {"file_type": file_type, "n_chunks": n_chunks, "focus_instruction": focus_instruction,
+                     "n_rows": n_rows}
+    # Many chunks: the narratives share the window like the sheets of a single request
+    budget = input_budget(MODEL, (CONSOLIDATION_SYSTEM_PROMPT,
+                                  CONSOLIDATION_PROMPT_TEMPLATE.format(partial_analyses="", **prompt_fields)))
+    consolidation_prompt = CONSOLIDATION_PROMPT_TEMPLATE.format(
+        partial_analyses="".join(fit_blocks(partial_analyses, budget, MODEL)), **prompt_fields
+    )
+    with span("analysis.reduce"):
+        summary = _request_analysis(api_key, consolidation_prompt, use_cache,
+                                    system_prompt=CONSOLIDATION_SYSTEM_PROMPT)
+    # A CSV block written by the model anyway would be taken for the consolidated one
+    for pattern in CSV_BLOCK_PATTERNS:
+        summary = re.sub(pattern, "", summary, flags=re.DOTALL)
+
+    if failed and not summary.startswith(ERROR_PREFIX):
+        summary = (f"{PARTIAL_PREFIX}: {len(failed)} de {n_chunks} partes sin analizar\n"
+                   + "\n".join(failed) + "\n\n" + summary)
+    if merged_csv:
+        summary += f"\n\n### Datos Consolidados ({n_chunks} partes)\n```csv\n{merged_csv}\n```\n"
+    return summary
@@ -0,0 +1,319 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from utils.analysis import (ERROR_PREFIX, SCAN_ERROR_PREFIX, analyze_report, build_csv_output, is_partial,
+                            parse_scan_result, scan_excel_reports, scan_pdf_reports)
+from utils.instrumentation import append_jsonl, track_run
+from utils.file_parser import parse_excel, parse_pdf
+from utils.parse_cache import get_parse_cache
+
+SUPPORTED_EXTENSIONS = ("xlsx", "xls", "pdf")
+MANIFEST_NAME = "manifest.json"
+METRICS_NAME = "metrics.jsonl"
+
+
+def discover_files(input_dir, extensions=SUPPORTED_EXTENSIONS, recursive=True):
+    """
+    Lists the report files under `input_dir` (sorted, paths relative to it).
+    Hidden files and Excel lock files (~$...) are skipped.
+    """
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".")) if recursive else []
+        for name in files:
+            if name.startswith((".", "~$")):
+                continue
+            if name.rsplit(".", 1)[-1].lower() in extensions:
+                found.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return sorted(found)
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _slug(text, max_length=60):
+    slug = re.sub(r"[^\w\-]+", "_", str(text), flags=re.UNICODE).strip("_")
+    return slug[:max_length] or "reporte"
+
+
+class JobManifest:
+    """
+    Resumable record of a batch run, stored as JSON in the output directory.
+
+    One entry per input file (keyed by its relative path) holding its content hash,
+    status (pending / done / partial / failed), outputs and, for per-report runs, the
+    status of each report. Every update is written atomically, so after a crash the
+    next run skips what is done and continues with the rest. Partial results (parts
+    of a map-reduce analysis failed) are processed again like failed ones, and so is
+    a file whose content changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+
+    def is_done(self, name, digest):
+        entry = self.entries.get(name)
+        return bool(entry) and entry.get("status") == "done" and entry.get("sha256") == digest
+
+    def entry(self, name):
+        return self.entries.get(name, {})
+
+    def update(self, name, **fields):
+        with self._lock:
+            entry = self.entries.setdefault(name, {})
+            entry.update(fields)
+            entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+            self._save()
+
+    def update_report(self, name, report_key, **fields):
+        with self._lock:
+            reports = self.entries.setdefault(name, {}).setdefault("reports", {})
+            reports.setdefault(report_key, {}).update(fields)
+            self._save()
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.entries}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry.get("status", "pending")] = counts.get(entry.get("status", "pending"), 0) + 1
+        return counts
+
+
+def _parser_name(path):
+    return "pdf" if path.rsplit(".", 1)[-1].lower() == "pdf" else "excel"
+
+
+def parse_file(path):
+    """
+    Parses one report in a worker process. The parsers are called directly: a
+    spawned worker starts with an empty parse cache, so the parent process checks
+    and fills the cache instead (see run_batch). PDFs are fully extracted here, so
+    the text travels back to the parent with the document.
+    """
+    with open(path, "rb") as f:
+        file = io.BytesIO(f.read())
+    file.name = os.path.basename(path)
+    if _parser_name(path) == "pdf":
+        data = parse_pdf(file, workers=1)  # no nested process pool inside a worker
+        data.extract_all()
+    else:
+        data = parse_excel(file)
+    return data
+
+
+def _write_text(path, text, encoding="utf-8"):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding=encoding) as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _write_analysis(out_dir, analysis_text, data, local_validation):
+    """
+    Writes analysis.md and data.csv (BOM so Excel opens accents correctly).
+    Returns the output paths and the number of CSV rows.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    analysis_path = os.path.join(out_dir, "analysis.md")
+    _write_text(analysis_path, analysis_text)
+    outputs = {"analysis": analysis_path}
+    csv_output = build_csv_output(analysis_text, data, local_validation=local_validation)
+    n_rows = 0
+    if csv_output["csv_content"]:
+        csv_path = os.path.join(out_dir, "data.csv")
+        _write_text(csv_path, csv_output["csv_content"], encoding="utf-8-sig")
+        outputs["csv"] = csv_path
+        n_rows = len(csv_output["csv_df"]) if csv_output["csv_df"] is not None else 0
+    if csv_output["validation"]:
+        outputs["validation"] = csv_output["validation"]
+    return outputs, n_rows
+
+
+def _is_model_error(text):
+    return text.startswith((ERROR_PREFIX, SCAN_ERROR_PREFIX))
+
+
+def process_parsed_file(name, data, out_dir, api_key, manifest, per_report=False, map_reduce=True,
+                        use_cache=True, sheet_format=None, local_validation=True):
+    """
+    Runs the model stage for one parsed file and records the result in the manifest.
+
+    By default the whole document is analyzed (map-reduce for large ones). With
+    per_report=True the document is scanned first (scan_*_reports) and every detected
+    report is analyzed separately into its own sub-folder; reports already done in a
+    previous run are skipped. The result has "partial": True when some analysis left
+    parts of the document out (see utils.analysis.is_partial).
+    """
+    file_type = name.rsplit(".", 1)[-1].lower()
+    options = dict(map_reduce=map_reduce, use_cache=use_cache, sheet_format=sheet_format,
+                   local_validation=local_validation)
+    os.makedirs(out_dir, exist_ok=True)
+
+    if not per_report:
+        analysis_text = analyze_report(data, file_type, api_key, **options)
+        if _is_model_error(analysis_text):
+            raise RuntimeError(analysis_text)
+        outputs, n_rows = _write_analysis(out_dir, analysis_text, data, local_validation)
+        return {"outputs": outputs, "rows": n_rows, "partial": is_partial(analysis_text)}
+
+    if file_type == "pdf":
+        scan_json = scan_pdf_reports(data, api_key, use_cache=use_cache)
+    else:
+        scan_json = scan_excel_reports(data, api_key, use_cache=use_cache, sheet_format=sheet_format)
+    reports = parse_scan_result(scan_json)
+    if reports is None:
+        raise RuntimeError(f"No se pudo interpretar el escaneo de reportes: {scan_json[:500]}")
+    _write_text(os.path.join(out_dir, "reports.json"), json.dumps(reports, ensure_ascii=False, indent=2))
+
+    done_reports = manifest.entry(name).get("reports", {})
+    total_rows = 0
+    partial = False
+    for i, report in enumerate(reports, 1):
+        report_key = f"{i:02d}_{_slug(report.get('title', ''))}"
+        if done_reports.get(report_key, {}).get("status") == "done":
+            total_rows += done_reports[report_key].get("rows", 0)
+            continue
+        analysis_text = analyze_report(data, file_type, api_key, focus_context=report.get("title"),
+                                       focus_location=report, **options)
+        if _is_model_error(analysis_text):
+            manifest.update_report(name, report_key, status="failed", error=analysis_text)
+            raise RuntimeError(analysis_text)
+        outputs, n_rows = _write_analysis(os.path.join(out_dir, report_key), analysis_text, data,
+                                          local_validation)
+        status = "partial" if is_partial(analysis_text) else "done"
+        manifest.update_report(name, report_key, status=status, rows=n_rows, outputs=outputs)
+        partial = partial or status == "partial"
+        total_rows += n_rows
+    return {"outputs": {"reports": os.path.join(out_dir, "reports.json")}, "rows": total_rows,
+            "n_reports": len(reports), "partial": partial}
+
+
+def run_batch(input_dir, output_dir, api_key, parse_workers=None, model_workers=4, per_report=False,
+              map_reduce=True, use_cache=True, sheet_format=None, local_validation=True, retry_failed=True,
+              recursive=True):
+    """
+    Processes every report under `input_dir` unattended.
+
+    Files are parsed in a process pool (`parse_workers`, CPU count by default) and each
+    parsed file is handed to a pool of `model_workers` threads for the model calls, so
+    parsing and analysis overlap and at most `model_workers` files wait on the API at
+    once (requests are further capped by OPENAI_MAX_CONCURRENCY). Outputs go to
+    `output_dir/<file path>/`; the manifest in `output_dir` makes the run resumable.
+    The timings and token usage of each file's model stage are appended to
+    `output_dir/metrics.jsonl` (see utils.instrumentation).
+    Returns the manifest status counts.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = JobManifest(os.path.join(output_dir, MANIFEST_NAME))
+
+    pending = []
+    digests = {}
+    for name in discover_files(input_dir, recursive=recursive):
+        digest = digests[name] = file_digest(os.path.join(input_dir, name))
+        if manifest.is_done(name, digest):
+            continue
+        entry = manifest.entry(name)
+        if entry.get("status") in ("failed", "partial") and not retry_failed and entry.get("sha256") == digest:
+            continue
+        if entry.get("sha256") != digest:
+            # New or changed file: forget per-report progress from an older version
+            manifest.update(name, sha256=digest, status="pending", reports={})
+        pending.append(name)
+    print(f"{len(pending)} archivos por procesar ({len(manifest.entries) - len(pending)} ya procesados)")
+    if not pending:
+        return manifest.summary()
+
+    # Parsed files waiting for the model are held in memory, so only a bounded
+    # number of files is in flight (being parsed or analyzed) at any time
+    parse_workers = parse_workers or os.cpu_count() or 1
+    model_workers = max(1, model_workers)
+    in_flight = threading.BoundedSemaphore(parse_workers + model_workers)
+    metrics_path = os.path.join(output_dir, METRICS_NAME)
+    metrics_lock = threading.Lock()
+    model_futures = []
+    # Parses are shared with other runs only through the on-disk tier (PARSE_CACHE_DIR):
+    # an in-memory entry would only hold the file until this run ends
+    cache = get_parse_cache()
+    cache = cache if cache.disk_dir else None
+
+    def run_model_stage(name, data, cache_key=None):
+        out_dir = os.path.join(output_dir, os.path.splitext(name)[0])
+        run = None
+        # Everything runs inside the try, so the in-flight slot is always released
+        try:
+            if cache_key is not None:
+                cache.put(cache_key, data)
+            manifest.update(name, status="analyzing", started_at=datetime.now().isoformat(timespec="seconds"))
+            with track_run("batch_file", file=name, per_report=per_report) as run:
+                result = process_parsed_file(name, data, out_dir, api_key, manifest, per_report=per_report,
+                                             map_reduce=map_reduce, use_cache=use_cache,
+                                             sheet_format=sheet_format, local_validation=local_validation)
+        except Exception as e:
+            manifest.update(name, status="failed", error=str(e))
+            print(f"✗ {name}: {e}")
+            return
+        finally:
+            in_flight.release()
+            if run is not None:
+                with metrics_lock:
+                    append_jsonl(metrics_path, [run])
+        if result.pop("partial"):
+            manifest.update(name, status="partial", error="Análisis incompleto: algunas partes fallaron", **result)
+            print(f"⚠ {name} ({result.get('rows', 0)} filas, análisis incompleto)")
+            return
+        manifest.update(name, status="done", error=None, **result)
+        print(f"✓ {name} ({result.get('rows', 0)} filas)")
+
+    def on_parsed(name, cache_key, future):
+        try:
+            data = future.result()
+        except Exception as e:
+            try:
+                manifest.update(name, status="failed", error=f"Error al leer el archivo: {e}")
+                print(f"✗ {name}: {e}")
+            finally:
+                in_flight.release()
+            return
+        # The cache entry is written from the model thread, off the pool's result thread
+        model_futures.append(model_pool.submit(run_model_stage, name, data, cache_key))
+
+    # spawn: the same start method the PDF extraction pool uses
+    ctx = multiprocessing.get_context("spawn")
+    with ThreadPoolExecutor(max_workers=model_workers) as model_pool:
+        with ProcessPoolExecutor(max_workers=min(parse_workers, len(pending)), mp_context=ctx) as parse_pool:
+            for name in pending:
+                in_flight.acquire()
+                cache_key = cache.digest_key(digests[name], _parser_name(name)) if cache else None
+                data = cache.get(cache_key) if cache else None
+                if data is not None:
+                    model_futures.append(model_pool.submit(run_model_stage, name, data))
+                    continue
+                future = parse_pool.submit(parse_file, os.path.join(input_dir, name))
+                future.add_done_callback(partial(on_parsed, name, cache_key))
+        # The parse pool has finished (and run every callback): wait for the model stage
+        for future in list(model_futures):
+            future.result()
+    return manifest.summary()
@@ -0,0 +1,127 @@
+import pandas as pd
+
+from utils.serializer import format_legend, serialize_sheet
+
+
+def _blank_row_blocks(df):
+    """
+    Splits a sheet into (start, stop) row blocks separated by runs of blank rows.
+    """
+    if df.empty:
+        return []
+    non_blank = df.notna().any(axis=1).to_numpy()
+    blocks = []
+    start = None
+    for i, filled in enumerate(non_blank):
+        if filled and start is None:
+            start = i
+        elif not filled and start is not None:
+            blocks.append((start, i))
+            start = None
+    if start is not None:
+        blocks.append((start, len(non_blank)))
+    return blocks
+
+
+def _split_oversized(df, start, stop, max_chars, sheet_format):
+    """
+    Splits rows [start, stop) into row ranges whose serialized text fits in max_chars.
+    """
+    n_rows = stop - start
+    chars = len(serialize_sheet(df.iloc[start:stop], sheet_format))
+    if chars <= max_chars or n_rows <= 1:
+        return [(start, stop)]
+    rows_per_chunk = max(1, int(n_rows * max_chars / chars))
+    return [(i, min(i + rows_per_chunk, stop)) for i in range(start, stop, rows_per_chunk)]
+
+
+def split_excel(data, max_chars, sheet_format=None):
+    """
+    Splits parsed Excel data into chunks of at most ~max_chars characters.
+
+    Each sheet is kept whole when it fits; larger sheets are cut at blank-row
+    boundaries between tables, and tables that are still too large are cut into
+    row ranges. Sheets are serialized with `sheet_format` (see utils.serializer), which
+    keeps the Excel coordinates so chunks stay traceable. Returns a list of (label, text) pairs.
+    """
+    chunks = []
+    for sheet, content in data.items():
+        df = content['values']
+        legend = format_legend(sheet_format)
+        legend = legend + "\n" if legend else ""
+        header = f"\n--- SHEET: {sheet} ---\n" + legend
+        text = serialize_sheet(df, sheet_format) + "\n"
+        if len(header) + len(text) <= max_chars:
+            chunks.append((f"Hoja {sheet}", header + text))
+            continue
+
+        ranges = []
+        for start, stop in _blank_row_blocks(df):
+            ranges.extend(_split_oversized(df, start, stop, max_chars, sheet_format))
+
+        # Pack consecutive ranges into chunks up to the budget
+        current = []
+        current_chars = 0
+        packed = []
+        for start, stop in ranges:
+            size = len(serialize_sheet(df.iloc[start:stop], sheet_format))
+            if current and current_chars + size > max_chars:
+                packed.append(current)
+                current, current_chars = [], 0
+            current.append((start, stop))
+            current_chars += size
+        if current:
+            packed.append(current)
+
+        for group in packed:
+            # 1-based Excel rows
+            first, last = group[0][0] + 1, group[-1][1]
+            rows = pd.concat([df.iloc[start:stop] for start, stop in group])
+            chunks.append((
+                f"Hoja {sheet} - Filas {first}-{last}",
+                f"\n--- SHEET: {sheet} (filas {first}-{last}) ---\n" + legend
+                + serialize_sheet(rows, sheet_format) + "\n",
+            ))
+    return chunks
+
+
+def split_pdf(data, max_chars, sheet_format=None):
+    """
+    Splits PDF text into chunks of whole pages of at most ~max_chars characters.
+
+    Works on a PdfDocument (page boundaries are exact, tables serialized as grids) or
+    on plain text, in which case the text is cut at line boundaries. Returns a list
+    of (label, text) pairs.
+    """
+    if hasattr(data, "n_pages"):
+        units = [(i + 1, data.pages_layout_text(i, i + 1, sheet_format)) for i in range(data.n_pages)]
+        label_prefix = "Páginas"
+    else:
+        units = list(enumerate(str(data).splitlines(keepends=True), 1))
+        label_prefix = "Líneas"
+
+    chunks = []
+    current = []
+    current_chars = 0
+    for number, text in units:
+        if current and current_chars + len(text) > max_chars:
+            chunks.append(current)
+            current, current_chars = [], 0
+        current.append((number, text))
+        current_chars += len(text)
+    if current:
+        chunks.append(current)
+
+    return [
+        (f"{label_prefix} {group[0][0]}-{group[-1][0]}", "".join(text for _, text in group))
+        for group in chunks
+    ]
+
+
+def split_document(data, max_chars, sheet_format=None):
+    """
+    Splits parsed Excel or PDF data along sheet, table or page boundaries.
+    """
+    if isinstance(data, dict):
+        return split_excel(data, max_chars, sheet_format)
+    return split_pdf(data, max_chars, sheet_format)
@@ -0,0 +1,124 @@
+import csv
+
+import pandas as pd
+
+CSV_FENCE = "```csv"
+
+
+class IncrementalCsvDecoder:
+    """
+    Decodes the first ```csv block of a streamed model response as it arrives.
+
+    Feed it the text deltas in order; every complete CSV line inside the fence is
+    parsed as soon as its newline arrives (quoted fields spanning several lines are
+    held until their closing quote). Text outside the block is kept as narrative.
+    """
+
+    def __init__(self):
+        self.state = "before"  # before -> inside -> after the csv fence
+        self.header = None
+        self.rows = []
+        self.csv_lines = []
+        self.narrative = ""
+        self._buffer = ""
+        self._pending = ""
+
+    def feed(self, delta):
+        """
+        Consumes a text delta and returns the list of rows completed by it.
+        """
+        self._buffer += delta
+        new_rows = []
+        while True:
+            if self.state == "before":
+                start = self._buffer.find(CSV_FENCE)
+                if start == -1:
+                    # Keep a tail in case the fence is split across deltas
+                    keep = len(CSV_FENCE) - 1
+                    cut = max(0, len(self._buffer) - keep)
+                    self.narrative += self._buffer[:cut]
+                    self._buffer = self._buffer[cut:]
+                    break
+                newline = self._buffer.find("\n", start)
+                if newline == -1:
+                    self.narrative += self._buffer[:start]
+                    self._buffer = self._buffer[start:]
+                    break
+                self.narrative += self._buffer[:start]
+                self._buffer = self._buffer[newline + 1:]
+                self.state = "inside"
+            elif self.state == "inside":
+                newline = self._buffer.find("\n")
+                if newline == -1:
+                    break
+                line = self._buffer[:newline].rstrip("\r")
+                self._buffer = self._buffer[newline + 1:]
+                if self._is_closing_fence(line):
+                    self.state = "after"
+                    continue
+                row = self._consume_line(line)
+                if row is not None:
+                    new_rows.append(row)
+            else:
+                self.narrative += self._buffer
+                self._buffer = ""
+                break
+        return new_rows
+
+    def finish(self):
+        """
+        Flushes the last line once the stream ends (or is cut off).
+        Returns the rows completed by it.
+        """
+        new_rows = []
+        if self.state == "inside" and self._buffer:
+            line = self._buffer.rstrip("\r")
+            self._buffer = ""
+            if not self._is_closing_fence(line):
+                row = self._consume_line(line)
+                if row is not None:
+                    new_rows.append(row)
+            self.state = "after"
+        elif self.state != "inside":
+            self.narrative += self._buffer
+            self._buffer = ""
+        return new_rows
+
+    @staticmethod
+    def _is_closing_fence(line):
+        return line.strip().startswith("```")
+
+    def _consume_line(self, line):
+        text = self._pending + line
+        if text.count('"') % 2:
+            # Inside a quoted field that continues on the next line
+            self._pending = text + "\n"
+            return None
+        self._pending = ""
+        if not text.strip():
+            return None
+        self.csv_lines.append(text)
+        row = next(csv.reader([text], quotechar='"', skipinitialspace=True))
+        if self.header is None:
+            self.header = row
+            return None
+        self.rows.append(row)
+        return row
+
+    def csv_text(self):
+        """
+        The CSV decoded so far (header included), or None if no row has arrived.
+        """
+        if not self.csv_lines:
+            return None
+        return "\n".join(self.csv_lines)
+
+    def dataframe(self):
+        """
+        The rows decoded so far as a DataFrame; rows are padded/cut to the header width.
+        """
+        if self.header is None:
+            return pd.DataFrame()
+        width = len(self.header)
+        rows = [(row + [None] * width)[:width] for row in self.rows]
+        return pd.DataFrame(rows, columns=self.header)
@@ -1,65 +1,383 @@
+import numpy as np
 import pandas as pd
-import pypdf
-import io
+import os
 
 import openpyxl
+from pandas.io.parsers import TextParser
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from openpyxl.utils import get_column_letter
 
-def parse_excel(file):
+try:
+    # openpyxl's worksheet reader is private; it lets one pass over the sheet XML
+    # yield values and formulas. Without it sheets are read through iter_rows.
+    from openpyxl.worksheet._reader import WorkSheetParser, FORMULA_TAG
+except ImportError:
+    WorkSheetParser = FORMULA_TAG = None
+
+from utils.instrumentation import span
+from utils.pdf_document import PdfDocument
+from utils.spill import frame_nbytes, spill_frame
+
+# Bump whenever parser output changes so cached parses are invalidated
+PARSER_VERSION = 6
+
+# Rows read from the sheet XML before they are converted to typed columns
+EXCEL_CHUNK_ROWS = 5000
+# Text columns become categorical when at most this share of their values is distinct
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+# Below this page count, process start-up costs more than it saves
+PDF_PARALLEL_MIN_PAGES = 48
+
+
+if WorkSheetParser is not None:
+    class _ValuesAndFormulasParser(WorkSheetParser):
+        """
+        Worksheet XML parser that reads the cached value of every cell and, in the
+        same pass, records the formula text of the cells that have one.
+        """
+
+        def __init__(self, *args, formulas=None, **kwargs):
+            super().__init__(*args, data_only=True, **kwargs)
+            self.formulas = {} if formulas is None else formulas
+
+        def parse_cell(self, element):
+            cell = super().parse_cell(element)
+            if element.find(FORMULA_TAG) is not None:
+                # parse_formula also expands shared formulas for dependent cells
+                formula = self.parse_formula(element)
+                if isinstance(formula, str):
+                    coordinate = f"{get_column_letter(cell['column'])}{cell['row']}"
+                    self.formulas[coordinate] = formula
+            return cell
+
+
+def _private_reader_available(wb):
+    """
+    Whether this openpyxl version still has the reader internals _private_rows uses.
+    """
+    return (WorkSheetParser is not None and hasattr(wb, "_date_formats") and hasattr(wb, "_timedelta_formats")
+            and all(hasattr(ws, "_get_source") and hasattr(ws, "_shared_strings") for ws in wb.worksheets))
+
+
+def _convert_cell(cell):
+    """
+    Mirrors the cell conversion pandas applies in read_excel(engine='openpyxl').
+    """
+    value = cell['value']
+    if value is None or cell['data_type'] == TYPE_ERROR:
+        return ""
+    if cell['data_type'] == TYPE_NUMERIC and not isinstance(value, bool):
+        if int(value) == value:
+            return int(value)
+        return float(value)
+    return value
+
+
+def _private_rows(wb, ws, formulas):
+    """
+    (row number, cells) for the rows of a read-only worksheet, from a single pass of
+    the private reader; formulas are added to `formulas` as they are met.
+    """
+    with ws._get_source() as src:
+        parser = _ValuesAndFormulasParser(
+            src,
+            ws._shared_strings,
+            epoch=wb.epoch,
+            date_formats=wb._date_formats,
+            timedelta_formats=wb._timedelta_formats,
+            formulas=formulas,
+        )
+        yield from parser.parse()
+
+
+def _public_rows(ws, formula_ws, formulas):
+    """
+    Same rows (cells as the private reader's dicts) through the public iter_rows API.
+    The formulas come from `formula_ws`, the same sheet of the workbook opened with
+    data_only=False, read in step with the values.
+    """
+    for row_idx, (cells, formula_cells) in enumerate(zip(ws.iter_rows(), formula_ws.iter_rows()), 1):
+        for cell in formula_cells:
+            if cell.data_type == "f" and isinstance(cell.value, str):
+                formulas[cell.coordinate] = cell.value
+        # Missing cells come back as EmptyCell placeholders, without a column
+        yield row_idx, [{"column": cell.column, "value": cell.value, "data_type": cell.data_type}
+                        for cell in cells if hasattr(cell, "column")]
+
+
+def _rows_frame(pending):
+    """
+    Converts buffered non-empty rows [(0-based row position, cells)] to a DataFrame
+    indexed by row position, with the type inference read_excel(header=None) applies.
+    Returns the frame and the text and boolean cells of the columns that were
+    converted to numbers ({column: {row position: cell}}); see _merge_column.
+    """
+    width = max(len(cells) for _, cells in pending)
+    frame = TextParser([cells + [""] * (width - len(cells)) for _, cells in pending], header=None).read()
+    frame.index = [position for position, _ in pending]
+    converted = {}
+    for col in frame.columns:
+        if frame[col].dtype.kind in "iuf":
+            cells = {}
+            for position, row in pending:
+                value = row[col] if col < len(row) else ""
+                if isinstance(value, bool) or (isinstance(value, str) and value):
+                    cells[position] = value
+            if cells:
+                converted[col] = cells
+    return frame, converted
+
+
+def _type_family(dtype):
+    if dtype.kind in "biuf":
+        return "number"
+    if dtype.kind == "M":
+        return "date"
+    if isinstance(dtype, pd.StringDtype):
+        return "text"
+    return "object"
+
+
+def _object_piece(piece, cells):
+    """
+    The cell values of a typed chunk piece as an object column: integers where the
+    cell was an integer (see _convert_cell), datetimes, and the converted text and
+    boolean `cells` put back.
+    """
+    if piece.dtype.kind == "f":
+        values = [int(value) if value.is_integer() else value for value in piece.to_numpy().tolist()]
+    elif piece.dtype.kind == "M":
+        values = [np.nan if value is pd.NaT else value.to_pydatetime() for value in piece]
+    else:
+        values = piece.astype(object).tolist()
+    values = pd.Series(values, index=piece.index, dtype=object)
+    for position, value in cells.items():
+        values[position] = value
+    return values
+
+
+def _merge_column(pieces, converted, n_rows):
+    """
+    Joins the chunk pieces of a column with the type read_excel would infer over the
+    whole column, so the result does not depend on the chunk size: numbers keep a
+    common numeric dtype, and any other mix becomes an object column of the cell
+    values as the workbook holds them (e.g. "12" stays text next to "BALANCE").
+    Pieces with only empty cells do not take part in the inference.
+    """
+    pieces = [(piece, cells) for piece, cells in zip(pieces, converted) if piece.notna().any()]
+    if not pieces:
+        return pd.Series(np.nan, index=range(n_rows))
+    families = {_type_family(piece.dtype) for piece, _ in pieces}
+    kinds = {piece.dtype.kind for piece, _ in pieces}
+    if families == {"number"} and len(kinds) > 1:
+        target = np.float64 if "f" in kinds else np.int64
+        pieces = [piece.astype(target) for piece, _ in pieces]
+    elif len(families) > 1:
+        pieces = [_object_piece(piece, cells) for piece, cells in pieces]
+    else:
+        pieces = [piece for piece, _ in pieces]
+    series = pieces[0] if len(pieces) == 1 else pd.concat(pieces)
+    return series.reindex(range(n_rows))
+
+
+def _compact_column(series):
+    """
+    Smallest dtype that holds the column without changing its values: float32 when
+    the float64 values survive the round trip, the narrowest integer type, and
+    categorical codes for text or mixed columns with repeated values (not for
+    columns holding booleans, which would be merged with the numbers 0 and 1).
+    """
+    kind = series.dtype.kind
+    if kind == "f":
+        values = series.to_numpy()
+        narrow = values.astype(np.float32)
+        if np.array_equal(narrow.astype(np.float64), values, equal_nan=True):
+            return pd.Series(narrow, index=series.index, name=series.name)
+        return series
+    if kind in "iu":
+        return pd.to_numeric(series, downcast="integer")
+    if kind in "OT" or pd.api.types.is_string_dtype(series.dtype):
+        non_null = series.dropna()
+        if (len(non_null) and non_null.nunique() <= CATEGORY_MAX_UNIQUE_RATIO * len(non_null)
+                and not any(isinstance(value, (bool, np.bool_)) for value in non_null.to_numpy())):
+            return series.astype("category")
+    return series
+
+
+def _merge_chunks(chunks):
+    """
+    Joins the row chunks [(frame, converted cells)] of a sheet into one DataFrame with
+    compact column dtypes. Empty rows were never buffered; they are restored here as
+    missing values so row positions keep matching the workbook.
+    """
+    if not chunks:
+        return pd.DataFrame()
+    n_rows = chunks[-1][0].index[-1] + 1
+    width = max(len(chunk.columns) for chunk, _ in chunks)
+    columns = {}
+    for col in range(width):
+        present = [(chunk[col], converted.pop(col, {})) for chunk, converted in chunks if col in chunk.columns]
+        columns[col] = _compact_column(_merge_column(*zip(*present), n_rows))
+        for chunk, _ in chunks:
+            if col in chunk.columns:
+                del chunk[col]
+    return pd.DataFrame(columns)
+
+
+def _stream_sheet(wb, ws, chunk_rows=EXCEL_CHUNK_ROWS, memory_budget=None, formula_ws=None):
+    """
+    Streams a read-only worksheet once, returning (values DataFrame, formulas dict).
+
+    Rows are buffered `chunk_rows` at a time and converted to typed columns, so the
+    sheet is never held as Python lists of cells. When the converted chunks exceed
+    `memory_budget` bytes, MemoryError is raised before the sheet is complete.
+    `formula_ws` (the sheet opened with data_only=False) is only needed when the
+    private reader is not available (see _public_rows).
+    """
+    chunks = []
+    pending = []
+    chunk_bytes = 0
+    formulas = {}
+    rows = _public_rows(ws, formula_ws, formulas) if formula_ws is not None else _private_rows(wb, ws, formulas)
+    for row_idx, cells in rows:
+        row = []
+        for cell in cells:
+            while len(row) < cell['column'] - 1:
+                row.append("")
+            row.append(_convert_cell(cell))
+        # Trim trailing empty cells like pandas does; fully empty rows are skipped
+        while row and row[-1] == "":
+            row.pop()
+        if row:
+            pending.append((row_idx - 1, row))
+        if len(pending) >= chunk_rows:
+            chunks.append(_rows_frame(pending))
+            pending = []
+            chunk_bytes += frame_nbytes(chunks[-1][0])[0]
+            if memory_budget is not None and chunk_bytes > memory_budget:
+                raise MemoryError(
+                    f"La hoja '{ws.title}' supera el límite de memoria configurado "
+                    f"({memory_budget / 1024 ** 2:,.0f} MB disponibles)"
+                )
+    if pending:
+        chunks.append(_rows_frame(pending))
+
+    return _merge_chunks(chunks), formulas
+
+
+def _excel_settings(memory_limit_mb, spill_sheet_mb, spill_dir):
+    """
+    Resolves the ingestion limits from the arguments or the environment
+    (EXCEL_MEMORY_LIMIT_MB, EXCEL_SPILL_SHEET_MB, EXCEL_SPILL_DIR); 0 disables a limit.
+    """
+    if memory_limit_mb is None:
+        memory_limit_mb = float(os.getenv("EXCEL_MEMORY_LIMIT_MB", "0"))
+    if spill_sheet_mb is None:
+        spill_sheet_mb = float(os.getenv("EXCEL_SPILL_SHEET_MB", "256"))
+    return memory_limit_mb * 1024 ** 2 or None, spill_sheet_mb * 1024 ** 2 or None, spill_dir
+
+
+def _parse_excel_fallback(file):
+    """
+    Reads values with pandas only (used for .xls files, which openpyxl cannot open).
+    """
+    file.seek(0)
+    with span("parse_excel.read_excel"):
+        sheet_values = pd.read_excel(file, sheet_name=None, header=None)
+    return {
+        sheet_name: {
+            "values": pd.DataFrame({col: _compact_column(values[col]) for col in values.columns}),
+            "formulas": {}
+        }
+        for sheet_name, values in sheet_values.items()
+    }
+
+
+def parse_excel(file, memory_limit_mb=None, spill_sheet_mb=None, spill_dir=None, chunk_rows=EXCEL_CHUNK_ROWS):
     """
     Parses an Excel file and returns a dictionary for each sheet containing values and formulas.
+    Each worksheet is streamed once in read-only mode; cached values and formula
+    text are collected from the same pass over the sheet XML.
+
+    Memory is bounded as the sheets are read: rows are converted in chunks of
+    `chunk_rows` to compact column dtypes, sheets larger than `spill_sheet_mb` (or
+    that would push the workbook past `memory_limit_mb`) have their numeric and
+    categorical columns spilled to disk and memory-mapped back (utils.spill), and
+    MemoryError is raised as soon as what stays in memory exceeds `memory_limit_mb`.
+    Defaults come from the environment (see _excel_settings).
     """
-    # 1. Read values using pandas
+    memory_limit, spill_sheet_bytes, spill_dir = _excel_settings(memory_limit_mb, spill_sheet_mb, spill_dir)
     file.seek(0)
-    # Determine engine based on file type or let pandas decide, but we need to handle the openpyxl error specifically for .xls
-    # We'll try to read with pandas first. Pandas usually auto-detects.
-    # For .xls we need 'xlrd', for .xlsx 'openpyxl'.
-    
     try:
-        xls = pd.ExcelFile(file)
-    except Exception:
-        # Fallback if auto-detection fails, though it shouldn't with valid files
-        file.seek(0)
-        xls = pd.ExcelFile(file, engine='openpyxl')
-
-    sheet_values = {}
-    for sheet_name in xls.sheet_names:
-        sheet_values[sheet_name] = pd.read_excel(xls, sheet_name=sheet_name, header=None)
-        
-    # 2. Read formulas using openpyxl (ONLY for .xlsx)
-    sheet_formulas = {}
-    try:
-        file.seek(0)
-        wb = openpyxl.load_workbook(file, data_only=False)
-        for sheet_name in wb.sheetnames:
-            ws = wb[sheet_name]
-            formulas = {}
-            for row in ws.iter_rows():
-                for cell in row:
-                    if isinstance(cell.value, str) and cell.value.startswith('='):
-                        formulas[cell.coordinate] = cell.value
-            sheet_formulas[sheet_name] = formulas
+        with span("parse_excel.open"):
+            wb = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
     except Exception as e:
         # This likely means it's an .xls file or not supported by openpyxl
-        # We just skip formula extraction
+        # We skip formula extraction and let pandas pick the engine
         print(f"Could not extract formulas (likely .xls file): {e}")
-        pass
-        
-    # 3. Combine results
+        return _parse_excel_fallback(file)
+
+    formula_wb = None
+    if not _private_reader_available(wb):
+        # A second read of the file gives the formula text
+        formula_wb = openpyxl.load_workbook(file, read_only=True, data_only=False, keep_links=False)
+
     sheets_data = {}
-    for sheet_name in sheet_values.keys():
-        sheets_data[sheet_name] = {
-            "values": sheet_values[sheet_name],
-            "formulas": sheet_formulas.get(sheet_name, {})
-        }
-        
+    resident = 0
+    try:
+        for ws in wb.worksheets:
+            with span("parse_excel.sheet", sheet=ws.title) as attrs:
+                budget = memory_limit - resident if memory_limit else None
+                formula_ws = formula_wb[ws.title] if formula_wb is not None else None
+                values, formulas = _stream_sheet(wb, ws, chunk_rows, budget, formula_ws)
+                nbytes, spillable = frame_nbytes(values)
+                if spillable and ((spill_sheet_bytes and nbytes > spill_sheet_bytes)
+                                  or (memory_limit and resident + nbytes > memory_limit)):
+                    with span("parse_excel.spill", sheet=ws.title, mb=round(spillable / 1024 ** 2, 1)):
+                        values = spill_frame(values, spill_dir)
+                    nbytes -= spillable
+                resident += nbytes
+                attrs.update(rows=values.shape[0], columns=values.shape[1], formulas=len(formulas),
+                             mb=round(nbytes / 1024 ** 2, 1))
+            if memory_limit and resident > memory_limit:
+                raise MemoryError(
+                    f"El archivo supera el límite de memoria configurado ({memory_limit / 1024 ** 2:,.0f} MB) "
+                    f"al leer la hoja '{ws.title}'"
+                )
+            sheets_data[ws.title] = {
+                "values": values,
+                "formulas": formulas
+            }
+    finally:
+        wb.close()
+        if formula_wb is not None:
+            formula_wb.close()
+
     return sheets_data
 
-def parse_pdf(file):
+def _default_pdf_workers():
+    return int(os.getenv("PDF_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def parse_pdf(file, workers=None, parallel_min_pages=PDF_PARALLEL_MIN_PAGES, detect_tables=None):
     """
-    Extracts text from a PDF file.
+    Opens a PDF file as a lazy, page-indexed PdfDocument.
+    Pages are extracted on demand; the document still behaves like the full text string.
+    When the whole text is needed, documents with at least `parallel_min_pages` pages
+    are extracted by a pool of `workers` processes (PDF_WORKERS or the CPU count by default).
+    Tables are reconstructed from the text layout of each page unless `detect_tables`
+    (PDF_TABLES by default, on) is off.
     """
-    pdf_reader = pypdf.PdfReader(file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    if detect_tables is None:
+        detect_tables = os.getenv("PDF_TABLES", "1").lower() not in ("0", "false", "no")
+    file.seek(0)
+    with span("parse_pdf.open") as attrs:
+        document = PdfDocument(
+            file.read(),
+            workers=workers or _default_pdf_workers(),
+            parallel_min_pages=parallel_min_pages,
+            detect_tables=detect_tables,
+        )
+        attrs["pages"] = document.n_pages
+    return document
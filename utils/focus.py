@@ -0,0 +1,160 @@
+import re
+
+from utils.pdf_document import PDF_TABLE_HEADER
+from utils.retrieval import NEIGHBOUR_CHUNKS, TOP_CHUNKS
+from utils.serializer import format_legend
+
+# Extra rows / characters of the neighbouring pages sent around the selected report,
+# so headers and totals just outside the detected range are not lost
+FOCUS_ROW_MARGIN = 5
+FOCUS_PAGE_MARGIN_CHARS = 1500
+
+SHEET_PATTERN = re.compile(r"Hoja\s*:?\s*(.+?)(?:\s+-\s+Filas|\s*\(|,|$)", re.IGNORECASE)
+ROWS_PATTERN = re.compile(r"Filas?\s*(?:aprox\.?\s*)?(\d+)\s*(?:-|–|a|al|hasta)\s*(\d+)", re.IGNORECASE)
+PAGES_PATTERN = re.compile(r"P[áa]g(?:ina)?s?\.?\s*(\d+)(?:\s*(?:-|–|a|al|y)\s*(\d+))?", re.IGNORECASE)
+
+
+def parse_location(location):
+    """
+    Parses a scan location into its parts.
+
+    Accepts the strings the scans produce ("Hoja: Resultados - Filas 40-80",
+    "Página 3 (Superior)", "Páginas 3-5") or a scan record; records from the local
+    detector already carry sheet/start_row/end_row. Rows and pages are 1-based.
+    Returns a dict with the keys found (sheet, start_row, end_row, start_page, end_page).
+    """
+    parsed = {}
+    if isinstance(location, dict):
+        for key in ("sheet", "start_row", "end_row"):
+            if location.get(key) is not None:
+                parsed[key] = location[key]
+        location = location.get("location", "")
+        if "start_row" in parsed:
+            return parsed
+
+    location = location or ""
+    sheet_match = SHEET_PATTERN.search(location)
+    if sheet_match and "sheet" not in parsed:
+        parsed["sheet"] = sheet_match.group(1).strip()
+    rows_match = ROWS_PATTERN.search(location)
+    if rows_match:
+        start, end = sorted((int(rows_match.group(1)), int(rows_match.group(2))))
+        parsed["start_row"], parsed["end_row"] = start, end
+    pages_match = PAGES_PATTERN.search(location)
+    if pages_match:
+        start = int(pages_match.group(1))
+        end = int(pages_match.group(2) or start)
+        parsed["start_page"], parsed["end_page"] = sorted((start, end))
+    return parsed
+
+
+def _find_sheet(data, name):
+    if name in data:
+        return name
+    lowered = {str(sheet).strip().lower(): sheet for sheet in data}
+    if name.strip().lower() in lowered:
+        return lowered[name.strip().lower()]
+    for sheet in data:
+        if name.strip().lower() in str(sheet).lower() or str(sheet).lower() in name.strip().lower():
+            return sheet
+    return None
+
+
+def slice_excel(data, parsed, row_margin=FOCUS_ROW_MARGIN):
+    """
+    Returns {sheet: {"values": row slice, "formulas": ...}} for a parsed location,
+    or None when the sheet cannot be resolved. The slice keeps the original index,
+    so serialized coordinates still match the workbook.
+    """
+    if "sheet" not in parsed:
+        return None
+    sheet = _find_sheet(data, parsed["sheet"])
+    if sheet is None:
+        return None
+    content = data[sheet]
+    values = content["values"]
+    if "start_row" in parsed:
+        start = max(0, parsed["start_row"] - 1 - row_margin)
+        stop = min(len(values), parsed["end_row"] + row_margin)
+        if start >= stop:
+            return None
+        values = values.iloc[start:stop]
+    return {sheet: {**content, "values": values}}
+
+
+def slice_pdf(data, parsed, margin_chars=FOCUS_PAGE_MARGIN_CHARS, sheet_format=None):
+    """
+    Returns the prompt text of the located pages of a PdfDocument (tables as grids,
+    see PdfDocument.page_layout_text), plus the end of the previous page and the
+    start of the next one (`margin_chars` each), or None.
+    """
+    if "start_page" not in parsed or not hasattr(data, "n_pages"):
+        return None
+    start = max(0, parsed["start_page"] - 1)
+    stop = min(data.n_pages, parsed["end_page"])
+    if start >= stop:
+        return None
+    before = data.page_layout_text(start - 1, sheet_format)[-margin_chars:] if start > 0 and margin_chars else ""
+    after = data.page_layout_text(stop, sheet_format)[:margin_chars] if stop < data.n_pages and margin_chars else ""
+    return (
+        f"[Extracto del documento: páginas {start + 1}-{stop} de {data.n_pages}]\n"
+        + before + data.pages_layout_text(start, stop, sheet_format) + after
+    )
+
+
+def focus_query(location, title=None):
+    """
+    Retrieval query for a focused report: its title and description.
+    """
+    parts = [title or ""]
+    if isinstance(location, dict):
+        if location.get("title") != title:
+            parts.append(location.get("title") or "")
+        parts.append(location.get("description") or "")
+    return " ".join(part for part in parts if part)
+
+
+def retrieve_pdf(data, parsed, query, sheet_format=None, top_chunks=TOP_CHUNKS, neighbour_chunks=NEIGHBOUR_CHUNKS):
+    """
+    Returns the prompt text of the chunks of a PdfDocument (pages and table blocks,
+    see utils.retrieval) that best match `query`, every chunk of the located pages
+    and the chunks next to those, in document order; or None when nothing matches.
+    """
+    if not hasattr(data, "n_pages"):
+        return None
+    index = data.retrieval_index(sheet_format)
+    pages = range(parsed["start_page"] - 1, parsed["end_page"]) if "start_page" in parsed else ()
+    selected = index.select(query, top_chunks, neighbour_chunks, pages)
+    if not selected:
+        return None
+    parts = [f"[Extracto del documento: {len(selected)} de {len(index)} fragmentos ({data.n_pages} páginas), "
+             "seleccionados por relevancia para el reporte]\n"]
+    if any(index.chunks[i]["table"] for i in selected):
+        legend = format_legend(sheet_format)
+        parts.append(PDF_TABLE_HEADER + (legend + "\n" if legend else ""))
+    previous = None
+    for i in selected:
+        chunk = index.chunks[i]
+        if previous is not None and i != previous + 1:
+            parts.append("\n[...]\n")
+        parts.append(f"\n--- {chunk['label']} ---\n{chunk['text']}")
+        previous = i
+    return "".join(parts)
+
+
+def slice_for_focus(data, location, row_margin=FOCUS_ROW_MARGIN, page_margin_chars=FOCUS_PAGE_MARGIN_CHARS,
+                    sheet_format=None, query=None):
+    """
+    Resolves a scan location into the slice of the document it refers to.
+    For a PDF with a `query` (see focus_query), the slice is the retrieved chunks
+    (retrieve_pdf) instead of the located pages.
+    Returns None when the location cannot be parsed, so callers fall back to the full document.
+    """
+    parsed = parse_location(location)
+    if isinstance(data, dict):
+        return slice_excel(data, parsed, row_margin)
+    if query:
+        retrieved = retrieve_pdf(data, parsed, query, sheet_format)
+        if retrieved is not None:
+            return retrieved
+    return slice_pdf(data, parsed, page_margin_chars, sheet_format)
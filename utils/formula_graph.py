@@ -0,0 +1,789 @@
+import re
+import weakref
+from collections import deque
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+# A minus sign right before the reference, an optional sheet prefix ('Mi Hoja'!, Hoja1!),
+# then a cell, a cell range or a whole-column range (B:B). Function names such as
+# LOG10( are excluded by the lookahead.
+REFERENCE_PATTERN = re.compile(
+    r"(?P<minus>-\s*)?"
+    r"(?:(?P<sheet>'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)?"
+    r"(?<![\w.])(?:"
+    r"\$?(?P<c1>[A-Z]{1,3})\$?(?P<r1>\d+)(?::\$?(?P<c2>[A-Z]{1,3})\$?(?P<r2>\d+))?"
+    r"|\$?(?P<cc1>[A-Z]{1,3}):\$?(?P<cc2>[A-Z]{1,3})"
+    r")(?![\w(!])"
+)
+# The lookahead lets the regex engine skip positions that cannot start a reference
+_REFERENCE_SCAN = re.compile(r"(?=[-'$A-Za-z_])" + REFERENCE_PATTERN.pattern)
+STRING_LITERAL = re.compile(r'"[^"]*"')
+_REF_TERM = r"(?:(?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)?\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?"
+_SUM_TERM = rf"SUMA?\(\s*{_REF_TERM}(?:\s*[,;]\s*{_REF_TERM})*\s*\)"
+# Formulas that only add/subtract references: =SUM(B10:B19), =B5+B9-B12, =SUM(B3:B4)+B8
+AGGREGATE_PATTERN = re.compile(
+    rf"^=\s*[+-]?\s*(?:{_SUM_TERM}|{_REF_TERM})(?:\s*[+-]\s*(?:{_SUM_TERM}|{_REF_TERM}))*\s*$",
+    re.IGNORECASE,
+)
+_DIGITS_TO_ZERO = str.maketrans("123456789", "000000000")
+# Levels of hierarchy written to Nivel_1..Nivel_N
+MAX_LEVELS = 5
+# Aggregate ranges larger than this many cells are not expanded into components
+MAX_EXPANDED_CELLS = 5_000_000
+
+# Cells are packed into int64 keys ordered by sheet, column, row, so the cells of a
+# column range are contiguous in a sorted key array
+_ROW_BITS = 21
+_COL_BITS = 15
+
+
+def _pack(sheet, col, row):
+    return (np.asarray(sheet, dtype=np.int64) << (_ROW_BITS + _COL_BITS)) \
+        | (np.asarray(col, dtype=np.int64) << _ROW_BITS) | np.asarray(row, dtype=np.int64)
+
+
+def _unpack(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    return (keys >> (_ROW_BITS + _COL_BITS),
+            (keys >> _ROW_BITS) & ((1 << _COL_BITS) - 1),
+            keys & ((1 << _ROW_BITS) - 1))
+
+
+def _unique(keys):
+    """
+    Sorted distinct values of an integer array. Sorting is several times faster than
+    np.unique on the large key arrays of a workbook.
+    """
+    keys = np.sort(keys)
+    if len(keys):
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    return keys
+
+
+def _column_numbers(letters):
+    """
+    Array of column letters -> 1-based column numbers; "" -> 0.
+    """
+    codes, unique = pd.factorize(np.asarray(letters, dtype=object))
+    numbers = np.array([column_index_from_string(text) if text else 0 for text in unique], dtype=np.int64)
+    return numbers[codes]
+
+
+def _row_numbers(digits):
+    digits = np.asarray(digits, dtype=object)
+    return np.where(digits == "", "0", digits).astype(np.int64)
+
+
+def _read_numbers(characters, spans):
+    """
+    Integers written at (start, end) spans of an array of character codes.
+    """
+    number = np.zeros(len(spans), dtype=np.int64)
+    size = spans[:, 1] - spans[:, 0]
+    for j in range(int(size.max()) if len(size) else 0):
+        more = size > j
+        number[more] = number[more] * 10 + characters[spans[more, 0] + j] - 48
+    return number
+
+
+def _ancestor_tables(parent, max_depth):
+    """
+    jumps[j][i] is the 2**j-th ancestor of node i (-1 past the root).
+    """
+    jumps = [parent]
+    while (1 << len(jumps)) < max_depth:
+        previous = jumps[-1]
+        jumps.append(np.where(previous >= 0, previous[np.maximum(previous, 0)], -1))
+    return jumps
+
+
+def _ancestor(nodes, steps, jumps):
+    nodes = nodes.copy()
+    for j, table in enumerate(jumps):
+        move = ((steps >> j) & 1).astype(bool) & (nodes >= 0)
+        nodes[move] = table[nodes[move]]
+    return nodes
+
+
+def _steps_to_root(nodes, jumps):
+    """
+    Number of parent links from each node up to its root (capped by the tables' reach;
+    circular chains stop there too).
+    """
+    steps = np.zeros(len(nodes), dtype=np.int64)
+    current = nodes.copy()
+    for j in range(len(jumps) - 1, -1, -1):
+        valid = current >= 0
+        nxt = np.full(len(current), -1)
+        nxt[valid] = jumps[j][current[valid]]
+        move = nxt >= 0
+        current[move] = nxt[move]
+        steps[move] += 1 << j
+    return steps
+
+
+def _sheet_name(raw):
+    if raw.startswith("'"):
+        return raw[1:-1].replace("''", "'")
+    return raw
+
+
+class FormulaGraph:
+    """
+    Dependency graph of the formulas of a parsed workbook (see parse_excel).
+
+    Formulas are parsed in one vectorized pass into a columnar reference table
+    (owner formula, sheet, r1, c1, r2, c2, sign); ranges are kept as rectangles
+    instead of being expanded. Rows and columns are 1-based Excel numbers and cells
+    are returned as (sheet, row, column) tuples. Parent/child lookups and range sums
+    are vectorized NumPy operations over that table and per-sheet prefix sums.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.sheets = list(data)
+        self._sheet_index = {sheet: i for i, sheet in enumerate(self.sheets)}
+        self._numeric = {}
+        self._prefix_sums = {}
+
+        owner_sheets, coordinates, texts = [], [], []
+        for sheet, content in data.items():
+            formulas = content.get("formulas") or {}
+            owner_sheets.extend([self._sheet_index[sheet]] * len(formulas))
+            coordinates.extend(formulas.keys())
+            texts.extend(formulas.values())
+
+        parts = np.array(re.findall(r"\$?([A-Z]{1,3})\$?(\d+)", "\n".join(coordinates)), dtype=object)
+        parts = parts.reshape(-1, 2)
+        self.formula_text = np.array(texts, dtype=object)
+        self.formula_keys = _pack(owner_sheets, _column_numbers(parts[:, 0]), _row_numbers(parts[:, 1]))
+        self._formula_order = np.argsort(self.formula_keys, kind="stable")
+        self._sorted_keys = self.formula_keys[self._formula_order]
+        self._parse_references(owner_sheets)
+
+    def _parse_references(self, owner_sheets):
+        """
+        Builds the reference table. References are searched once per distinct formula
+        shape (its text with the digits zeroed), in the first formula of the shape:
+        every other formula of that shape has its references at the same character
+        offsets, so their row numbers (and sheet prefixes with digits) are read from
+        those offsets for all of them at once.
+        """
+        text = STRING_LITERAL.sub('""', "\n".join(t.replace("\n", " ") for t in self.formula_text))
+        self._joined_text = text
+        self._shape_codes, self._shapes = pd.factorize(
+            np.array(text.translate(_DIGITS_TO_ZERO).split("\n"), dtype=object))
+        columns = ["owner", "sheet", "r1", "c1", "r2", "c2", "sign"]
+        if not len(self.formula_text):
+            self.refs = pd.DataFrame({column: np.zeros(0, dtype=np.int64) for column in columns})
+            return
+
+        # One template per reference of each shape, parsed from the shape's first formula
+        formulas = text.split("\n")
+        codes = self._shape_codes
+        repeated = np.bincount(codes) > 1
+        _, representative = np.unique(codes, return_index=True)
+        found = [_REFERENCE_SCAN.findall(formulas[i]) for i in representative]
+        per_shape = np.fromiter(map(len, found), dtype=np.int64, count=len(found))
+        first = np.cumsum(per_shape) - per_shape
+        found = np.array(list(chain.from_iterable(found)), dtype=object).reshape(-1, 8)
+        minus, prefix, c1, r1, c2, r2, cc1, cc2 = found.T
+        whole = cc1 != ""
+        c1 = _column_numbers(np.where(whole, cc1, c1))
+        c2 = np.where(whole, _column_numbers(cc2), np.where(c2 != "", _column_numbers(c2), c1))
+        r1 = _row_numbers(r1)
+        r2 = np.where(r2 != "", _row_numbers(r2), r1)
+
+        # Expand the templates to every formula of their shape
+        counts = per_shape[codes]
+        owner = np.repeat(np.arange(len(codes)), counts)
+        template = np.repeat(first[codes], counts) + np.arange(len(owner)) \
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        minus, prefix, c1, r1, c2, r2, whole = (
+            column[template] for column in (minus, prefix, c1, r1, c2, r2, whole))
+
+        # Row digits and sheet prefixes of the other formulas of a repeated shape
+        spans = np.zeros((len(found), 3, 2), dtype=np.int64)
+        for shape_id in np.flatnonzero(repeated):
+            for i, match in enumerate(_REFERENCE_SCAN.finditer(formulas[representative[shape_id]])):
+                spans[first[shape_id] + i] = match.span("r1"), match.span("r2"), match.span("sheet")
+        lengths = np.fromiter(map(len, formulas), dtype=np.int64, count=len(formulas))
+        copies = np.flatnonzero(repeated[codes[owner]])
+        at = (np.cumsum(lengths + 1) - lengths - 1)[owner[copies], None, None] + spans[template[copies]]
+        characters = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        r1[copies] = _read_numbers(characters, at[:, 0])
+        r2[copies] = np.where(at[:, 1, 1] > at[:, 1, 0], _read_numbers(characters, at[:, 1]), r1[copies])
+        # A prefix with digits ('Hoja1'!) may name a different sheet in each formula
+        which, raw = pd.factorize(found[:, 1])
+        digits = np.array([any(ch.isdigit() for ch in name) for name in raw], dtype=bool)[which]
+        varying = digits[template[copies]]
+        at, ids = at[varying, 2], copies[varying]
+        for width in np.unique(at[:, 1] - at[:, 0]):
+            same = at[:, 1] - at[:, 0] == width
+            raw, which = np.unique(characters[at[same, 0][:, None] + np.arange(width)], axis=0, return_inverse=True)
+            prefix[ids[same]] = np.array(["".join(map(chr, name)) for name in raw], dtype=object)[which.ravel()]
+
+        # Sheet of each reference: the owner's sheet unless prefixed; unknown
+        # (external) sheets get indices after the workbook's own sheets
+        sheet = np.asarray(owner_sheets, dtype=np.int64)[owner]
+        which, raw = pd.factorize(prefix)
+        numbers = np.full(len(raw), -1)
+        for i, name in enumerate(raw):
+            if name:
+                name = _sheet_name(name)
+                if name not in self._sheet_index:
+                    self._sheet_index[name] = len(self._sheet_index)
+                numbers[i] = self._sheet_index[name]
+        prefixed = prefix != ""
+        sheet[prefixed] = numbers[which[prefixed]]
+
+        if whole.any():
+            # Whole columns are bounded by the used rows of their sheet
+            r1[whole] = 1
+            used_rows = np.array([max(1, len(self._values(name))) for name in self._sheet_index])
+            r2[whole] = used_rows[sheet[whole]]
+        self.refs = pd.DataFrame({
+            "owner": owner.astype(np.int64),
+            "sheet": sheet,
+            "r1": np.minimum(r1, r2), "c1": np.minimum(c1, c2),
+            "r2": np.maximum(r1, r2), "c2": np.maximum(c1, c2),
+            "sign": np.where(minus != "", -1, 1),
+        }, columns=columns)
+
+    # --- Cells ---
+
+    @staticmethod
+    def parse_cell(coordinate):
+        """
+        "B10" / "$B$10" -> (10, 2).
+        """
+        match = re.fullmatch(r"\$?([A-Za-z]{1,3})\$?(\d+)", coordinate.strip())
+        if not match:
+            raise ValueError(f"Invalid cell coordinate '{coordinate}'")
+        return int(match.group(2)), column_index_from_string(match.group(1).upper())
+
+    @staticmethod
+    def coordinate(cell):
+        _, row, col = cell
+        return f"{get_column_letter(col)}{row}"
+
+    def _sheet_names(self):
+        names = [None] * len(self._sheet_index)
+        for name, i in self._sheet_index.items():
+            names[i] = name
+        return names
+
+    def _cells(self, keys):
+        sheets, cols, rows = _unpack(keys)
+        names = self._sheet_names()
+        return [(names[s], int(r), int(c)) for s, r, c in zip(sheets, rows, cols)]
+
+    def _values(self, sheet):
+        content = self.data.get(sheet)
+        return content["values"] if content is not None else pd.DataFrame()
+
+    def _formula_position(self, sheet, coordinate):
+        row, col = self.parse_cell(coordinate)
+        key = _pack(self._sheet_index.get(sheet, -1), col, row)
+        i = np.searchsorted(self._sorted_keys, key)
+        if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+            return self._formula_order[i]
+        return None
+
+    # --- Lookups ---
+
+    def formula(self, sheet, coordinate):
+        position = self._formula_position(sheet, coordinate)
+        return None if position is None else self.formula_text[position]
+
+    def precedents(self, sheet, coordinate):
+        """
+        References the formula of a cell depends on, as (sheet, r1, c1, r2, c2, sign)
+        tuples (r1 == r2 and c1 == c2 for single cells). Empty for constant cells.
+        """
+        position = self._formula_position(sheet, coordinate)
+        if position is None:
+            return []
+        owners = self.refs["owner"].to_numpy()
+        lo, hi = np.searchsorted(owners, [position, position + 1])
+        names = self._sheet_names()
+        return [
+            (names[s], int(r1), int(c1), int(r2), int(c2), int(sign))
+            for s, r1, c1, r2, c2, sign in self.refs.iloc[lo:hi][
+                ["sheet", "r1", "c1", "r2", "c2", "sign"]].itertuples(index=False)
+        ]
+
+    def dependents(self, sheet, coordinate):
+        """
+        Formula cells that reference a cell, directly or through a range.
+        """
+        row, col = self.parse_cell(coordinate)
+        refs = self.refs
+        hits = (
+            (refs["sheet"].to_numpy() == self._sheet_index.get(sheet, -1))
+            & (refs["r1"].to_numpy() <= row) & (row <= refs["r2"].to_numpy())
+            & (refs["c1"].to_numpy() <= col) & (col <= refs["c2"].to_numpy())
+        )
+        owners = _unique(refs["owner"].to_numpy()[hits])
+        return self._cells(self.formula_keys[owners])
+
+    def _numeric_values(self, sheet):
+        if sheet not in self._numeric:
+            values = self._values(sheet)
+            # One conversion over all the cells instead of one per column
+            self._numeric[sheet] = pd.to_numeric(values.to_numpy(dtype=object).ravel(), errors="coerce") \
+                .astype(float).reshape(values.shape) if not values.empty else np.zeros((0, 0))
+        return self._numeric[sheet]
+
+    def value(self, sheet, row, col):
+        """
+        Numeric cached value of a cell (NaN when empty or not numeric).
+        """
+        numeric = self._numeric_values(sheet)
+        if 1 <= row <= numeric.shape[0] and 1 <= col <= numeric.shape[1]:
+            return numeric[row - 1, col - 1]
+        return np.nan
+
+    def range_sum(self, sheet, reference):
+        """
+        Sum of the numeric cached values of a range ("B10:B19", "B10" or
+        "Hoja!B10:C12") in O(1) from per-sheet 2D prefix sums.
+        """
+        match = REFERENCE_PATTERN.fullmatch(reference.strip())
+        if not match or not match.group("c1"):
+            raise ValueError(f"Invalid range '{reference}'")
+        if match.group("sheet"):
+            sheet = _sheet_name(match.group("sheet"))
+        r1, c1 = int(match.group("r1")), column_index_from_string(match.group("c1"))
+        r2 = int(match.group("r2") or r1)
+        c2 = column_index_from_string(match.group("c2")) if match.group("c2") else c1
+        return self._rectangle_sum(sheet, *sorted((r1, r2)), *sorted((c1, c2)))
+
+    def _rectangle_sum(self, sheet, r1, r2, c1, c2):
+        if sheet not in self._prefix_sums:
+            numeric = np.nan_to_num(self._numeric_values(sheet))
+            prefix = np.zeros((numeric.shape[0] + 1, numeric.shape[1] + 1))
+            prefix[1:, 1:] = numeric.cumsum(axis=0).cumsum(axis=1)
+            self._prefix_sums[sheet] = prefix
+        prefix = self._prefix_sums[sheet]
+        r1, c1 = max(r1, 1), max(c1, 1)
+        r2, c2 = min(r2, prefix.shape[0] - 1), min(c2, prefix.shape[1] - 1)
+        if r1 > r2 or c1 > c2:
+            return 0.0
+        return float(prefix[r2, c2] - prefix[r1 - 1, c2] - prefix[r2, c1 - 1] + prefix[r1 - 1, c1 - 1])
+
+    # --- DAG ---
+
+    def _column_spans(self, refs):
+        """
+        One row per (reference, column) of a reference table: (ref index, sheet, col, r1, r2).
+        """
+        widths = (refs["c2"] - refs["c1"] + 1).to_numpy()
+        index = np.repeat(np.arange(len(refs)), widths)
+        offsets = np.arange(len(index)) - np.repeat(np.cumsum(widths) - widths, widths)
+        return (index, refs["sheet"].to_numpy()[index], refs["c1"].to_numpy()[index] + offsets,
+                refs["r1"].to_numpy()[index], refs["r2"].to_numpy()[index])
+
+    def edges(self):
+        """
+        Formula-to-formula edges as (source, target) arrays of formula positions:
+        target's formula reads source's cell, directly or through a range.
+        """
+        index, sheet, col, r1, r2 = self._column_spans(self.refs)
+        lo = np.searchsorted(self._sorted_keys, _pack(sheet, col, r1), side="left")
+        hi = np.searchsorted(self._sorted_keys, _pack(sheet, col, r2), side="right")
+        counts = hi - lo
+        span = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(span)) - np.repeat(np.cumsum(counts) - counts, counts)
+        sources = self._formula_order[lo[span] + offsets]
+        targets = self.refs["owner"].to_numpy()[index[span]]
+        return sources, targets
+
+    def topological_order(self):
+        """
+        Formula cells ordered so every cell comes after the formula cells it depends on.
+        Returns (order, cyclic) where cyclic lists the cells caught in circular references.
+        """
+        n = len(self.formula_keys)
+        sources, targets = self.edges()
+        indegree = np.bincount(targets, minlength=n)
+        order_by_source = np.argsort(sources, kind="stable")
+        starts = np.searchsorted(sources[order_by_source], np.arange(n + 1))
+        adjacency = targets[order_by_source].tolist()
+        starts = starts.tolist()
+        indegree = indegree.tolist()
+
+        queue = deque(np.flatnonzero(np.asarray(indegree) == 0).tolist())
+        order = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for target in adjacency[starts[node]:starts[node + 1]]:
+                indegree[target] -= 1
+                if indegree[target] == 0:
+                    queue.append(target)
+        cyclic = np.flatnonzero(np.asarray(indegree) > 0)
+        return self._cells(self.formula_keys[order]), self._cells(self.formula_keys[cyclic])
+
+    # --- Hierarchy ---
+
+    def aggregate_mask(self):
+        """
+        Formulas that only add/subtract references (SUM ranges, A+B-C).
+        """
+        if not len(self.formula_text):
+            return np.zeros(0, dtype=bool)
+        # Whether a formula matches does not depend on its digits (nor on its string
+        # literals, blanked in the joined text), so the pattern runs once per distinct
+        # shape ("=SUM(B0:B00)") instead of once per formula
+        return np.array([bool(AGGREGATE_PATTERN.match(shape)) for shape in self._shapes],
+                        dtype=bool)[self._shape_codes]
+
+    def _filled_at(self, sheets, rows, cols):
+        """
+        Whether each (sheet, row, col) holds a value or a formula.
+        """
+        filled = np.zeros(len(rows), dtype=bool)
+        for sheet, name in enumerate(self._sheet_names()):
+            here = sheets == sheet
+            if not here.any() or name not in self.data:
+                continue
+            mask = self._values(name).notna().to_numpy()
+            r, c = rows[here] - 1, cols[here] - 1
+            inside = (r < mask.shape[0]) & (c < mask.shape[1])
+            filled[np.flatnonzero(here)[inside]] = mask[r[inside], c[inside]]
+        empty = np.flatnonzero(~filled)
+        if len(self._sorted_keys) and len(empty):
+            keys = _pack(sheets[empty], cols[empty], rows[empty])
+            i = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+            filled[empty] = self._sorted_keys[i] == keys
+        return filled
+
+    def components(self):
+        """
+        Components of every aggregate formula as a DataFrame (owner, key, sign):
+        ranges are expanded to their non-empty cells, single references are kept as is.
+        """
+        aggregate = self.aggregate_mask()
+        refs = self.refs[aggregate[self.refs["owner"].to_numpy()]] if len(self.refs) else self.refs
+        sizes = ((refs["r2"] - refs["r1"] + 1) * (refs["c2"] - refs["c1"] + 1)).to_numpy()
+        refs = refs[np.cumsum(sizes) <= MAX_EXPANDED_CELLS]
+        sizes = sizes[:len(refs)]
+        index = np.repeat(np.arange(len(refs)), sizes)
+        offsets = np.arange(len(index)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        widths = (refs["c2"] - refs["c1"] + 1).to_numpy()[index]
+        rows = refs["r1"].to_numpy()[index] + offsets // widths
+        cols = refs["c1"].to_numpy()[index] + offsets % widths
+        sheets = refs["sheet"].to_numpy()[index]
+        single = (sizes == 1)[index]
+        keep = single | self._filled_at(sheets, rows, cols)
+        owner = refs["owner"].to_numpy()[index]
+        keys = _pack(sheets, cols, rows)
+        keep &= keys != self.formula_keys[owner]
+        return pd.DataFrame({
+            "owner": owner[keep],
+            "key": keys[keep],
+            "sign": refs["sign"].to_numpy()[index][keep],
+        })
+
+    @staticmethod
+    def relation_text(formulas):
+        """
+        Relacion_Celdas text for formulas: "=SUM($B$10:$B$19)" -> "Suma(B10:B19)".
+        """
+        # One substitution pass over all formulas joined by newlines
+        text = "\n".join(formula.replace("\n", " ") for formula in formulas)
+        text = re.sub(r"^=", "", text.replace("$", "").replace(" ", "").replace("\t", ""), flags=re.MULTILINE)
+        text = re.sub(r"\bSUMA?\(", "Suma(", text, flags=re.IGNORECASE)
+        return np.array(text.split("\n"), dtype=object) if len(formulas) else np.zeros(0, dtype=object)
+
+    def structure(self, max_levels=MAX_LEVELS, max_depth=128):
+        """
+        Hierarchy derived from the aggregate formulas as a DataFrame, one row per cell
+        that takes part in one (see FormulaStructure).
+        """
+        return FormulaStructure(self, max_levels, max_depth).frame()
+
+
+class FormulaStructure:
+    """
+    Hierarchy derived from the aggregate formulas of a workbook: the cells that take
+    part in one (totals and their components) and the parent of each. A component
+    belongs to the most specific aggregate that includes it (the one with the fewest
+    components).
+
+    The rows of the structure (labels, levels, values, relation text) are built by
+    frame() only for the cells asked for: a prompt shows a few hundred totals per sheet
+    and an analysis CSV points to a few hundred cells, while the totals of a large
+    workbook add up hundreds of thousands of them. The workbook's values are held
+    through weak references, so a cached structure never keeps it alive.
+    """
+
+    def __init__(self, graph, max_levels=MAX_LEVELS, max_depth=128):
+        self.max_levels = max_levels
+        self.max_depth = max_depth
+        self.columns = ["Hoja", "Celda", "Concepto", "Valor", "Es_Total"] + \
+            [f"Nivel_{i}" for i in range(1, max_levels + 1)] + ["Relacion_Celdas", "Padre"]
+        self.sheet_names = graph._sheet_names()
+        self._values = {sheet: weakref.ref(content["values"]) for sheet, content in graph.data.items()}
+
+        components = graph.components()
+        owner, key = components["owner"].to_numpy(), components["key"].to_numpy()
+        totals = _unique(owner)
+        total_keys = graph.formula_keys[totals]
+        # Most specific aggregate first, so the first row of each key is its parent
+        order = np.lexsort((owner, np.bincount(owner)[owner] if len(owner) else owner, key))
+        first = np.concatenate(([True], key[order][1:] != key[order][:-1])) if len(order) else order.astype(bool)
+        child_keys, parent_owner = key[order][first], owner[order][first]
+
+        self.nodes = _unique(np.concatenate([total_keys, child_keys]))
+        node_of = np.zeros(len(graph.formula_keys), dtype=np.int64)
+        node_of[totals] = np.searchsorted(self.nodes, total_keys)
+        self.parent = np.full(len(self.nodes), -1)
+        self.parent[np.searchsorted(self.nodes, child_keys)] = node_of[parent_owner]
+        self.is_total = np.zeros(len(self.nodes), dtype=bool)
+        self.is_total[node_of[totals]] = True
+        # Positions of the totals and their formulas, in position order
+        by_position = np.argsort(node_of[totals])
+        self._totals = node_of[totals][by_position]
+        self._formulas = graph.formula_text[totals[by_position]]
+        self.sheets, self.cols, self.rows = _unpack(self.nodes)
+        self._jumps = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def empty(self):
+        return not len(self.nodes)
+
+    def totals(self, sheet, rows=None):
+        """
+        Positions of the totals of a sheet in workbook order; `rows` (0-based) limits
+        them to those rows.
+        """
+        number = self.sheet_names.index(sheet) if sheet in self.sheet_names else -1
+        found = self._totals[self.sheets[self._totals] == number]
+        if rows is not None:
+            found = found[np.isin(self.rows[found] - 1, np.asarray(rows))]
+        return found[np.lexsort((self.cols[found], self.rows[found]))]
+
+    def positions(self, sheets, cells):
+        """
+        Positions of the cells named by arrays of sheet names and coordinates ("B10"),
+        -1 for those outside the structure. Sheet names are compared ignoring case and
+        surrounding spaces.
+        """
+        numbers = {}
+        for i, name in enumerate(self.sheet_names):
+            numbers.setdefault(str(name).strip().lower(), i)
+        sheet = pd.Series(sheets, dtype=object).fillna("").astype(str).str.strip().str.lower() \
+            .map(numbers).fillna(-1).to_numpy(dtype=np.int64)
+        parts = pd.Series(cells, dtype=object).fillna("").astype(str).str.extract(r"^([A-Z]{1,3})(\d{1,7})$")
+        cols = _column_numbers(parts[0].fillna("").to_numpy())
+        rows = _row_numbers(parts[1].fillna("").to_numpy())
+        valid = (sheet >= 0) & (rows > 0) & (rows < 1 << _ROW_BITS)
+        found = np.full(len(sheet), -1)
+        if not len(self.nodes):
+            return found
+        keys = _pack(sheet[valid], cols[valid], rows[valid])
+        i = np.minimum(np.searchsorted(self.nodes, keys), len(self.nodes) - 1)
+        found[np.flatnonzero(valid)] = np.where(self.nodes[i] == keys, i, -1)
+        return found
+
+    def _cells(self, positions):
+        """
+        Label and numeric value of the cells at `positions`. The label is the nearest
+        text cell to the left in the same row, or "Hoja!B10" when there is none. Only
+        the rows of those cells are read from the workbook.
+        """
+        sheets, cols, rows = self.sheets[positions], self.cols[positions], self.rows[positions]
+        labels = np.full(len(positions), None, dtype=object)
+        numbers = np.full(len(positions), np.nan)
+        for sheet in _unique(sheets):
+            reference = self._values.get(self.sheet_names[sheet])
+            values = reference() if reference is not None else None
+            if values is None or values.empty:
+                continue
+            here = np.flatnonzero(sheets == sheet)
+            here = here[rows[here] <= values.shape[0]]
+            block_rows, r = np.unique(rows[here] - 1, return_inverse=True)
+            c = cols[here] - 1
+            cells = values.iloc[block_rows].to_numpy(dtype=object)
+            numeric = pd.to_numeric(cells.ravel(), errors="coerce").astype(float).reshape(cells.shape)
+            inside = c < cells.shape[1]
+            numbers[here[inside]] = numeric[r[inside], c[inside]]
+            # Last text column at or before each column
+            last_text = np.maximum.accumulate(
+                np.where(pd.notna(cells) & np.isnan(numeric), np.arange(cells.shape[1]), -1), axis=1
+            )
+            left = np.minimum(c - 1, cells.shape[1] - 1)
+            label_col = np.where(left >= 0, last_text[r, np.maximum(left, 0)], -1)
+            found = label_col >= 0
+            labels[here[found]] = cells[r[found], label_col[found]]
+        # Whitespace is normalized once per distinct label
+        missing = pd.isna(labels)
+        codes, unique = pd.factorize(labels)
+        normalized = np.array([" ".join(str(label).split()) for label in unique] + [None], dtype=object)
+        labels = normalized[codes]
+        if missing.any():
+            labels[missing] = [f"{self.sheet_names[s]}!{get_column_letter(int(c))}{int(r)}"
+                               for s, c, r in zip(sheets[missing], cols[missing], rows[missing])]
+        return labels, numbers
+
+    def _coordinates(self, positions):
+        cols, rows = self.cols[positions], self.rows[positions]
+        if not len(positions):
+            return np.zeros(0, dtype=object)
+        letters = np.array([get_column_letter(col) if col else "" for col in range(int(cols.max()) + 1)],
+                           dtype=object)
+        # Row numbers are looked up in a table when there are more cells than rows
+        if len(positions) > rows.max():
+            digits = np.array([str(row) for row in range(int(rows.max()) + 1)], dtype=object)[rows]
+        else:
+            digits = np.array([str(row) for row in rows.tolist()], dtype=object)
+        return letters[cols] + digits
+
+    def frame(self, positions=None):
+        """
+        Structure rows of the cells at `positions` (see totals and positions), all of
+        them in workbook order by default. Nivel_1..Nivel_N hold the labels of the
+        ancestor totals from the top down, plus the cell's own label for totals, which
+        matches the layout of the analysis CSV and what utils.validation expects.
+        """
+        if positions is None:
+            positions = np.lexsort((self.cols, self.rows, self.sheets))
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(positions):
+            return pd.DataFrame(columns=self.columns)
+        is_total, parent = self.is_total[positions], self.parent[positions]
+
+        # Chains start at the node itself for totals and at the parent for components;
+        # Nivel_i is the chain node i steps below the top, found by binary lifting
+        if self._jumps is None:
+            self._jumps = _ancestor_tables(self.parent, self.max_depth)
+        start = np.where(is_total, positions, parent)
+        length = np.where(start >= 0, _steps_to_root(start, self._jumps) + 1, 0)
+        ancestors = []
+        for i in range(self.max_levels):
+            ancestor = _ancestor(start, np.maximum(length - 1 - i, 0), self._jumps)
+            ancestor[length - 1 - i < 0] = -1
+            ancestors.append(ancestor)
+
+        # Text columns are categoricals over the distinct labels, sheets and relations:
+        # a workbook has few of them and up to hundreds of thousands of rows
+        labelled = _unique(np.concatenate([positions, *ancestors]))
+        labelled = labelled[labelled >= 0]
+        labels, values = self._cells(labelled)
+        label_codes, label_names = pd.factorize(np.append(labels, ""))
+        # Label code and value of every node; index -1 (past the top of a chain) reads
+        # the blank label kept in the last slot
+        node_codes = np.full(len(self.nodes) + 1, label_codes[-1])
+        node_codes[labelled] = label_codes[:-1]
+        node_values = np.full(len(self.nodes), np.nan)
+        node_values[labelled] = values
+
+        levels = {f"Nivel_{i + 1}": pd.Categorical.from_codes(node_codes[ancestor], label_names)
+                  for i, ancestor in enumerate(ancestors)}
+
+        relation_codes = np.zeros(len(positions), dtype=np.int64)
+        formulas = self._formulas[np.searchsorted(self._totals, positions[is_total])]
+        relation_codes[is_total], relation_names = pd.factorize(FormulaGraph.relation_text(formulas))
+        relation_codes[is_total] += 1
+
+        coordinates = self._coordinates(np.concatenate([positions, parent[parent >= 0]]))
+        padre = np.full(len(positions), "", dtype=object)
+        padre[parent >= 0] = coordinates[len(positions):]
+        return pd.DataFrame({
+            "Hoja": pd.Categorical.from_codes(self.sheets[positions], self.sheet_names),
+            "Celda": coordinates[:len(positions)],
+            "Concepto": pd.Categorical.from_codes(node_codes[positions], label_names),
+            "Valor": node_values[positions],
+            "Es_Total": pd.Categorical.from_codes(is_total.astype(np.int8), ["NO", "SI"]),
+            **levels,
+            "Relacion_Celdas": pd.Categorical.from_codes(relation_codes, ["Dato directo", *relation_names]),
+            "Padre": padre,
+        }, columns=self.columns)
+
+
+# Structures of the most recently seen workbooks. Entries are keyed by the identity
+# of the sheets' values DataFrames (parse_cache hands back the same objects for the
+# same file) and dropped as soon as one of those frames is garbage collected, so the
+# cache never keeps a workbook alive and a reused id cannot hit a stale entry.
+_STRUCTURE_CACHE = {}
+_STRUCTURE_CACHE_SIZE = 4
+
+
+def has_formulas(data):
+    return isinstance(data, dict) and any(content.get("formulas") for content in data.values())
+
+
+def workbook_structure(data):
+    """
+    FormulaStructure of a parsed workbook, memoized for the last few parsed workbooks.
+    Returns None for data without formulas (PDFs, .xls files).
+    """
+    if not has_formulas(data):
+        return None
+    key = tuple((sheet, id(content["values"])) for sheet, content in data.items())
+    structure = _STRUCTURE_CACHE.get(key)
+    if structure is not None:
+        return structure
+    structure = FormulaStructure(FormulaGraph(data))
+    if len(_STRUCTURE_CACHE) >= _STRUCTURE_CACHE_SIZE:
+        _STRUCTURE_CACHE.pop(next(iter(_STRUCTURE_CACHE)), None)
+    _STRUCTURE_CACHE[key] = structure
+    for content in data.values():
+        weakref.finalize(content["values"], _STRUCTURE_CACHE.pop, key, None)
+    return structure
+
+
+def structure_hint(structure, sheet, rows=None, max_lines=200):
+    """
+    Prompt lines listing the formula totals of a sheet ("B20 Total Activos Corrientes
+    = Suma(B10:B19) | Niveles: Total Activos > Total Activos Corrientes").
+    `rows` (0-based index labels of the values sent) limits the lines to those rows.
+    """
+    if structure is None or structure.empty:
+        return ""
+    totals = structure.totals(sheet, rows)
+    if not len(totals):
+        return ""
+    shown = structure.frame(totals[:max_lines])
+    level_columns = [column for column in shown.columns if column.startswith("Nivel_")]
+    lines = []
+    for record in shown.to_dict("records"):
+        levels = " > ".join(record[column] for column in level_columns if record[column])
+        lines.append(f"{record['Celda']} {record['Concepto']} = {record['Relacion_Celdas']} | Niveles: {levels}")
+    if len(totals) > max_lines:
+        lines.append(f"... ({len(totals) - max_lines} totales más)")
+    return "\n".join(lines)
+
+
+def apply_formula_structure(csv_df, structure):
+    """
+    Overwrites Es_Total, Nivel_1..Nivel_5 and Relacion_Celdas of the analysis CSV rows
+    whose Origen_Dato points to a cell of the formula structure (same Hoja).
+    Returns the updated copy and the number of rows matched.
+    """
+    if structure is None or structure.empty or "Origen_Dato" not in csv_df.columns:
+        return csv_df, 0
+    csv_df = csv_df.copy()
+    origin = csv_df["Origen_Dato"].fillna("").astype(str)
+    cells = origin.str.extract(r"\b([A-Z]{1,3}\d+)\b(?!.*\b[A-Z]{1,3}\d+\b)")[0]
+    sheets = csv_df["Hoja"] if "Hoja" in csv_df.columns else pd.Series("", index=csv_df.index)
+    positions = structure.positions(sheets.to_numpy(dtype=object), cells.to_numpy(dtype=object))
+    matched = positions >= 0
+    if not matched.any():
+        return csv_df, 0
+    source = structure.frame(positions[matched])
+    columns = ["Es_Total", "Relacion_Celdas"] + [column for column in structure.columns if column.startswith("Nivel_")]
+    for column in columns:
+        if column not in csv_df.columns:
+            csv_df[column] = ""
+        csv_df[column] = csv_df[column].astype(object)
+        csv_df.loc[matched, column] = source[column].to_numpy()
+    return csv_df, int(matched.sum())
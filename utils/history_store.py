@@ -0,0 +1,167 @@
+import gzip
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from io import StringIO
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStore:
+    """
+    Disk-backed store for analysis results.
+
+    Each entry lives in its own folder under `root_dir`: the markdown analysis and the
+    raw CSV as gzip-compressed text, the parsed table as Parquet and a small meta.json.
+    Callers keep only the metadata returned by `save` (a few hundred bytes) and load
+    the heavy parts on demand. Entries older than `max_age_days` are pruned on start-up.
+    """
+
+    def __init__(self, root_dir, max_age_days=30):
+        self.root_dir = root_dir
+        self.max_age_days = max_age_days
+        os.makedirs(root_dir, exist_ok=True)
+        if max_age_days:
+            self.prune(max_age_days)
+
+    def _path(self, entry_id, name):
+        return os.path.join(self.root_dir, entry_id, name)
+
+    def save(self, timestamp, filename, analysis, csv_content=None, csv_df=None):
+        """
+        Writes an entry and returns its metadata dict (id, timestamp, filename,
+        has_csv, has_table, n_rows, csv_bytes).
+        """
+        entry_id = uuid.uuid4().hex
+        entry_dir = os.path.join(self.root_dir, entry_id)
+        tmp_dir = entry_dir + ".tmp"
+        os.makedirs(tmp_dir)
+        try:
+            with gzip.open(os.path.join(tmp_dir, "analysis.md.gz"), "wt", encoding="utf-8") as f:
+                f.write(analysis or "")
+            if csv_content:
+                with gzip.open(os.path.join(tmp_dir, "data.csv.gz"), "wt", encoding="utf-8") as f:
+                    f.write(csv_content)
+            has_table = csv_df is not None and self._write_table(csv_df, os.path.join(tmp_dir, "data.parquet"))
+            meta = {
+                "id": entry_id,
+                "timestamp": timestamp,
+                "filename": filename,
+                "has_csv": bool(csv_content),
+                "has_table": bool(has_table),
+                "n_rows": len(csv_df) if csv_df is not None else None,
+                # Size of the download (UTF-8 with BOM), known without loading the CSV
+                "csv_bytes": len(csv_content.encode("utf-8-sig")) if csv_content else 0,
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return meta
+
+    @staticmethod
+    def _write_table(df, path):
+        """
+        Stores the table as Parquet. Returns False when it cannot be stored (no Parquet
+        engine installed, or values Parquet cannot hold even as text); the entry then
+        keeps only the raw CSV, which load_table parses again.
+        """
+        try:
+            df.to_parquet(path, index=False)
+            return True
+        except ImportError as e:
+            logger.warning("History tables are kept as CSV only: %s", e)
+            return False
+        except Exception:
+            pass
+        # Mixed-type object columns (e.g. numbers and text in Valor) cannot be
+        # stored as Parquet as they are; keep them as text
+        try:
+            df.astype({col: str for col in df.columns if df[col].dtype == object}).to_parquet(path, index=False)
+            return True
+        except Exception as e:
+            logger.warning("Could not store history table %s, keeping the CSV only: %s", path, e)
+            # A partial file would be read back instead of the CSV
+            if os.path.exists(path):
+                os.remove(path)
+            return False
+
+    def load_analysis(self, entry_id):
+        with gzip.open(self._path(entry_id, "analysis.md.gz"), "rt", encoding="utf-8") as f:
+            return f.read()
+
+    def load_csv(self, entry_id):
+        path = self._path(entry_id, "data.csv.gz")
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return f.read()
+
+    def load_table(self, entry_id):
+        """
+        The stored table, or the raw CSV parsed again when there is no Parquet copy.
+        """
+        path = self._path(entry_id, "data.parquet")
+        if os.path.exists(path):
+            try:
+                return pd.read_parquet(path)
+            except Exception as e:
+                logger.warning("Could not read history table %s, parsing the CSV: %s", path, e)
+        csv_content = self.load_csv(entry_id)
+        if not csv_content:
+            return None
+        try:
+            return pd.read_csv(StringIO(csv_content), on_bad_lines='skip', quotechar='"', skipinitialspace=True)
+        except Exception:
+            return None
+
+    def list_entries(self):
+        """
+        Metadata of every stored entry, oldest first.
+        """
+        entries = []
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name, "meta.json")
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entries.append(json.load(f))
+            except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+                continue
+        return sorted(entries, key=lambda entry: entry["timestamp"])
+
+    def delete(self, entry_id):
+        shutil.rmtree(os.path.join(self.root_dir, entry_id), ignore_errors=True)
+
+    def prune(self, max_age_days):
+        cutoff = time.time() - max_age_days * 86400
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except FileNotFoundError:
+                continue
+
+
+_default_store = None
+
+
+def get_history_store():
+    """
+    Returns the process-wide history store (HISTORY_DIR, default .cache/history;
+    entries older than HISTORY_MAX_AGE_DAYS, default 30, are pruned).
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = HistoryStore(
+            os.getenv("HISTORY_DIR", os.path.join(".cache", "history")),
+            max_age_days=float(os.getenv("HISTORY_MAX_AGE_DAYS", "30")),
+        )
+    return _default_store
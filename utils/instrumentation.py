@@ -0,0 +1,240 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from utils.token_budget import count_tokens
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Runs kept in memory for the app panel (most recent last)
+RECENT_RUNS_LIMIT = 50
+
+_current_run = contextvars.ContextVar("current_run", default=None)
+_recent_runs = deque(maxlen=RECENT_RUNS_LIMIT)
+_recent_lock = threading.Lock()
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _peak_rss_mb():
+    """
+    High-water mark of the process resident memory, in MB (None where unavailable).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class RunTrace:
+    """
+    Timings, model usage and memory of one run (a scan, an analysis, a parse...).
+
+    Spans opened with `span()` while the run is active are recorded with their start
+    offset, duration, thread and attributes; model calls add their prompt size,
+    estimated input tokens and the usage reported by the API. Thread-safe, so
+    map-reduce chunks analyzed in worker threads report into the same run.
+    """
+
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.spans = []
+        self.llm = {"requests": 0, "cache_hits": 0, "prompt_chars": 0, "estimated_input_tokens": 0,
+                    "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "latency_seconds": 0.0}
+        self.seconds = None
+        self.peak_rss_mb = None
+        self.peak_rss_growth_mb = None
+        self.peak_traced_mb = None
+        self.error = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, seconds, attrs):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start": round(start - self._start, 4),
+                "seconds": round(seconds, 4),
+                "thread": threading.current_thread().name,
+                **({"attrs": attrs} if attrs else {}),
+            })
+
+    def add_llm_call(self, prompt_chars, estimated_tokens, usage=None, seconds=0.0, cache_hit=False):
+        with self._lock:
+            self.llm["requests"] += 1
+            self.llm["cache_hits"] += int(cache_hit)
+            self.llm["prompt_chars"] += prompt_chars
+            self.llm["estimated_input_tokens"] += estimated_tokens
+            self.llm["latency_seconds"] += seconds
+            if usage is not None:
+                self.llm["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                self.llm["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+                details = getattr(usage, "prompt_tokens_details", None)
+                self.llm["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+
+    def find_span(self, name):
+        """
+        The first recorded span called `name`, or None.
+        """
+        return next((span for span in self.spans if span["name"] == name), None)
+
+    def stage_totals(self):
+        """
+        Total seconds and call count per span name, in order of first appearance.
+        """
+        totals = {}
+        for span in self.spans:
+            entry = totals.setdefault(span["name"], {"calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += span["seconds"]
+        return totals
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "peak_rss_mb": self.peak_rss_mb,
+            "peak_rss_growth_mb": self.peak_rss_growth_mb,
+            "peak_traced_mb": self.peak_traced_mb,
+            "llm": dict(self.llm),
+            "spans": list(self.spans),
+            "error": self.error,
+        }
+
+
+def current_run():
+    return _current_run.get()
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Times a stage of the active run. Without an active run it does nothing, so the
+    library functions can be instrumented at no cost outside tracked runs.
+    The yielded dict can be filled with attributes known only at the end.
+    """
+    run = _current_run.get()
+    if run is None:
+        yield attrs
+        return
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        run.add_span(name, start, time.perf_counter() - start, attrs)
+
+
+def record_llm_call(messages, usage=None, seconds=0.0, cache_hit=False):
+    """
+    Adds a model call to the active run (prompt size from the request messages,
+    usage tokens from the API response).
+    """
+    run = _current_run.get()
+    if run is None:
+        return
+    prompt = "".join(message.get("content") or "" for message in messages)
+    run.add_llm_call(len(prompt), count_tokens(prompt), usage, seconds, cache_hit)
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    return peak / 1024 ** 2
+
+
+@contextmanager
+def track_run(name, trace_memory=None, **attrs):
+    """
+    Makes a new RunTrace the active run for the enclosed code and yields it.
+
+    On exit the run gets its total latency and memory figures: the process peak RSS
+    (and how much this run raised it), plus the peak of Python allocations when
+    tracemalloc is enabled (trace_memory=True or INSTRUMENT_TRACEMALLOC=1; it slows
+    the run down and is process-wide, so concurrent runs share the figure). Finished
+    runs are kept for recent_runs() and appended to INSTRUMENTATION_LOG (a JSON
+    lines file) when that variable is set.
+    """
+    if trace_memory is None:
+        trace_memory = os.getenv("INSTRUMENT_TRACEMALLOC", "").lower() in ("1", "true", "yes")
+    run = RunTrace(name, **attrs)
+    rss_before = _peak_rss_mb()
+    if trace_memory:
+        _start_tracemalloc()
+    token = _current_run.set(run)
+    try:
+        yield run
+    except BaseException as e:
+        run.error = str(e)
+        raise
+    finally:
+        _current_run.reset(token)
+        run.seconds = round(time.perf_counter() - run._start, 4)
+        if trace_memory:
+            run.peak_traced_mb = round(_stop_tracemalloc(), 1)
+        rss_after = _peak_rss_mb()
+        if rss_after is not None:
+            run.peak_rss_mb = round(rss_after, 1)
+            run.peak_rss_growth_mb = round(rss_after - rss_before, 1)
+        with _recent_lock:
+            _recent_runs.append(run)
+        log_path = os.getenv("INSTRUMENTATION_LOG")
+        if log_path:
+            try:
+                append_jsonl(log_path, [run])
+            except OSError as e:
+                print(f"Could not write instrumentation log {log_path}: {e}")
+
+
+def recent_runs():
+    with _recent_lock:
+        return list(_recent_runs)
+
+
+def runs_to_jsonl(runs):
+    """
+    Serializes runs (RunTrace objects or their dicts) as JSON lines.
+    """
+    return "".join(
+        json.dumps(run.to_dict() if isinstance(run, RunTrace) else run, ensure_ascii=False, default=str) + "\n"
+        for run in runs
+    )
+
+
+def append_jsonl(path, runs):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(runs_to_jsonl(runs))
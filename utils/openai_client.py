@@ -0,0 +1,265 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion
+
+from utils.instrumentation import record_llm_call, span
+from utils.rate_limit import RateLimiter
+from utils.response_cache import ResponseCache, get_response_cache
+from utils.token_budget import count_tokens
+
+
+class ClientSettings:
+    """
+    Connection settings shared by every OpenAI client created by this module.
+
+    Defaults come from the environment:
+    - OPENAI_BASE_URL: alternative OpenAI-compatible endpoint (e.g. a local fake server).
+    - OPENAI_TIMEOUT: request timeout in seconds.
+    - OPENAI_MAX_RETRIES: retries on connection errors, 408/409/429 and 5xx responses.
+      The SDK retries with exponential backoff and jitter and honours Retry-After.
+    - OPENAI_MAX_CONCURRENCY: maximum number of requests in flight per process
+      (per event loop for the async client).
+    - OPENAI_RPM_LIMIT / OPENAI_TPM_LIMIT: requests and tokens per minute allowed to
+      this process (0, the default, is unlimited). Requests wait for room instead of
+      being throttled by the API; tokens count the prompt plus max_tokens, as the
+      API does.
+    """
+
+    def __init__(self, base_url=None, timeout=None, max_retries=None, max_concurrency=None,
+                 requests_per_minute=None, tokens_per_minute=None):
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        self.timeout = float(timeout or os.getenv("OPENAI_TIMEOUT", "600"))
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv("OPENAI_MAX_RETRIES", "4"))
+        self.max_concurrency = int(max_concurrency or os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+        self.requests_per_minute = int(requests_per_minute if requests_per_minute is not None
+                                       else os.getenv("OPENAI_RPM_LIMIT", "0"))
+        self.tokens_per_minute = int(tokens_per_minute if tokens_per_minute is not None
+                                     else os.getenv("OPENAI_TPM_LIMIT", "0"))
+
+
+_settings = ClientSettings()
+_lock = threading.Lock()
+_clients = {}
+_semaphore = threading.BoundedSemaphore(_settings.max_concurrency)
+_rate_limiter = RateLimiter(_settings.requests_per_minute, _settings.tokens_per_minute)
+# Async clients and semaphores are bound to the event loop that uses them
+_async_state = weakref.WeakKeyDictionary()
+
+
+def configure(**kwargs):
+    """
+    Replaces the client settings (see ClientSettings) and drops the pooled clients.
+    """
+    global _settings, _semaphore, _rate_limiter
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _async_state.clear()
+        _settings = ClientSettings(**kwargs)
+        _semaphore = threading.BoundedSemaphore(_settings.max_concurrency)
+        _rate_limiter = RateLimiter(_settings.requests_per_minute, _settings.tokens_per_minute)
+
+
+def get_settings():
+    return _settings
+
+
+def set_rate_limits(requests_per_minute=0, tokens_per_minute=0):
+    """
+    Changes the per-minute budgets (0 is unlimited) without dropping the pooled
+    clients. Requests already counted in the current window stay counted.
+    """
+    with _lock:
+        _settings.requests_per_minute = int(requests_per_minute or 0)
+        _settings.tokens_per_minute = int(tokens_per_minute or 0)
+        _rate_limiter.set_limits(requests_per_minute, tokens_per_minute)
+
+
+def _wait_for_rate_limit(kwargs):
+    """
+    Blocks until the request fits the per-minute budgets; returns the seconds waited.
+    """
+    limiter = _rate_limiter
+    if not limiter.enabled:
+        return 0.0
+    tokens = 0
+    if limiter.tokens_per_minute:
+        tokens = sum(count_tokens(message.get("content") or "", kwargs.get("model", "gpt-4o"))
+                     for message in kwargs.get("messages", []))
+        tokens += kwargs.get("max_tokens") or 0
+    return limiter.acquire(tokens)
+
+
+def get_client(api_key):
+    """
+    Returns the pooled synchronous client for `api_key`, creating it on first use.
+    The client keeps its HTTP connections alive across calls and is thread-safe.
+    """
+    with _lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=_settings.base_url,
+                max_retries=_settings.max_retries,
+                timeout=_settings.timeout,
+            )
+            _clients[api_key] = client
+        return client
+
+
+def get_async_client(api_key):
+    """
+    Returns the pooled asyncio client for `api_key` on the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        state = _async_state.get(loop)
+        if state is None:
+            state = {"clients": {}, "semaphore": asyncio.Semaphore(_settings.max_concurrency)}
+            _async_state[loop] = state
+        client = state["clients"].get(api_key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=_settings.base_url,
+                max_retries=_settings.max_retries,
+                timeout=_settings.timeout,
+            )
+            state["clients"][api_key] = client
+        return client
+
+
+def _cache_lookup(use_cache, kwargs):
+    cache = get_response_cache() if use_cache else None
+    if cache is None:
+        return None, None, None
+    key = ResponseCache.make_key(**kwargs)
+    cached = cache.get(key)
+    if cached is not None:
+        return cache, key, ChatCompletion.model_validate_json(cached)
+    return cache, key, None
+
+
+def _cache_store(cache, key, response):
+    # Truncated or filtered responses are not worth replaying
+    if cache is not None and all(choice.finish_reason == "stop" for choice in response.choices):
+        cache.put(key, response.model_dump_json())
+
+
+def chat_completion(api_key, use_cache=True, **kwargs):
+    """
+    client.chat.completions.create on the pooled client, within the concurrency limit.
+    Responses are served from / stored in the persistent response cache unless
+    use_cache=False (or LLM_CACHE_DISABLED is set).
+    Calls are recorded in the active instrumentation run (utils.instrumentation).
+    """
+    with span("llm.request", model=kwargs.get("model")) as attrs:
+        cache, key, cached = _cache_lookup(use_cache, kwargs)
+        if cached is not None:
+            attrs["cache_hit"] = True
+            record_llm_call(kwargs.get("messages", []), cache_hit=True)
+            return cached
+        client = get_client(api_key)
+        attrs["rate_wait"] = round(_wait_for_rate_limit(kwargs), 3)
+        with _semaphore:
+            start = time.perf_counter()
+            response = client.chat.completions.create(**kwargs)
+            seconds = time.perf_counter() - start
+        record_llm_call(kwargs.get("messages", []), response.usage, seconds)
+        if response.usage is not None:
+            # Prompt tokens the provider served from its prefix cache (faster and cheaper)
+            details = getattr(response.usage, "prompt_tokens_details", None)
+            attrs["prompt_tokens"] = response.usage.prompt_tokens
+            attrs["cached_tokens"] = getattr(details, "cached_tokens", 0) or 0
+        _cache_store(cache, key, response)
+        return response
+
+
+def chat_completion_stream(api_key, use_cache=True, **kwargs):
+    """
+    Streaming chat completion: yields the text of the response as it arrives.
+
+    A cached response is yielded in one piece. A stream that finishes normally is
+    stored in the response cache like a regular completion. The usage of streamed
+    responses is requested in a final chunk and recorded like chat_completion's.
+    """
+    cache, key, cached = _cache_lookup(use_cache, kwargs)
+    if cached is not None:
+        record_llm_call(kwargs.get("messages", []), cache_hit=True)
+        yield cached.choices[0].message.content or ""
+        return
+
+    client = get_client(api_key)
+    _wait_for_rate_limit(kwargs)
+    parts = []
+    finish_reason = None
+    response_id = model = None
+    usage = None
+    start = time.perf_counter()
+    with _semaphore:
+        stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+        for chunk in stream:
+            response_id = response_id or chunk.id
+            model = model or chunk.model
+            usage = chunk.usage or usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta and choice.delta.content:
+                parts.append(choice.delta.content)
+                yield choice.delta.content
+    record_llm_call(kwargs.get("messages", []), usage, time.perf_counter() - start)
+
+    if finish_reason is None:
+        # The connection closed before the model finished (e.g. a proxy timeout)
+        raise ConnectionError("the response stream ended before the model finished")
+    _cache_store(cache, key, ChatCompletion.model_validate({
+        "id": response_id or "stream",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or kwargs.get("model", ""),
+        "choices": [{
+            "index": 0,
+            "finish_reason": finish_reason,
+            "message": {"role": "assistant", "content": "".join(parts)},
+        }],
+    }))
+
+
+async def achat_completion(api_key, use_cache=True, **kwargs):
+    """
+    Async counterpart of chat_completion, limited per event loop.
+    """
+    cache, key, cached = _cache_lookup(use_cache, kwargs)
+    if cached is not None:
+        record_llm_call(kwargs.get("messages", []), cache_hit=True)
+        return cached
+    client = get_async_client(api_key)
+    await asyncio.to_thread(_wait_for_rate_limit, kwargs)
+    semaphore = _async_state[asyncio.get_running_loop()]["semaphore"]
+    async with semaphore:
+        start = time.perf_counter()
+        response = await client.chat.completions.create(**kwargs)
+        seconds = time.perf_counter() - start
+    record_llm_call(kwargs.get("messages", []), response.usage, seconds)
+    _cache_store(cache, key, response)
+    return response
+
+
+async def achat_completions(api_key, requests, use_cache=True):
+    """
+    Runs several chat completion requests (dicts of create() kwargs) concurrently.
+    Results are returned in request order; failed requests return their exception.
+    """
+    return await asyncio.gather(
+        *(achat_completion(api_key, use_cache=use_cache, **request) for request in requests),
+        return_exceptions=True,
+    )
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from utils.file_parser import PARSER_VERSION, parse_excel, parse_pdf
+from utils.instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+
+class ParseCache:
+    """
+    Content-addressed cache for parsed uploads.
+
+    Entries are keyed by a hash of the file bytes plus the parser name and
+    PARSER_VERSION, so the same report uploaded again (in a rerun or by another
+    session) is served without re-parsing. A bounded in-memory LRU tier is always
+    used; an on-disk tier is enabled when `disk_dir` is given and is trimmed to
+    `max_disk_bytes`, evicting the least recently used files first. Values with an
+    `on_update` hook (PdfDocument) are written to disk again when they report a
+    change, so work done after parsing (the retrieval index) survives a restart.
+    """
+
+    def __init__(self, max_entries=8, disk_dir=None, max_disk_bytes=2 * 1024 ** 3):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_bytes, parser_name):
+        return ParseCache.digest_key(hashlib.sha256(file_bytes).hexdigest(), parser_name)
+
+    @staticmethod
+    def digest_key(digest, parser_name):
+        """
+        Cache key of a file whose SHA-256 hex digest is already known.
+        """
+        return f"{parser_name}-v{PARSER_VERSION}-{digest}"
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        value = self._disk_get(key)
+        if value is not None:
+            self._watch(key, value)
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        self._watch(key, value)
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _watch(self, key, value):
+        if self.disk_dir and hasattr(value, "on_update"):
+            value.on_update = lambda updated: self._disk_put(key, updated)
+
+    def get_or_parse(self, file, parse_fn, parser_name):
+        """
+        Returns the cached result for `file`, calling `parse_fn(file)` on a miss.
+        """
+        with span("parse", parser=parser_name) as attrs:
+            file.seek(0)
+            key = self.make_key(file.read(), parser_name)
+            value = self.get(key)
+            attrs["cache_hit"] = value is not None
+            if value is None:
+                file.seek(0)
+                value = parse_fn(file)
+                self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for path, _, _ in self._disk_entries():
+            os.remove(path)
+
+    # --- memory tier ---
+
+    def _memory_put(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    # --- disk tier ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".pkl")
+
+    def _disk_entries(self):
+        if not self.disk_dir:
+            return []
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Discarding unreadable parse cache entry %s: %s", path, e)
+            os.remove(path)
+            return None
+        # Touch the file so eviction treats it as recently used
+        os.utime(path)
+        return value
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("Could not write parse cache entry %s: %s", path, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._disk_evict()
+
+    def _disk_evict(self):
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_parse_cache():
+    """
+    Returns the process-wide parse cache, shared by every Streamlit session.
+    The disk tier is enabled by setting PARSE_CACHE_DIR (size cap in PARSE_CACHE_MAX_MB).
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ParseCache(
+                max_entries=int(os.getenv("PARSE_CACHE_MAX_ENTRIES", "8")),
+                disk_dir=os.getenv("PARSE_CACHE_DIR") or None,
+                max_disk_bytes=int(os.getenv("PARSE_CACHE_MAX_MB", "2048")) * 1024 ** 2,
+            )
+        return _default_cache
+
+
+def cached_parse_excel(file):
+    """
+    parse_excel backed by the shared parse cache.
+    """
+    return get_parse_cache().get_or_parse(file, parse_excel, "excel")
+
+
+def cached_parse_pdf(file):
+    """
+    parse_pdf backed by the shared parse cache.
+    """
+    return get_parse_cache().get_or_parse(file, parse_pdf, "pdf")
@@ -0,0 +1,321 @@
+import io
+import multiprocessing
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pypdf
+
+from utils.instrumentation import span
+from utils.pdf_extract import extract_page, extract_page_runs
+from utils.retrieval import build_index
+from utils.serializer import format_legend, serialize_sheet
+
+PDF_TABLE_HEADER = "(Tabla reconstruida a partir de la posición del texto en la página)\n"
+
+
+def _split_range(n_items, n_chunks):
+    """
+    Splits range(n_items) into at most n_chunks contiguous (start, stop) pairs.
+    """
+    n_chunks = max(1, min(n_chunks, n_items))
+    size, extra = divmod(n_items, n_chunks)
+    bounds = []
+    start = 0
+    for i in range(n_chunks):
+        stop = start + size + (1 if i < extra else 0)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def _page_runs(pages):
+    """
+    Groups sorted page indices into contiguous (start, stop) runs.
+    """
+    runs = []
+    for page in pages:
+        if runs and runs[-1][1] == page:
+            runs[-1][1] = page + 1
+        else:
+            runs.append([page, page + 1])
+    return [tuple(run) for run in runs]
+
+
+class PdfDocument:
+    """
+    Lazy, page-indexed view over the text of a PDF.
+
+    Pages are extracted on first access and cached. The text of the document is the
+    concatenation of every page followed by a newline (the same string parse_pdf
+    used to return), and the object behaves like that string: len(), slicing,
+    `in`, concatenation and any other str method work. Slices from the start of the
+    document (`doc[:1000]`) only extract the pages they cover; operations that need
+    the whole text extract the remaining pages, in parallel for large documents.
+
+    With detect_tables=True every page is also laid out from the positions of its
+    text (utils.pdf_layout) in the same pass; pages that hold a table get a grid
+    shaped like the values of a parsed Excel sheet (see page_table), which prompts
+    serialize compactly instead of the flattened text (see page_layout_text).
+
+    `on_update`, when set, is called with the document once a retrieval index has
+    been built, so a cache holding a copy of it (see utils.parse_cache) can store it again.
+    """
+
+    def __init__(self, pdf_bytes, workers=1, parallel_min_pages=48, detect_tables=True):
+        self._pdf_bytes = pdf_bytes
+        self.workers = workers
+        self.parallel_min_pages = parallel_min_pages
+        self.detect_tables = detect_tables
+        self._reader = None
+        self._lock = threading.RLock()
+        self.n_pages = len(self._get_reader().pages)
+        self._pages = [None] * self.n_pages
+        self._grids = [None] * self.n_pages
+        self._tables = {}
+        self._indexes = {}
+        self.on_update = None
+        # _offsets[i] is the character offset where page i starts, known for the
+        # contiguous prefix of pages extracted so far (plus the end of that prefix)
+        self._offsets = [0]
+        self._full_text = None
+
+    # --- pickling (PdfReader holds open streams and locks) ---
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_reader"] = None
+        state["_lock"] = None
+        state["_full_text"] = None
+        state["_tables"] = {}
+        state["on_update"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _get_reader(self):
+        if self._reader is None:
+            self._reader = pypdf.PdfReader(io.BytesIO(self._pdf_bytes))
+        return self._reader
+
+    # --- page access ---
+
+    def page(self, index):
+        """
+        Returns the text of page `index` (0-based), extracting it if needed.
+        """
+        with self._lock:
+            if self._pages[index] is None:
+                text, self._grids[index] = extract_page(self._get_reader().pages[index], self.detect_tables)
+                self._pages[index] = text + "\n"
+                self._extend_offsets()
+            return self._pages[index]
+
+    def pages_text(self, start=0, stop=None):
+        """
+        Returns the concatenated text of pages [start, stop).
+        """
+        stop = self.n_pages if stop is None else min(stop, self.n_pages)
+        return "".join(self.page(i) for i in range(start, stop))
+
+    def extract_all(self):
+        """
+        Extracts every page not yet cached, using a process pool for large documents.
+        """
+        self.extract_pages()
+
+    def extract_pages(self, start=0, stop=None):
+        """
+        Extracts the pages [start, stop) not yet cached, like extract_all.
+        """
+        stop = self.n_pages if stop is None else min(stop, self.n_pages)
+        with self._lock:
+            missing = [i for i in range(start, stop) if self._pages[i] is None]
+            if not missing:
+                return
+            if self.workers <= 1 or len(missing) < self.parallel_min_pages:
+                with span("parse_pdf.extract", pages=len(missing), workers=1):
+                    for i in missing:
+                        self.page(i)
+                return
+
+            # Only the missing pages are extracted: they are shared out evenly among
+            # the workers, each share sent as its contiguous runs of pages
+            shares = [missing[start:stop] for start, stop in _split_range(len(missing), self.workers)]
+            # spawn: Streamlit serves sessions from threads, where forking is unsafe
+            ctx = multiprocessing.get_context("spawn")
+            with span("parse_pdf.extract", pages=len(missing), workers=len(shares)):
+                with ProcessPoolExecutor(max_workers=len(shares), mp_context=ctx) as executor:
+                    chunks = executor.map(
+                        extract_page_runs,
+                        [self._pdf_bytes] * len(shares),
+                        [_page_runs(share) for share in shares],
+                        [self.detect_tables] * len(shares),
+                    )
+                    for share, chunk in zip(shares, chunks):
+                        for index, (text, grid) in zip(share, chunk):
+                            if self._pages[index] is None:
+                                self._pages[index] = text + "\n"
+                                self._grids[index] = grid
+            self._extend_offsets()
+
+    # --- tables ---
+
+    def page_table(self, index):
+        """
+        The table of page `index` as a DataFrame shaped like the values of a parsed
+        Excel sheet (0-based positional rows/columns, empty cells missing), or None
+        when the page holds no table.
+        """
+        self.page(index)
+        grid = self._grids[index]
+        if grid is None:
+            return None
+        with self._lock:
+            if index not in self._tables:
+                frame = pd.DataFrame([[np.nan if cell == "" else cell for cell in row] for row in grid])
+                self._tables[index] = frame.infer_objects()
+            return self._tables[index]
+
+    def table_sheets(self):
+        """
+        The tables of the document as parsed Excel data: {"Página N": {"values", "formulas"}}.
+        """
+        self.extract_all()
+        sheets = {}
+        for i in range(self.n_pages):
+            table = self.page_table(i)
+            if table is not None:
+                sheets[f"Página {i + 1}"] = {"values": table, "formulas": {}}
+        return sheets
+
+    def page_layout_text(self, index, sheet_format=None):
+        """
+        Prompt text of page `index`: its table serialized like an Excel sheet (see
+        utils.serializer) when it holds one, otherwise the extracted text.
+        """
+        table = self.page_table(index)
+        if table is None:
+            return self.page(index)
+        legend = format_legend(sheet_format)
+        return PDF_TABLE_HEADER + (legend + "\n" if legend else "") + serialize_sheet(table, sheet_format) + "\n"
+
+    def pages_layout_text(self, start=0, stop=None, sheet_format=None):
+        """
+        Prompt text of pages [start, stop), each under a page marker.
+        """
+        stop = self.n_pages if stop is None else min(stop, self.n_pages)
+        return "".join(f"\n--- PÁGINA {i + 1} ---\n" + self.page_layout_text(i, sheet_format)
+                       for i in range(start, stop))
+
+    def retrieval_index(self, sheet_format=None):
+        """
+        The BM25 index over the page and table-block chunks of the document (see
+        utils.retrieval), built on first use and kept with the document, so the
+        parse cache serves it to every later focused analysis of the same file.
+        """
+        with self._lock:
+            index = self._indexes.get(sheet_format)
+            if index is None:
+                with span("retrieval.index", pages=self.n_pages) as attrs:
+                    index = self._indexes[sheet_format] = build_index(self, sheet_format)
+                    attrs["chunks"] = len(index)
+                built = True
+            else:
+                built = False
+        if built and self.on_update is not None:
+            self.on_update(self)
+        return index
+
+    def _extend_offsets(self):
+        while len(self._offsets) <= self.n_pages and self._pages[len(self._offsets) - 1] is not None:
+            self._offsets.append(self._offsets[-1] + len(self._pages[len(self._offsets) - 1]))
+
+    def _ensure_chars(self, n_chars):
+        """
+        Extracts pages in order until at least `n_chars` characters are available.
+        """
+        while self._offsets[-1] < n_chars and len(self._offsets) <= self.n_pages:
+            self.page(len(self._offsets) - 1)
+
+    # --- offset index ---
+
+    @property
+    def page_offsets(self):
+        """
+        Start offset of every page in the document text (extracts all pages).
+        """
+        self.extract_all()
+        return self._offsets[:-1]
+
+    def page_span(self, index):
+        """
+        Returns the (start, stop) character offsets of page `index`.
+        """
+        while len(self._offsets) <= index + 1:
+            self.page(len(self._offsets) - 1)
+        return self._offsets[index], self._offsets[index + 1]
+
+    def page_at(self, offset):
+        """
+        Returns the 0-based page containing character `offset`.
+        """
+        self._ensure_chars(offset + 1)
+        return min(bisect_right(self._offsets, offset) - 1, self.n_pages - 1)
+
+    # --- str behaviour ---
+
+    def __str__(self):
+        with self._lock:
+            if self._full_text is None:
+                self.extract_all()
+                self._full_text = "".join(self._pages)
+            return self._full_text
+
+    def __len__(self):
+        return len(str(self))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in (None, 1):
+            start = key.start or 0
+            stop = key.stop
+            if start >= 0 and stop is not None and stop >= 0:
+                self._ensure_chars(stop)
+                # pages[:n_pages] cover at least the first `stop` characters
+                n_pages = bisect_left(self._offsets, stop)
+                return "".join(self._pages[:n_pages])[start:stop]
+        return str(self)[key]
+
+    def __contains__(self, item):
+        return item in str(self)
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __add__(self, other):
+        return str(self) + other
+
+    def __radd__(self, other):
+        return other + str(self)
+
+    def __eq__(self, other):
+        if isinstance(other, PdfDocument):
+            other = str(other)
+        return str(self) == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        extracted = sum(text is not None for text in self._pages)
+        return f"<PdfDocument {extracted}/{self.n_pages} pages extracted>"
+
+    def __getattr__(self, name):
+        # Any other str method (find, splitlines, upper, ...) works on the full text
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(str(self), name)
@@ -0,0 +1,29 @@
+"""
+Worker-side PDF text extraction.
+
+Kept free of pandas/openpyxl imports so that spawned worker processes start quickly.
+"""
+import io
+
+import pypdf
+
+from utils.pdf_layout import extract_page_layout
+
+
+def extract_page(page, tables=True):
+    """
+    Returns the text of a pypdf page and its table grid (None without a table, or
+    when `tables` is off).
+    """
+    if tables:
+        return extract_page_layout(page)
+    return page.extract_text(), None
+
+
+def extract_page_runs(pdf_bytes, runs, tables=True):
+    """
+    Extracts the (text, table grid) of the pages of every (start, stop) run, in order,
+    from the PDF bytes (runs in a worker process).
+    """
+    pdf_reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+    return [extract_page(pdf_reader.pages[i], tables) for start, stop in runs for i in range(start, stop)]
@@ -0,0 +1,164 @@
+"""
+Layout-aware table reconstruction for PDF pages.
+
+Text runs are collected with their positions through pypdf's visitor callback,
+clustered into rows by baseline and into columns by horizontal extent, and returned
+as a grid of cells shaped like the rows of a sheet. Kept free of pandas/openpyxl
+imports, like utils.pdf_extract, because it also runs in spawned worker processes.
+"""
+import re
+
+# Average glyph width as a share of the font size (no font metrics are read)
+CHAR_WIDTH = 0.5
+# Runs whose baselines differ by less than this share of the font size share a row
+ROW_TOLERANCE = 0.4
+# Runs closer than this share of the font size belong to the same cell
+WORD_GAP = 0.6
+# A page is a table when at least this many rows have 2+ cells and a number
+MIN_TABLE_ROWS = 3
+
+CELL_SPLIT_PATTERN = re.compile(r"\S+(?: \S+)*")
+NUMBER_PATTERN = re.compile(r"^\(?-?[$€]?\s?\d[\d.,]*\)?$")
+
+
+class _RunCollector:
+    """
+    visitor_text callback that records every non-empty text run as (x, y, size, text)
+    in page space. Runs made of several cells padded with spaces are split at every
+    gap of 2+ spaces, placing each piece at its estimated offset.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def __call__(self, text, cm, tm, font_dict, font_size):
+        if not text or not text.strip():
+            return
+        # Text space to page space: the text matrix, then the current transformation matrix
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        size = abs(font_size * tm[3] * cm[3]) or abs(font_size) or 10.0
+        for line_number, line in enumerate(text.split("\n")):
+            for match in CELL_SPLIT_PATTERN.finditer(line):
+                self.runs.append((x + match.start() * size * CHAR_WIDTH, y - line_number * size * 1.2,
+                                  size, match.group()))
+
+
+def _rows(runs):
+    """
+    Groups runs into rows (top to bottom), each a list of cells (x0, x1, size, text)
+    from left to right, merging runs separated by a word gap.
+    """
+    rows = []
+    for x, y, size, text in sorted(runs, key=lambda run: (-run[1], run[0])):
+        if rows and abs(rows[-1][0] - y) <= ROW_TOLERANCE * size:
+            rows[-1][1].append((x, size, text))
+        else:
+            rows.append((y, [(x, size, text)]))
+    cell_rows = []
+    for _, row_runs in rows:
+        cells = []
+        for x, size, text in sorted(row_runs):
+            if cells and x - cells[-1][1] < WORD_GAP * size:
+                x0, _, _, previous = cells[-1]
+                cells[-1] = (x0, x + len(text) * size * CHAR_WIDTH, size, previous + " " + text)
+            else:
+                cells.append((x, x + len(text) * size * CHAR_WIDTH, size, text))
+        cell_rows.append(cells)
+    return cell_rows
+
+
+def _column_bands(cell_rows):
+    """
+    Column bands (x0, x1) from left to right: the union of the horizontal extents of
+    the cells of multi-cell rows, so left- and right-aligned columns both line up.
+    """
+    extents = sorted((x0, x1) for cells in cell_rows if len(cells) > 1 for x0, x1, _, _ in cells)
+    bands = []
+    for x0, x1 in extents:
+        if bands and x0 <= bands[-1][1]:
+            bands[-1][1] = max(bands[-1][1], x1)
+        else:
+            bands.append([x0, x1])
+    return bands
+
+
+def _band_index(bands, x0, x1):
+    """
+    The band a cell overlaps most, or the last band starting before it.
+    """
+    best, best_overlap = 0, 0.0
+    for i, (start, stop) in enumerate(bands):
+        overlap = min(stop, x1) - max(start, x0)
+        if overlap > best_overlap:
+            best, best_overlap = i, overlap
+        elif best_overlap <= 0 and start <= x0:
+            best = i
+    return best
+
+
+def is_number(text):
+    return bool(NUMBER_PATTERN.match(text.strip())) and any(ch.isdigit() for ch in text)
+
+
+def parse_number(text):
+    """
+    The value of a number as printed in a report ("1,234.56", "1.234,56", "(500)"),
+    or the text itself when it is not a number. A single separator followed by
+    exactly three digits is read as a thousands separator.
+    """
+    cleaned = text.strip().replace("$", "").replace("€", "").replace(" ", "")
+    if not is_number(cleaned):
+        return text
+    negative = cleaned.startswith("(") and cleaned.endswith(")") or cleaned.startswith("-")
+    digits = cleaned.strip("()-")
+    if "," in digits and "." in digits:
+        decimal = "," if digits.rfind(",") > digits.rfind(".") else "."
+    elif digits.count(",") == 1 and len(digits.split(",")[1]) != 3:
+        decimal = ","
+    elif digits.count(".") == 1 and len(digits.split(".")[1]) != 3:
+        decimal = "."
+    else:
+        decimal = None
+    thousands = {",", "."} - {decimal}
+    for separator in thousands:
+        digits = digits.replace(separator, "")
+    if decimal:
+        digits = digits.replace(decimal, ".")
+    try:
+        value = float(digits) if decimal else int(digits)
+    except ValueError:
+        return text
+    return -value if negative else value
+
+
+def page_grid(runs):
+    """
+    The table grid of a page from its positioned runs: a list of rows, each a list of
+    cells (numbers parsed, "" for empty cells) over the same columns, or None when
+    the page does not hold a table.
+    """
+    cell_rows = _rows(runs)
+    table_rows = sum(1 for cells in cell_rows if len(cells) > 1 and any(is_number(c[3]) for c in cells))
+    if table_rows < MIN_TABLE_ROWS:
+        return None
+    bands = _column_bands(cell_rows)
+    if len(bands) < 2:
+        return None
+    grid = []
+    for cells in cell_rows:
+        row = [""] * len(bands)
+        for x0, x1, _, text in cells:
+            i = _band_index(bands, x0, x1)
+            row[i] = f"{row[i]} {text}" if row[i] else text
+        grid.append([parse_number(cell) if cell else "" for cell in row])
+    return grid
+
+
+def extract_page_layout(page):
+    """
+    Extracts the text of a pypdf page and, in the same pass, its table grid (or None).
+    """
+    collector = _RunCollector()
+    text = page.extract_text(visitor_text=collector)
+    return text, page_grid(collector.runs)
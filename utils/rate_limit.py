@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter for requests per minute and tokens per minute.
+
+    acquire() blocks until one more request of the given token count fits in both
+    budgets over the last `window` seconds, then records it. A budget of 0 is
+    unlimited. Thread-safe; waiting threads poll outside the lock.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, window=60.0):
+        self.requests_per_minute = int(requests_per_minute or 0)
+        self.tokens_per_minute = int(tokens_per_minute or 0)
+        self.window = window
+        self._events = deque()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def set_limits(self, requests_per_minute=0, tokens_per_minute=0):
+        with self._lock:
+            self.requests_per_minute = int(requests_per_minute or 0)
+            self.tokens_per_minute = int(tokens_per_minute or 0)
+
+    @property
+    def enabled(self):
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _expire(self, now):
+        while self._events and self._events[0][0] <= now - self.window:
+            _, tokens = self._events.popleft()
+            self._tokens -= tokens
+
+    def acquire(self, tokens=0):
+        """
+        Waits for room for a request of `tokens` tokens; returns the seconds waited.
+        A request larger than the whole token budget is let through on an empty window.
+        """
+        if not self.enabled:
+            return 0.0
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                fits_requests = not self.requests_per_minute or len(self._events) < self.requests_per_minute
+                fits_tokens = not self.tokens_per_minute or self._tokens + tokens <= self.tokens_per_minute
+                if fits_requests and fits_tokens:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return now - start
+                # Room appears when the oldest request leaves the window
+                wait = self._events[0][0] + self.window - now
+            time.sleep(min(max(wait, 0.01), 1.0))
+
+    def usage(self):
+        """
+        Requests and tokens counted in the current window.
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._events), self._tokens
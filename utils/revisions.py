@@ -0,0 +1,293 @@
+import contextvars
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from openpyxl.utils.cell import coordinate_to_tuple
+
+from utils.analysis import (CSV_BLOCK_PATTERNS, ERROR_PREFIX, analyze_report, extract_csv_block, is_partial,
+                            merge_csv_blocks)
+from utils.focus import FOCUS_ROW_MARGIN
+from utils.instrumentation import span
+from utils.table_detector import detect_reports
+
+logger = logging.getLogger(__name__)
+
+# Bumped when fingerprints or stored results change meaning, so older snapshots are ignored
+REVISION_FORMAT = 1
+
+# "Balance (2)", "balance_v3", "Balance - corregido", "balance final"...: reissues of one workbook
+VERSION_SUFFIX_PATTERN = re.compile(
+    r"(?:\s*\(\d+\)|[\s_\-.]+(?:v\d+|rev\d*|revisi[oó]n|revisado|corregido|correcci[oó]n|final|copia))$",
+    re.IGNORECASE,
+)
+
+
+def workbook_key(filename):
+    """
+    Identifies the workbook an upload is a version of: the file name without its
+    extension and without version suffixes, so a corrected reissue finds the snapshot
+    of the previous one.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0].strip().lower()
+    previous = None
+    while stem != previous:
+        previous = stem
+        stem = VERSION_SUFFIX_PATTERN.sub("", stem)
+    return re.sub(r"[^\w\-]+", "_", stem, flags=re.UNICODE).strip("_") or "libro"
+
+
+def cell_hashes(df, formulas=None):
+    """
+    Fingerprints every cell of a sheet: a (rows x columns) uint64 matrix with 0 for
+    empty cells. Numbers are hashed as float64, so a column stored as integers or
+    float32 in one version and float64 in the next still matches; formula cells also
+    hash their formula, so a corrected formula counts as a change even when its
+    cached value is the same.
+    """
+    matrix = np.zeros(df.shape, dtype=np.uint64)
+    for j in range(df.shape[1]):
+        column = df.iloc[:, j]
+        if column.dtype.kind in "fiub":
+            values = column.to_numpy(dtype="float64")
+        else:
+            values = column.astype(object).to_numpy()
+        matrix[:, j] = pd.util.hash_array(values, categorize=False)
+    matrix[~df.notna().to_numpy()] = 0
+    if formulas:
+        positions = [coordinate_to_tuple(coordinate) for coordinate in formulas]
+        rows = np.array([row - 1 for row, _ in positions], dtype=np.int64)
+        cols = np.array([col - 1 for _, col in positions], dtype=np.int64)
+        inside = (rows < df.shape[0]) & (cols < df.shape[1])
+        texts = np.array(list(formulas.values()), dtype=object)[inside]
+        matrix[rows[inside], cols[inside]] ^= pd.util.hash_array(texts, categorize=False)
+    return matrix
+
+
+def changed_rows(previous, current):
+    """
+    1-based rows where two cell fingerprint matrices differ. Rows or columns present
+    in only one of them count as changed where they hold a value.
+    """
+    shape = (max(previous.shape[0], current.shape[0]), max(previous.shape[1], current.shape[1]))
+    if previous.shape != shape:
+        previous = np.pad(previous, [(0, shape[0] - previous.shape[0]), (0, shape[1] - previous.shape[1])])
+    if current.shape != shape:
+        current = np.pad(current, [(0, shape[0] - current.shape[0]), (0, shape[1] - current.shape[1])])
+    changed = previous != current
+    return np.flatnonzero(changed.any(axis=1)) + 1, int(changed.sum())
+
+
+def diff_workbooks(previous_cells, cells):
+    """
+    Compares the cell fingerprints of two versions of a workbook, sheet by sheet.
+    Returns {sheet: (changed 1-based rows, changed cell count)} for the sheets of the
+    new version; sheets that did not exist before are changed everywhere.
+    """
+    changes = {}
+    for sheet, matrix in cells.items():
+        before = previous_cells.get(sheet)
+        if before is None:
+            before = np.zeros((0, 0), dtype=np.uint64)
+        changes[sheet] = changed_rows(before, matrix)
+    return changes
+
+
+class RevisionStore:
+    """
+    Disk-backed snapshots of the last analyzed version of each workbook.
+
+    Each workbook (see workbook_key) has a folder under `root_dir` with the cell
+    fingerprints of its sheets (cells.npz) and a gzip-compressed JSON with its reports,
+    the analysis and raw CSV rows of each one and the settings they were produced
+    with. Snapshots older than `max_age_days` are pruned on start-up.
+    """
+
+    def __init__(self, root_dir, max_age_days=90):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        if max_age_days:
+            self.prune(max_age_days)
+
+    def load(self, key):
+        """
+        The snapshot of workbook `key` ({"cells", "reports", "settings", "saved_at"}),
+        or None.
+        """
+        folder = os.path.join(self.root_dir, key)
+        try:
+            with gzip.open(os.path.join(folder, "snapshot.json.gz"), "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            with np.load(os.path.join(folder, "cells.npz")) as arrays:
+                snapshot["cells"] = {sheet: arrays[f"s{i}"] for i, sheet in enumerate(snapshot.pop("sheets"))}
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Discarding unreadable revision snapshot %s: %s", folder, e)
+            shutil.rmtree(folder, ignore_errors=True)
+            return None
+        return snapshot
+
+    def save(self, key, cells, reports, settings):
+        folder = os.path.join(self.root_dir, key)
+        tmp_dir = f"{folder}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            sheets = list(cells)
+            np.savez_compressed(os.path.join(tmp_dir, "cells.npz"),
+                                **{f"s{i}": cells[sheet] for i, sheet in enumerate(sheets)})
+            snapshot = {"sheets": sheets, "reports": reports, "settings": settings,
+                        "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+            with gzip.open(os.path.join(tmp_dir, "snapshot.json.gz"), "wt", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, default=str)
+            # Swap the folders; a reader in between just sees no snapshot
+            shutil.rmtree(folder, ignore_errors=True)
+            os.replace(tmp_dir, folder)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def delete(self, key):
+        shutil.rmtree(os.path.join(self.root_dir, key), ignore_errors=True)
+
+    def prune(self, max_age_days):
+        cutoff = time.time() - max_age_days * 86400
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except FileNotFoundError:
+                continue
+
+
+_default_store = None
+
+
+def get_revision_store():
+    """
+    Returns the process-wide revision store (REVISIONS_DIR, default .cache/revisions;
+    snapshots older than REVISIONS_MAX_AGE_DAYS, default 90, are pruned).
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = RevisionStore(
+            os.getenv("REVISIONS_DIR", os.path.join(".cache", "revisions")),
+            max_age_days=float(os.getenv("REVISIONS_MAX_AGE_DAYS", "90")),
+        )
+    return _default_store
+
+
+def _workbook_reports(data):
+    """
+    The reports detected locally in the workbook, or one report per non-empty sheet.
+    """
+    reports = detect_reports(data)
+    if reports:
+        return reports
+    return [
+        {"id": i, "title": str(sheet), "location": f"Hoja: {sheet} - Filas 1-{len(content['values'])}",
+         "description": "Hoja completa", "sheet": sheet, "start_row": 1, "end_row": len(content['values'])}
+        for i, (sheet, content) in enumerate(((s, c) for s, c in data.items() if not c['values'].empty), 1)
+    ]
+
+
+def _narrative(analysis_text):
+    for pattern in CSV_BLOCK_PATTERNS:
+        analysis_text = re.sub(pattern, "[CSV consolidado]", analysis_text, flags=re.DOTALL)
+    return analysis_text
+
+
+def analyze_workbook_incremental(data, filename, api_key, store=None, max_workers=4, map_reduce=False,
+                                 use_cache=True, sheet_format=None, local_validation=True,
+                                 row_margin=FOCUS_ROW_MARGIN, structured_output=False):
+    """
+    Analyzes every report of a workbook, re-using the results of its previous version.
+
+    The sheets are fingerprinted cell by cell and diffed against the snapshot stored
+    for the same workbook (see workbook_key). Reports are the blocks found by the
+    local detector; a report analyzed before over the same rows is re-used as long as
+    no cell changed within its rows (plus `row_margin`, the rows the focused prompt
+    also shows). The rest are analyzed concurrently (one focused analysis each) and
+    the snapshot is replaced by this version.
+
+    Returns a dict with the combined analysis (markdown with a single ```csv block,
+    like analyze_report_map_reduce), the workbook key, whether a previous version was
+    found, the changed cell count and the titles of the reused, re-analyzed, failed
+    and partial reports (the last two are not stored, so the next version retries them).
+    """
+    store = store or get_revision_store()
+    key = workbook_key(filename)
+    settings = {"format": REVISION_FORMAT, "sheet_format": sheet_format, "local_validation": local_validation,
+                "structured_output": structured_output, "map_reduce": map_reduce}
+
+    with span("incremental.fingerprint", sheets=len(data)):
+        cells = {sheet: cell_hashes(content['values'], content.get('formulas')) for sheet, content in data.items()}
+    previous = store.load(key)
+    if previous is not None and previous["settings"] != settings:
+        # Results produced with other prompt settings are not comparable
+        previous = None
+
+    with span("incremental.diff") as attrs:
+        reports = _workbook_reports(data)
+        changes = diff_workbooks(previous["cells"], cells) if previous else {}
+        stored = {(r["sheet"], r["start_row"], r["end_row"]): r for r in (previous or {}).get("reports", [])}
+        results = [None] * len(reports)
+        pending = []
+        for i, report in enumerate(reports):
+            record = stored.get((report["sheet"], report["start_row"], report["end_row"]))
+            rows = changes.get(report["sheet"], (np.array([], dtype=np.int64), 0))[0]
+            touched = np.any((rows >= report["start_row"] - row_margin) & (rows <= report["end_row"] + row_margin))
+            if record is not None and not touched:
+                results[i] = record
+            else:
+                pending.append(i)
+        attrs.update(reports=len(reports), reused=len(reports) - len(pending))
+
+    def analyze(report):
+        return analyze_report(data, "xlsx", api_key, focus_context=report["title"], focus_location=report,
+                              map_reduce=map_reduce, use_cache=use_cache, sheet_format=sheet_format,
+                              local_validation=local_validation, structured_output=structured_output)
+
+    if pending:
+        with span("incremental.analyze", reports=len(pending)):
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+                futures = {i: executor.submit(contextvars.copy_context().run, analyze, reports[i]) for i in pending}
+                for i, future in futures.items():
+                    analysis_text = future.result()
+                    results[i] = {**{k: v for k, v in reports[i].items() if k != "ambiguous"},
+                                  "analysis": analysis_text, "csv": extract_csv_block(analysis_text)}
+
+    # Failed and partial analyses are not kept, so the next version retries them
+    failed = {i for i in pending if results[i]["analysis"].startswith(ERROR_PREFIX)}
+    partial = {i for i in pending if is_partial(results[i]["analysis"])}
+    store.save(key, cells, [result for i, result in enumerate(results) if i not in failed | partial], settings)
+
+    n_cells = sum(count for _, count in changes.values())
+    reused = [reports[i]["title"] for i in range(len(reports)) if i not in pending]
+    reanalyzed = [reports[i]["title"] for i in pending]
+    if previous:
+        header = (f"## Revisión de {filename}\n{len(reused)} reportes reutilizados, {len(reanalyzed)} re-analizados "
+                  f"({n_cells} celdas cambiadas respecto a la versión del {previous['saved_at']}).\n")
+    else:
+        header = f"## Análisis de {filename}\nPrimera versión registrada: {len(reports)} reportes analizados.\n"
+    sections = [
+        f"\n### {report['title']} ({report['location']}){' ♻️' if i not in pending else ''}\n"
+        f"{_narrative(results[i]['analysis'])}\n"
+        for i, report in enumerate(reports)
+    ]
+    analysis = header + "".join(sections)
+    merged_csv = merge_csv_blocks([result["csv"] for result in results if result.get("csv")])
+    if merged_csv:
+        analysis += f"\n\n### Datos Consolidados ({len(reports)} reportes)\n```csv\n{merged_csv}\n```\n"
+    return {"analysis": analysis, "key": key, "previous": previous is not None, "changed_cells": n_cells,
+            "reused": reused, "reanalyzed": reanalyzed, "failed": [reports[i]["title"] for i in sorted(failed)],
+            "partial": [reports[i]["title"] for i in sorted(partial)]}
@@ -0,0 +1,62 @@
+import contextvars
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.analysis import ERROR_PREFIX, analyze_report, build_csv_output, is_partial, is_throttled
+from utils.openai_client import get_settings
+
+# Attempts per report when the API keeps throttling after the client's own retries
+MAX_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 5.0
+
+
+def _analyze_one(data, file_type, api_key, report, options, max_attempts, local_validation):
+    start = time.perf_counter()
+    for attempt in range(1, max_attempts + 1):
+        analysis_text = analyze_report(data, file_type, api_key, focus_context=report.get("title"),
+                                       focus_location=report, local_validation=local_validation, **options)
+        if not is_throttled(analysis_text) or attempt == max_attempts:
+            break
+        # Exponential backoff with jitter, so retried reports do not return in lockstep
+        time.sleep(RETRY_BASE_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+    failed = analysis_text.startswith(ERROR_PREFIX)
+    csv_output = None if failed else build_csv_output(analysis_text, data, local_validation=local_validation)
+    return {"report": report, "analysis": analysis_text, "csv_output": csv_output, "error": failed,
+            "partial": is_partial(analysis_text), "attempts": attempt, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def analyze_reports(data, file_type, api_key, reports, max_workers=None, max_attempts=MAX_ATTEMPTS,
+                    map_reduce=False, use_cache=True, sheet_format=None, local_validation=True,
+                    structured_output=False):
+    """
+    Analyzes every scanned report of a document concurrently and yields the results
+    as they finish (not in report order).
+
+    One focused analysis per report is submitted at once, up to `max_workers` at a
+    time (OPENAI_MAX_CONCURRENCY by default). Every model request waits for room in
+    the per-minute budgets of utils.openai_client (OPENAI_RPM_LIMIT/OPENAI_TPM_LIMIT)
+    before it is sent; a report whose analysis is still throttled after the client's
+    retries is retried with backoff up to `max_attempts` times. With map_reduce, a
+    throttled part fails the analysis of its report, which is retried as a whole (the
+    parts already answered come from the response cache when use_cache is on).
+
+    Each result is a dict with report, analysis (the response text), csv_output (see
+    build_csv_output; None when the analysis failed), error, partial (some map-reduce
+    parts could not be analyzed, see is_partial), attempts and seconds.
+    """
+    if not reports:
+        return
+    options = dict(map_reduce=map_reduce, use_cache=use_cache, sheet_format=sheet_format,
+                   structured_output=structured_output)
+    max_workers = max(1, min(max_workers or get_settings().max_concurrency, len(reports)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Workers run in a copy of the caller's context, so their model calls are
+        # recorded in the caller's instrumentation run
+        futures = [
+            executor.submit(contextvars.copy_context().run, _analyze_one, data, file_type, api_key, report,
+                            options, max_attempts, local_validation)
+            for report in reports
+        ]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,169 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+# Format used for sheets in prompts unless a caller asks for another one
+DEFAULT_SHEET_FORMAT = os.getenv("SHEET_FORMAT", "tsv")
+# Rows rendered with to_string() to estimate the legacy size of a sheet
+TABLE_ESTIMATE_ROWS = 200
+
+
+def _format_value(value):
+    """
+    Shortest faithful text for a cell value.
+    """
+    if isinstance(value, (float, np.floating)):
+        if float(value).is_integer():
+            return str(int(value))
+        return repr(float(value))
+    if isinstance(value, (pd.Timestamp, datetime.datetime)):
+        if value.hour == value.minute == value.second == 0:
+            return value.strftime("%Y-%m-%d")
+        return value.isoformat()
+    if isinstance(value, (bool, np.bool_)):
+        return "TRUE" if value else "FALSE"
+    return " ".join(str(value).split())
+
+
+def _trimmed(df):
+    """
+    Drops fully empty rows and columns. Returns the remaining values, their 1-based
+    Excel row numbers, their Excel column letters and the filled-cell mask.
+
+    Positions come from the index/column labels (0-based, as produced by parse_excel),
+    so slices of a sheet keep their original coordinates.
+    """
+    mask = df.notna().to_numpy()
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    trimmed = df.iloc[rows, cols]
+    row_numbers = [
+        label + 1 if isinstance(label, (int, np.integer)) else pos + 1
+        for label, pos in zip(trimmed.index, rows)
+    ]
+    letters = [
+        get_column_letter((label if isinstance(label, (int, np.integer)) else pos) + 1)
+        for label, pos in zip(trimmed.columns, cols)
+    ]
+    return trimmed.to_numpy(dtype=object), row_numbers, letters, mask[np.ix_(rows, cols)]
+
+
+def serialize_table(df):
+    """
+    Legacy fixed-width DataFrame.to_string() layout.
+    """
+    return df.to_string()
+
+
+def serialize_tsv(df):
+    """
+    Tab-separated values with empty rows and columns dropped. The first line holds the
+    Excel column letters and every row starts with its Excel row number.
+    """
+    values, row_numbers, letters, mask = _trimmed(df)
+    lines = ["#\t" + "\t".join(letters)]
+    for i, row_number in enumerate(row_numbers):
+        cells = [_format_value(v) if filled else "" for v, filled in zip(values[i], mask[i])]
+        while cells and cells[-1] == "":
+            cells.pop()
+        lines.append(f"{row_number}\t" + "\t".join(cells))
+    return "\n".join(lines)
+
+
+def serialize_cells(df):
+    """
+    Sparse A1=value form: one filled cell per line.
+    """
+    values, row_numbers, letters, mask = _trimmed(df)
+    lines = []
+    for i, j in zip(*np.nonzero(mask)):
+        lines.append(f"{letters[j]}{row_numbers[i]}={_format_value(values[i, j])}")
+    return "\n".join(lines)
+
+
+def serialize_rows(df):
+    """
+    Row-numbered blocks: one line per non-empty row listing only its filled cells
+    with their column letters, e.g. `45: A=Caja | B=1500`.
+    """
+    values, row_numbers, letters, mask = _trimmed(df)
+    lines = []
+    for i, row_number in enumerate(row_numbers):
+        cells = [f"{letters[j]}={_format_value(values[i, j])}" for j in np.flatnonzero(mask[i])]
+        lines.append(f"{row_number}: " + " | ".join(cells))
+    return "\n".join(lines)
+
+
+SERIALIZERS = {
+    "table": serialize_table,
+    "tsv": serialize_tsv,
+    "cells": serialize_cells,
+    "rows": serialize_rows,
+}
+
+
+# One-line legend placed before each serialized sheet so the model can read the layout
+FORMAT_LEGENDS = {
+    "table": "",
+    "tsv": "(Formato TSV: la 1ra línea son las letras de columna Excel; cada fila empieza con su número de fila Excel)",
+    "cells": "(Formato celda=valor: una celda Excel no vacía por línea, ej. B45=1500)",
+    "rows": "(Formato por filas: 'fila: columna=valor | ...' con coordenadas Excel)",
+}
+
+
+def register_serializer(name, fn, legend=""):
+    """
+    Adds a sheet serializer (a function DataFrame -> str) under `name`.
+    """
+    SERIALIZERS[name] = fn
+    FORMAT_LEGENDS[name] = legend
+
+
+def format_legend(fmt=None):
+    return FORMAT_LEGENDS.get(fmt or DEFAULT_SHEET_FORMAT, "")
+
+
+def serialize_sheet(df, fmt=None):
+    """
+    Serializes one sheet's values with the named format (DEFAULT_SHEET_FORMAT by default).
+    """
+    fmt = fmt or DEFAULT_SHEET_FORMAT
+    try:
+        serializer = SERIALIZERS[fmt]
+    except KeyError:
+        raise ValueError(f"Unknown sheet format '{fmt}'. Available: {', '.join(SERIALIZERS)}")
+    return serializer(df)
+
+
+def estimate_table_chars(df):
+    """
+    Approximate len(serialize_table(df)) without rendering the whole sheet.
+
+    to_string() pads every line to the same width, so its length is about
+    (rows + 1) x line width. The width is taken from a to_string() of evenly spaced
+    rows (first and last included); a wider cell outside them is not seen.
+    """
+    if len(df) <= TABLE_ESTIMATE_ROWS:
+        return len(serialize_table(df))
+    positions = np.linspace(0, len(df) - 1, TABLE_ESTIMATE_ROWS).astype(int)
+    sample = serialize_table(df.iloc[positions])
+    line_chars = max(len(line) for line in sample.split("\n")) + 1
+    return (len(df) + 1) * line_chars - 1
+
+
+def sheet_size_stats(df, fmt=None):
+    """
+    Compares the size of a sheet serialized with `fmt` against DataFrame.to_string()
+    (estimated, see estimate_table_chars).
+    """
+    original_chars = estimate_table_chars(df)
+    compact_chars = len(serialize_sheet(df, fmt))
+    return {
+        "format": fmt or DEFAULT_SHEET_FORMAT,
+        "original_chars": original_chars,
+        "compact_chars": compact_chars,
+        "reduction": 1 - compact_chars / original_chars if original_chars else 0.0,
+    }
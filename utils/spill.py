@@ -0,0 +1,87 @@
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Spill folders left behind (e.g. where mapped files cannot be deleted) are removed after this age
+SPILL_MAX_AGE_SECONDS = 24 * 3600
+
+
+def default_spill_dir():
+    return os.getenv("EXCEL_SPILL_DIR", os.path.join(".cache", "spill"))
+
+
+def _is_spillable(series):
+    return series.dtype.kind in "fiub" or isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def frame_nbytes(df):
+    """
+    Returns (bytes held by `df`, bytes of it that spill_frame can move to disk).
+    Object columns are measured deeply, since their values live in Python objects.
+    """
+    usage = df.memory_usage(index=False, deep=True)
+    spillable = sum(int(usage[col]) for col in df.columns if _is_spillable(df[col]))
+    return int(usage.sum()), spillable
+
+
+def _prune(root):
+    cutoff = time.time() - SPILL_MAX_AGE_SECONDS
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            continue
+
+
+def _map_back(path):
+    """
+    Memory-maps a saved array read-only and removes the file: the mapping keeps the
+    data readable and the disk space is released when the array is garbage collected.
+    Where an open mapping cannot be deleted (Windows) the file is left for _prune.
+    """
+    array = np.load(path, mmap_mode="r")
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return array
+
+
+def spill_frame(df, root=None):
+    """
+    Moves the numeric and categorical columns of `df` to .npy files and returns an
+    equivalent DataFrame whose columns are memory-mapped back from them, so the OS
+    pages the data in and out instead of holding it on the heap. Mixed/object
+    columns stay in memory. Index, column labels and dtypes are unchanged.
+    """
+    root = root or default_spill_dir()
+    os.makedirs(root, exist_ok=True)
+    _prune(root)
+    directory = os.path.join(root, uuid.uuid4().hex)
+    os.makedirs(directory)
+    columns = {}
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            path = os.path.join(directory, f"{i}.codes.npy")
+            np.save(path, np.asarray(series.array.codes))
+            values = pd.Categorical.from_codes(_map_back(path), dtype=series.dtype, validate=False)
+            columns[col] = pd.Series(values, index=df.index, name=col, copy=False)
+        elif _is_spillable(series):
+            path = os.path.join(directory, f"{i}.npy")
+            np.save(path, series.to_numpy())
+            columns[col] = pd.Series(_map_back(path), index=df.index, name=col, copy=False)
+        else:
+            columns[col] = series
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass
+    # copy=False keeps one block per column, so every column stays backed by its map
+    return pd.DataFrame(columns, index=df.index, columns=df.columns, copy=False)
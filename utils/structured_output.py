@@ -0,0 +1,226 @@
+import csv
+import json
+import re
+from io import StringIO
+
+# Columns of the analysis CSV the structured response is expanded into
+CSV_COLUMNS = [
+    "Hoja", "Entidad", "Año", "Mes", "Nivel_1", "Nivel_2", "Nivel_3", "Nivel_4", "Nivel_5", "Concepto_Final",
+    "Valor", "Moneda", "Es_Total", "Origen_Dato", "Relacion_Celdas", "Ecuacion_Validacion",
+    "Explicacion_Validacion", "Es_Outlier",
+]
+MAX_LEVELS = 5
+# Strings (group 1 closes them; a string cut at the end has none) and the
+# structural characters of a JSON text
+JSON_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(")?|[{}\[\]:,]')
+
+# Appended to the static analysis prompt in structured mode. The response is a JSON
+# object in a normalized shape: what the CSV repeats on every row (sheet, entity,
+# period, currency and the hierarchy path) is declared once and referenced by id, so
+# the model generates a fraction of the tokens of the equivalent CSV.
+STRUCTURED_OUTPUT_SECTION = """
+    ═══════════════════════════════════════════════════════════════════════════════
+    FORMATO DE SALIDA: JSON ESTRUCTURADO (REEMPLAZA AL BLOQUE CSV)
+    ═══════════════════════════════════════════════════════════════════════════════
+
+    En esta solicitud NO escribas el bloque CSV: responde con un objeto JSON según el esquema.
+    El CSV de la FASE 3 se reconstruye automáticamente a partir de él, con las mismas reglas.
+
+    - **informe**: Resumen Ejecutivo y Análisis Estructural de la FASE 4 en markdown (sin CSV).
+    - **contextos**: Cada combinación distinta de Hoja, Entidad, Año, Mes y Moneda, declarada UNA vez con un id.
+    - **nodos**: Cada categoría de la jerarquía (Nivel_1, Nivel_2, ...) declarada UNA vez con un id y el id
+      de su padre (null en Nivel_1). Dos categorías con el mismo nombre bajo padres distintos son nodos distintos.
+    - **filas**: Una por dato, con SOLO lo que cambia:
+      * c: id del contexto.
+      * n: id del nodo del que cuelga el concepto (el último nivel de su ruta; null si no tiene niveles).
+      * k: Concepto_Final (solo texto).  v: Valor (número, sin separador de miles).  t: Es_Total.
+      * o: celda o página de origen SIN la hoja (ej. "B10"); la hoja la aporta el contexto.
+      * r: Relacion_Celdas (ej. "Suma(B10:B19)" o "Dato directo").
+{validation_fields}
+    **EJEMPLO** (las dos filas del ejemplo CSV):
+    {{"informe": "## Resumen Ejecutivo ...",
+     "contextos": [{{"id": 1, "hoja": "H1", "entidad": "Empresa ABC", "anio": "2023", "mes": "Dic", "moneda": "USD"}}],
+     "nodos": [{{"id": 1, "nombre": "Activos", "padre": null}}, {{"id": 2, "nombre": "Corrientes", "padre": 1}},
+               {{"id": 3, "nombre": "Caja y Bancos", "padre": 2}}],
+     "filas": [{{"c": 1, "n": 3, "k": "Caja General", "v": 50000.0, "t": false, "o": "B10", "r": "Dato directo"{example_validation}}},
+               {{"c": 1, "n": 2, "k": "Total Activos Corrientes", "v": 1200000.0, "t": true, "o": "B20", "r": "Suma(B10:B19)"{example_validation}}}]}}
+    """
+
+MODEL_VALIDATION_FIELDS = {
+    "validation_fields": """      * e: Ecuacion_Validacion.  x: Explicacion_Validacion.  out: Es_Outlier.
+""",
+    "example_validation": ', "e": "", "x": "Valor base reportado", "out": false',
+}
+LOCAL_VALIDATION_FIELDS = {"validation_fields": "", "example_validation": ""}
+
+STRUCTURED_SYSTEM_NOTE = """
+
+FORMATO ESTRUCTURADO:
+   - Cuando la solicitud pide JSON estructurado, el CSV se entrega en ese JSON (contextos, nodos y filas)
+   - Las reglas del CSV (filas completas, trazabilidad, niveles) se aplican igual a las filas del JSON"""
+
+
+def structured_prompt_section(local_validation=True):
+    fields = LOCAL_VALIDATION_FIELDS if local_validation else MODEL_VALIDATION_FIELDS
+    return STRUCTURED_OUTPUT_SECTION.format(**fields)
+
+
+def _object(properties):
+    # Strict schemas require every property and no others
+    return {"type": "object", "properties": properties, "required": list(properties),
+            "additionalProperties": False}
+
+
+def response_format(local_validation=True):
+    """
+    The response_format (strict JSON schema) of a structured analysis. With
+    local_validation=False the rows also carry the model's validation columns.
+    """
+    row = {
+        "c": {"type": "integer", "description": "id del contexto"},
+        "n": {"type": ["integer", "null"], "description": "id del nodo del que cuelga el concepto"},
+        "k": {"type": "string", "description": "Concepto_Final"},
+        "v": {"type": ["number", "null"], "description": "Valor"},
+        "t": {"type": "boolean", "description": "Es_Total"},
+        "o": {"type": "string", "description": "Origen_Dato sin la hoja"},
+        "r": {"type": "string", "description": "Relacion_Celdas"},
+    }
+    if not local_validation:
+        row.update({
+            "e": {"type": "string", "description": "Ecuacion_Validacion"},
+            "x": {"type": "string", "description": "Explicacion_Validacion"},
+            "out": {"type": "boolean", "description": "Es_Outlier"},
+        })
+    text = {"type": "string"}
+    schema = _object({
+        "informe": {"type": "string", "description": "Resumen Ejecutivo y Análisis Estructural en markdown"},
+        "contextos": {"type": "array", "items": _object({
+            "id": {"type": "integer"}, "hoja": text, "entidad": text, "anio": text, "mes": text, "moneda": text,
+        })},
+        "nodos": {"type": "array", "items": _object({
+            "id": {"type": "integer"}, "nombre": text, "padre": {"type": ["integer", "null"]},
+        })},
+        "filas": {"type": "array", "items": _object(row)},
+    })
+    return {"type": "json_schema", "json_schema": {"name": "analisis_reporte", "strict": True, "schema": schema}}
+
+
+def _closing_points(text):
+    """
+    The places a cut JSON text can be closed at, last first: (end, closers) after
+    every complete object or array and after every string value of the top-level
+    object, where `closers` are the brackets still open there, innermost first.
+    """
+    points = []
+    stack = []
+    after_colon = False
+    for match in JSON_TOKEN.finditer(text):
+        token = match.group()
+        if token in "{[":
+            stack.append("}" if token == "{" else "]")
+        elif token in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if stack:
+                points.append((match.end(), "".join(reversed(stack))))
+        elif token == ":":
+            after_colon = True
+            continue
+        elif match.group(1) and after_colon and len(stack) == 1:
+            points.append((match.end(), "}"))
+        after_colon = False
+    return points[::-1]
+
+
+def _load_payload(text):
+    """
+    Parses a structured response. A response cut at the output limit is closed after
+    its last complete value (a row, a node, a context or the report text), so the
+    rows generated so far are kept wherever the cut falls.
+    Returns (payload, truncated).
+    """
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    for end, closers in _closing_points(text)[:20]:
+        try:
+            return json.loads(text[:end] + closers), True
+        except json.JSONDecodeError:
+            continue
+    return None, True
+
+
+def _node_paths(nodes):
+    """
+    Hierarchy path (root first) of every node id. A parent chain that loops back
+    (a cycle in the model's nodes) stops at the first node seen twice.
+    """
+    by_id = {node.get("id"): node for node in nodes}
+    paths = {}
+    for node_id in by_id:
+        path = []
+        seen = set()
+        current_id = node_id
+        while current_id in by_id and current_id not in seen:
+            seen.add(current_id)
+            current = by_id[current_id]
+            path.append(str(current.get("nombre") or ""))
+            current_id = current.get("padre")
+        paths[node_id] = path[::-1]
+    return paths
+
+
+def _levels(path):
+    # Paths deeper than the CSV allows keep their last levels joined in Nivel_5
+    if len(path) > MAX_LEVELS:
+        path = path[:MAX_LEVELS - 1] + [" > ".join(path[MAX_LEVELS - 1:])]
+    return path + [""] * (MAX_LEVELS - len(path))
+
+
+def _flag(value):
+    if value is None or value == "":
+        return ""
+    return "SI" if value else "NO"
+
+
+def expand_rows(payload):
+    """
+    The CSV rows (lists in CSV_COLUMNS order) of a structured response payload.
+    """
+    contexts = {context.get("id"): context for context in payload.get("contextos") or []}
+    paths = _node_paths(payload.get("nodos") or [])
+    rows = []
+    for row in payload.get("filas") or []:
+        context = contexts.get(row.get("c"), {})
+        sheet = str(context.get("hoja") or "")
+        origin = str(row.get("o") or "")
+        if sheet and origin and sheet not in origin:
+            origin = f"{sheet}:{origin}"
+        value = row.get("v")
+        rows.append([
+            sheet, context.get("entidad", ""), context.get("anio", ""), context.get("mes", ""),
+            *_levels(paths.get(row.get("n"), [])),
+            row.get("k", ""), "" if value is None else value, context.get("moneda", ""), _flag(row.get("t")),
+            origin, row.get("r", ""), row.get("e", ""), row.get("x", ""), _flag(row.get("out")),
+        ])
+    return rows
+
+
+def expand_structured(text):
+    """
+    Turns a structured analysis response into the markdown + ```csv block layout of
+    a regular analysis response, so the rest of the app handles both the same way.
+    Text that is not a structured response is returned unchanged.
+    """
+    payload, truncated = _load_payload(text)
+    if not isinstance(payload, dict):
+        return text
+    buffer = StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+    writer.writerow(CSV_COLUMNS)
+    writer.writerows(expand_rows(payload))
+    note = "\n\n⚠️ [Respuesta interrumpida por el límite de salida: se conservan las filas completas]" \
+        if truncated else ""
+    return f"{payload.get('informe', '')}{note}\n\n```csv\n{buffer.getvalue().rstrip()}\n```\n"
@@ -0,0 +1,180 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# "AL 30 DE JUNIO DE 2023", "(En bolivianos)", "Expresado en miles de USD", ...
+MARKER_PATTERN = re.compile(
+    r"\bAL\s+\d{1,2}\s+DE\s+[A-ZÁÉÍÓÚ]+|\(?\s*EN\s+(BOLIVIANOS|D[OÓ]LARES|MILES|MILLONES)|EXPRESADO\s+EN",
+    re.IGNORECASE,
+)
+
+
+def _row_features(df):
+    """
+    Per-row counts of filled, numeric and text cells plus a title/marker classification,
+    computed column-wise with vectorized pandas/NumPy operations.
+    """
+    filled = df.notna().to_numpy()
+    numeric = np.column_stack([
+        pd.to_numeric(df[col], errors="coerce").notna().to_numpy() for col in df.columns
+    ]) if len(df.columns) else np.zeros_like(filled)
+    text = filled & ~numeric
+
+    n_filled = filled.sum(axis=1)
+    n_numeric = numeric.sum(axis=1)
+    n_text = text.sum(axis=1)
+
+    # Text of the rows that can be titles, markers or headers (text cells only);
+    # numeric data rows never need it
+    values = df.to_numpy(dtype=object)
+    row_text = np.full(len(df), "", dtype=object)
+    for i in np.flatnonzero((n_text >= 1) & (n_numeric <= 1)):
+        row_text[i] = " | ".join(str(v).strip() for v in values[i][text[i]])
+
+    is_marker = np.array([bool(MARKER_PATTERN.search(t)) for t in row_text], dtype=bool)
+    is_title = (n_text >= 1) & (n_numeric == 0) & (n_filled <= 2) & ~is_marker
+    is_header = (n_text >= 3) & (n_numeric <= 1)
+    return {
+        "n_filled": n_filled,
+        "n_numeric": n_numeric,
+        "row_text": row_text,
+        "is_marker": is_marker,
+        "is_title": is_title,
+        "is_header": is_header,
+    }
+
+
+def _segment(features, min_blank_gap):
+    """
+    Splits the sheet rows into (start, stop) candidate blocks.
+
+    A new block starts after `min_blank_gap` or more blank rows, at a title/marker row
+    that follows a blank row once the current block already holds numeric data, and
+    at a repeated header row (together with the title rows right above it).
+    """
+    n_filled = features["n_filled"]
+    n_numeric = features["n_numeric"]
+    is_title = features["is_title"] | features["is_marker"]
+    is_header = features["is_header"]
+    row_text = features["row_text"]
+
+    n_rows = len(n_filled)
+    rows = np.arange(n_rows)
+    blank = n_filled == 0
+    # Last non-blank row at or before each row, and blank rows right before each row
+    last_filled = np.maximum.accumulate(np.where(~blank, rows, -1))
+    prev_filled = np.concatenate([[-1], last_filled[:-1]])
+    blank_before = rows - prev_filled - 1
+    # cum_numeric[i] = number of rows with numbers among rows [0, i)
+    cum_numeric = np.concatenate([[0], np.cumsum(n_numeric > 0)])
+
+    # Only rows after a blank gap, title/marker rows and header rows can open a block;
+    # plain data rows in between are covered by the cumulative counts
+    events = np.flatnonzero(~blank & ((blank_before > 0) | is_title | is_header))
+    first_filled = np.flatnonzero(~blank)[:1]
+    events = np.union1d(first_filled, events)
+
+    starts = []
+    seen_headers = set()
+    for i in events:
+        if not starts:
+            starts.append(i)
+        else:
+            block_has_numbers = cum_numeric[i] - cum_numeric[starts[-1]] > 0
+            if blank_before[i] >= min_blank_gap:
+                starts.append(i)
+            elif block_has_numbers and is_title[i] and blank_before[i] > 0:
+                starts.append(i)
+            elif block_has_numbers and is_header[i] and row_text[i] in seen_headers:
+                # Pull the title rows immediately above into the new block
+                start = i
+                while start - 1 > starts[-1] and is_title[start - 1]:
+                    start -= 1
+                starts.append(start)
+        if is_header[i]:
+            seen_headers.add(row_text[i])
+
+    blocks = []
+    for k, start in enumerate(starts):
+        stop = starts[k + 1] if k + 1 < len(starts) else n_rows
+        # Trim trailing blank rows
+        blocks.append((int(start), int(last_filled[stop - 1]) + 1))
+
+    # Blocks without numbers (titles, notes) become the heading of the next block
+    merged = []
+    pending_start = None
+    for start, stop in blocks:
+        if cum_numeric[stop] - cum_numeric[start] == 0:
+            if pending_start is None:
+                pending_start = start
+            continue
+        merged.append((pending_start if pending_start is not None else start, stop))
+        pending_start = None
+    if pending_start is not None and merged:
+        merged[-1] = (merged[-1][0], blocks[-1][1])
+    return merged
+
+
+def _block_title(features, start, stop):
+    """
+    Builds a title from the leading title rows of a block (None when there are none).
+    """
+    parts = []
+    marker = None
+    for i in range(start, min(stop, start + 6)):
+        text = features["row_text"][i]
+        if features["is_marker"][i]:
+            marker = marker or text
+        elif features["is_title"][i]:
+            if text not in parts:
+                parts.append(text)
+        elif features["n_numeric"][i] > 0:
+            break
+    return " - ".join(parts[:2]) or None, marker
+
+
+def detect_sheet_reports(sheet_name, df, min_blank_gap=2):
+    """
+    Detects the report blocks of one sheet.
+    Rows in the returned records are 1-based Excel rows.
+    """
+    if df.empty:
+        return []
+    features = _row_features(df)
+    reports = []
+    blocks = _segment(features, min_blank_gap)
+    for k, (start, stop) in enumerate(blocks, 1):
+        title, marker = _block_title(features, start, stop)
+        has_header = bool(features["is_header"][start:stop].any())
+        n_data_rows = int((features["n_numeric"][start:stop] > 0).sum())
+        description = f"Tabla de {n_data_rows} filas con datos"
+        if marker:
+            description += f" ({marker})"
+        fallback_title = f"{sheet_name} - Tabla {k}" if len(blocks) > 1 else str(sheet_name)
+        reports.append({
+            "title": title or fallback_title,
+            "location": f"Hoja: {sheet_name} - Filas {start + 1}-{stop}",
+            "description": description,
+            "sheet": sheet_name,
+            "start_row": start + 1,
+            "end_row": stop,
+            # Without a title or header row the block needs the model to name it
+            "ambiguous": title is None and not has_header,
+        })
+    return reports
+
+
+def detect_reports(data, min_blank_gap=2):
+    """
+    Detects report blocks across every sheet of parsed Excel data.
+
+    Returns records with the same title/location/description keys as the model scan
+    (plus sheet, start_row, end_row and ambiguous), numbered with consecutive ids.
+    """
+    reports = []
+    for sheet_name, content in data.items():
+        reports.extend(detect_sheet_reports(sheet_name, content['values'], min_blank_gap))
+    for i, report in enumerate(reports, 1):
+        report["id"] = i
+    return reports
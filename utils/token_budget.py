@@ -0,0 +1,205 @@
+import logging
+import math
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # optional: the calibrated estimate below is used instead
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Context window and maximum completion size (tokens) of the models the app calls
+MODEL_LIMITS = {
+    "gpt-4o": {"context": 128000, "output": 16384},
+    "gpt-4o-mini": {"context": 128000, "output": 16384},
+    "gpt-4.1": {"context": 1047576, "output": 32768},
+    "gpt-4.1-mini": {"context": 1047576, "output": 32768},
+}
+DEFAULT_LIMITS = {"context": 128000, "output": 4096}
+
+# Tokens the API adds around every chat message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Share of the context window left unused to absorb estimation error
+SAFETY_MARGIN = 0.05
+# Every block keeps at least this many tokens (or all of it, if smaller) before the
+# rest of the budget is shared in proportion to size, so small sheets/pages are not
+# reduced to nothing next to a huge one
+MIN_BLOCK_TOKENS = 400
+# Share of a truncated block kept from its end (totals usually close a table)
+TAIL_SHARE = 0.2
+TRUNCATION_MARKER = "\n... [DATOS TRUNCADOS POR LÍMITE DE CONTEXTO: {lines} líneas omitidas] ...\n"
+
+# Calibrated estimate, modelled on how the GPT-4o tokenizer splits text: words cost
+# about one token per 4 letters (rounded up per word), numbers one token per group
+# of up to 3 digits, and punctuation, line breaks, tabs and runs of spaces one token
+# each. It errs on the high side for prose and is close for the numeric tables the
+# prompts are made of.
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+DIGIT_GROUP_PATTERN = re.compile(r"\d{1,3}")
+SYMBOL_PATTERN = re.compile(r"[^\w\s]|_")
+BREAK_PATTERN = re.compile(r"[ ]*[\n\t\r][\s]*| {2,}")
+LETTERS_PER_TOKEN = 4
+
+
+def model_limits(model):
+    return MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    """
+    The tiktoken encoding of `model`, or None when tiktoken is not installed or its
+    encoding files cannot be loaded (they are downloaded once, then cached).
+    """
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("Tokenizer unavailable for %s, using the estimate instead: %s", model, e)
+        return None
+
+
+def estimate_tokens(text):
+    """
+    Token count of `text` without a tokenizer (see the calibration notes above).
+    """
+    if not text:
+        return 0
+    words = WORD_PATTERN.findall(text)
+    word_tokens = sum(map(len, words)) / LETTERS_PER_TOKEN + len(words) / 2
+    return int(word_tokens + len(DIGIT_GROUP_PATTERN.findall(text)) + len(SYMBOL_PATTERN.findall(text))
+               + len(BREAK_PATTERN.findall(text))) + 1
+
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    Tokens of `text` for `model`: exact with tiktoken when it is available,
+    otherwise the calibrated estimate.
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def input_budget(model, fixed_texts=(), output_tokens=None):
+    """
+    Tokens left for the document data in one request to `model`.
+
+    The context window (minus the safety margin) is reduced by the room reserved
+    for the answer (`output_tokens`, at most the model's maximum output; the whole
+    maximum by default, since the CSV is the bulk of an analysis response) and by
+    the fixed texts of the request (system prompt, template), which are counted.
+    """
+    limits = model_limits(model)
+    output = limits["output"] if output_tokens is None else min(output_tokens, limits["output"])
+    fixed = sum(count_tokens(text, model) + MESSAGE_OVERHEAD_TOKENS for text in fixed_texts)
+    return max(0, int(limits["context"] * (1 - SAFETY_MARGIN)) - output - fixed)
+
+
+def output_limit(model, output_tokens=None):
+    """
+    The max_tokens value matching the room input_budget reserved for the answer.
+    """
+    limit = model_limits(model)["output"]
+    return limit if output_tokens is None else min(output_tokens, limit)
+
+
+def allocate(sizes, budget):
+    """
+    Splits `budget` tokens across blocks of the given token sizes.
+
+    Everything fits: every block keeps its size. Otherwise each block first gets
+    up to MIN_BLOCK_TOKENS (fewer when there are many blocks) and the rest of the
+    budget is shared in proportion to what each block still needs, so the budget
+    is used whole and large blocks give up the most.
+    """
+    if sum(sizes) <= budget:
+        return list(sizes)
+    if not sizes:
+        return []
+    floor = min(MIN_BLOCK_TOKENS, budget // (2 * len(sizes)))
+    allotments = [min(size, floor) for size in sizes]
+    remaining = budget - sum(allotments)
+    needs = [size - allotted for size, allotted in zip(sizes, allotments)]
+    total_need = sum(needs)
+    return [allotted + int(remaining * need / total_need) if total_need else allotted
+            for allotted, need in zip(allotments, needs)]
+
+
+def _cut_lines(text, n_chars, from_end=False):
+    """
+    The first (or last) whole lines of `text` within n_chars characters.
+    """
+    if n_chars <= 0:
+        return ""
+    if from_end:
+        piece = text[-n_chars:]
+        newline = piece.find("\n")
+        return piece[newline + 1:] if 0 <= newline < len(piece) - 1 else piece
+    piece = text[:n_chars]
+    newline = piece.rfind("\n")
+    return piece[:newline + 1] if newline > 0 else piece
+
+
+def fit_text(text, max_tokens, model="gpt-4o", tokens=None):
+    """
+    Cuts `text` to at most `max_tokens`, keeping whole lines from its start and
+    (TAIL_SHARE of the room) from its end, with a marker in between that says how
+    many lines were left out. `tokens` is the known count of `text`, if any.
+    """
+    tokens = count_tokens(text, model) if tokens is None else tokens
+    if tokens <= max_tokens:
+        return text
+    chars_per_token = len(text) / max(tokens, 1)
+    room = max_tokens - count_tokens(TRUNCATION_MARKER.format(lines=text.count("\n")), model)
+    # The density varies along the text, so shrink until the estimate confirms it fits
+    for _ in range(5):
+        if room <= 0:
+            return ""
+        n_chars = int(room * chars_per_token)
+        tail = _cut_lines(text, int(n_chars * TAIL_SHARE), from_end=True)
+        head = _cut_lines(text, n_chars - len(tail))
+        if len(head) + len(tail) >= len(text):
+            tail = ""
+        omitted = text.count("\n") - head.count("\n") - tail.count("\n")
+        fitted = head + TRUNCATION_MARKER.format(lines=max(omitted, 0)) + tail
+        fitted_tokens = count_tokens(fitted, model)
+        if fitted_tokens <= max_tokens:
+            return fitted
+        room = int(room * max_tokens / fitted_tokens * 0.95)
+    return fitted[:max(0, int(max_tokens * chars_per_token * 0.5))]
+
+
+def fit_blocks(blocks, budget, model="gpt-4o", sizes=None):
+    """
+    Fits a document made of blocks (sheets, pages) into `budget` tokens.
+
+    The budget is allocated across the blocks (see allocate) and each block over
+    its share is cut with fit_text. Returns the block texts, all unchanged when the
+    whole document fits. `sizes` are the token counts of the blocks, if known.
+    """
+    sizes = [count_tokens(block, model) for block in blocks] if sizes is None else sizes
+    if sum(sizes) <= budget:
+        return list(blocks)
+    return [fit_text(block, allotted, model, tokens=size)
+            for block, size, allotted in zip(blocks, sizes, allocate(sizes, budget))]
+
+
+def chars_for_tokens(text, max_tokens, model="gpt-4o"):
+    """
+    Characters of `text` that hold about `max_tokens` tokens, at the token density
+    of `text` itself (numeric tables pack far fewer characters per token than prose).
+    """
+    tokens = count_tokens(text, model)
+    if not tokens:
+        return max_tokens * LETTERS_PER_TOKEN
+    return max(1, math.floor(max_tokens * len(text) / tokens))
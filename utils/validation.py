@@ -0,0 +1,274 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# A total is flagged when its components differ from the reported value by more than this
+TOTAL_TOLERANCE = 0.01
+# Deviations (in standard deviations) that make a value an outlier within its series
+OUTLIER_SIGMAS = 2.0
+# A series needs at least this many values before sigma-based outliers are computed
+OUTLIER_MIN_POINTS = 3
+# Components listed in Ecuacion_Validacion before the rest is abbreviated
+EQUATION_MAX_TERMS = 6
+
+LEVEL_COLUMNS = [f"Nivel_{i}" for i in range(1, 6)]
+SCOPE_COLUMNS = ["Hoja", "Entidad", "Año", "Mes", "Moneda"]
+SERIES_COLUMNS = ["Hoja", "Entidad", "Moneda"] + LEVEL_COLUMNS + ["Concepto_Final"]
+VALIDATION_COLUMNS = ["Ecuacion_Validacion", "Explicacion_Validacion", "Es_Outlier"]
+
+TRUE_VALUES = {"SI", "SÍ", "S", "TRUE", "1", "YES", "Y"}
+CELL_PATTERN = re.compile(r"\b([A-Z]{1,3})(\d+)\b")
+# "B10:B19", "B10 a B19", "B10 hasta B19". A dash is not a range separator: "B5-B6"
+# is the difference written by utils.formula_graph for B5 minus B6
+RANGE_PATTERN = re.compile(r"\b([A-Z]{1,3})(\d+)\s*(?::|\ba\b|\bal\b|\bhasta\b)\s*([A-Z]{1,3})(\d+)\b")
+# Accounts that are negative by nature inside Activos (contra accounts)
+CONTRA_ACCOUNT_PATTERN = re.compile(r"depreciaci|amortizaci|previsi|provisi|deterioro|incobrab", re.IGNORECASE)
+
+
+def _format_number(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return f"{value:.2f}"
+
+
+def _text_column(df, column):
+    """
+    A column as stripped strings ("" for missing), or all "" when the column is absent.
+    """
+    if column not in df.columns:
+        return pd.Series("", index=df.index)
+    return df[column].fillna("").astype(str).str.strip().replace({"nan": "", "None": ""})
+
+
+def _numeric_values(df):
+    """
+    Valor as floats; thousands separators and a trailing/parenthesized sign are tolerated.
+    """
+    if "Valor" not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    values = df["Valor"]
+    if values.dtype.kind in "if":
+        return values.astype(float)
+    text = values.fillna("").astype(str).str.strip()
+    negative = text.str.match(r"^\(.*\)$") | text.str.endswith("-")
+    text = text.str.replace(r"[^\d.\-eE]", "", regex=True).str.rstrip("-")
+    numbers = pd.to_numeric(text, errors="coerce")
+    return numbers.where(~negative, -numbers.abs())
+
+
+def _hierarchy_paths(df):
+    """
+    Per-row hierarchy path (the Nivel_1..Nivel_5 values up to the first empty one),
+    returned as the prefix keys of every depth and the path length.
+    """
+    levels = [_text_column(df, column) for column in LEVEL_COLUMNS]
+    filled = np.column_stack([(level != "").to_numpy() for level in levels])
+    # Levels after the first empty one are ignored
+    depth = np.cumprod(filled, axis=1).sum(axis=1)
+    prefixes = [pd.Series("", index=df.index)]
+    for k, level in enumerate(levels, 1):
+        prefixes.append(prefixes[-1] + "\x1f" + level)
+    return prefixes, depth
+
+
+def _assign_parents(scope, prefixes, depth, is_total):
+    """
+    Assigns each row to its nearest ancestor total within the same scope.
+
+    A detail row belongs to the deepest total whose path is a prefix of (or equal to)
+    its own path; a total belongs to the deepest total whose path is a strict prefix
+    of its own, so nested subtotals are counted once and not together with their detail.
+    Returns an array of parent positions (-1 when a row has no parent total).
+    """
+    n_rows = len(scope)
+    positions = np.arange(n_rows)
+    total_keys = scope[is_total] + prefixes[0][is_total]
+    # Full-path key of every total, first total wins when several share a path
+    for k in range(1, len(prefixes)):
+        total_keys = total_keys.where(depth[is_total] != k, scope[is_total] + prefixes[k][is_total])
+    total_lookup = pd.Series(positions[is_total], index=total_keys.to_numpy())
+    total_lookup = total_lookup[~total_lookup.index.duplicated()]
+
+    parent = np.full(n_rows, -1)
+    for k in range(len(prefixes) - 1, -1, -1):
+        allowed = np.where(is_total, depth > k, depth >= k) & (parent == -1)
+        if not allowed.any():
+            continue
+        keys = (scope + prefixes[k]).to_numpy()[allowed]
+        found = pd.Series(keys).map(total_lookup).to_numpy()
+        hits = ~pd.isna(found)
+        rows = positions[allowed][hits]
+        candidates = found[hits].astype(int)
+        # A total never parents itself
+        keep = candidates != rows
+        parent[rows[keep]] = candidates[keep]
+    return parent
+
+
+def _cell_refs(df):
+    """
+    Sheet, column letters and row number of the cell each row was taken from (Origen_Dato).
+    Rows without a cell reference get an empty column and row 0.
+    """
+    origin = _text_column(df, "Origen_Dato")
+    # The last reference wins: "H1:B10" is sheet H1, cell B10
+    refs = origin.str.extract(r"\b([A-Z]{1,3})(\d+)\b(?!.*\b[A-Z]{1,3}\d+\b)")
+    columns = refs[0].fillna("")
+    rows = pd.to_numeric(refs[1], errors="coerce").fillna(0).astype(int)
+    return _text_column(df, "Hoja"), columns, rows
+
+
+def _relation_components(relation, position, sheets, columns, rows, scope):
+    """
+    Rows referenced by a Relacion_Celdas text ("Suma(B10:B19)", "B10+B11-B12",
+    "Suma de B10 a B40") on the same sheet and scope, as (positions, signs), or None.
+    A reference preceded by "-" is subtracted.
+    """
+    if not relation:
+        return None
+    same_sheet = (sheets == sheets[position]) & (scope == scope[position])
+    weights = np.zeros(len(sheets))
+    remaining = relation
+    for match in RANGE_PATTERN.finditer(relation):
+        first_col, first_row, last_col, last_row = match.groups()
+        low, high = sorted((int(first_row), int(last_row)))
+        # Row ranges across columns (e.g. B10:D10) take the cells of both columns
+        mask = same_sheet & np.isin(columns, [first_col, last_col]) & (rows >= low) & (rows <= high)
+        weights[mask] = _sign_before(relation, match.start())
+        # Blank the range out (keeping offsets) so its ends are not read as single cells
+        remaining = remaining[:match.start()] + " " * len(match.group(0)) + remaining[match.end():]
+    for match in CELL_PATTERN.finditer(remaining):
+        col, row = match.groups()
+        weights[same_sheet & (columns == col) & (rows == int(row))] = _sign_before(relation, match.start())
+    weights[position] = 0
+    if not weights.any():
+        return None
+    components = np.flatnonzero(weights)
+    return components, weights[components]
+
+
+def _sign_before(text, start):
+    """
+    -1 when the reference starting at `start` is preceded by a minus sign, else 1.
+    """
+    before = text[:start].rstrip()
+    return -1.0 if before.endswith("-") else 1.0
+
+
+def _equation(names, values, signs, total):
+    terms = [
+        f"{'-' if sign < 0 else '+'} {name} ({_format_number(value)})"
+        for name, value, sign in zip(names, values, signs)
+    ]
+    if len(terms) > EQUATION_MAX_TERMS:
+        terms = terms[:EQUATION_MAX_TERMS] + [f"+ ... ({len(names) - EQUATION_MAX_TERMS} más)"]
+    return " ".join(terms).removeprefix("+ ") + f" = {_format_number(total)}"
+
+
+def _flag_outliers(df, values):
+    """
+    Marks values more than OUTLIER_SIGMAS standard deviations from the mean of their
+    series (same sheet, entity, currency, hierarchy path and concept across periods),
+    plus economically illogical values such as negative Activos.
+    """
+    series_key = pd.Series("", index=df.index)
+    for column in SERIES_COLUMNS:
+        series_key = series_key + "\x1f" + _text_column(df, column)
+    groups = values.groupby(series_key)
+    count = groups.transform("count")
+    mean = groups.transform("mean")
+    std = groups.transform("std", ddof=0)
+    deviation = (values - mean).abs()
+    sigma_outlier = (count >= OUTLIER_MIN_POINTS) & (std > 0) & (deviation > OUTLIER_SIGMAS * std)
+
+    level_1 = _text_column(df, "Nivel_1").str.lower()
+    concept = _text_column(df, "Concepto_Final")
+    negative_asset = (
+        level_1.str.startswith("activo") & (values < 0)
+        & ~concept.str.contains(CONTRA_ACCOUNT_PATTERN)
+    )
+    return (sigma_outlier | negative_asset).fillna(False).to_numpy()
+
+
+def validate_report(df, tolerance=TOTAL_TOLERANCE):
+    """
+    Validates an analysis CSV locally and fills its validation columns.
+
+    Every row with Es_Total = "SI" is checked against the sum of its components:
+    the cells listed in Relacion_Celdas when they can be matched to the Origen_Dato of
+    other rows, otherwise the rows whose Nivel_1..Nivel_5 path hangs directly from the
+    total (same Hoja, Entidad, Año, Mes and Moneda). Ecuacion_Validacion gets the
+    equation, Explicacion_Validacion "Suma validada" or an
+    "ADVERTENCIA: Suma calculada X vs Valor reportado Y" note, and Es_Outlier is
+    recomputed per series. Returns the validated copy and a summary dict.
+    """
+    df = df.copy()
+    for column in VALIDATION_COLUMNS:
+        if column not in df.columns:
+            df[column] = ""
+        df[column] = df[column].astype(object)
+    if df.empty:
+        return df, {"totals": 0, "validated": 0, "discrepancies": 0, "unverified": 0, "outliers": 0}
+
+    values = _numeric_values(df)
+    value_array = values.to_numpy(dtype=float)
+    is_total = _text_column(df, "Es_Total").str.upper().isin(TRUE_VALUES).to_numpy()
+    scope = pd.Series("", index=df.index)
+    for column in SCOPE_COLUMNS:
+        scope = scope + "\x1f" + _text_column(df, column)
+    scope_array = scope.to_numpy()
+    names = _text_column(df, "Concepto_Final").to_numpy()
+
+    # Hierarchy: grouped sums of the direct components of every total
+    prefixes, depth = _hierarchy_paths(df)
+    parent = _assign_parents(scope.reset_index(drop=True), [p.reset_index(drop=True) for p in prefixes],
+                             depth, is_total)
+    has_parent = parent >= 0
+    child_sums = np.bincount(parent[has_parent], weights=np.nan_to_num(value_array[has_parent]),
+                             minlength=len(df))
+    children = pd.Series(np.flatnonzero(has_parent)).groupby(parent[has_parent]).agg(list)
+
+    # Cell references, for totals whose Relacion_Celdas names their components
+    sheets, ref_columns, ref_rows = (s.to_numpy() for s in _cell_refs(df))
+    relations = _text_column(df, "Relacion_Celdas").to_numpy()
+
+    equations = df["Ecuacion_Validacion"].to_numpy(dtype=object, copy=True)
+    explanations = df["Explicacion_Validacion"].to_numpy(dtype=object, copy=True)
+    summary = {"totals": int(is_total.sum()), "validated": 0, "discrepancies": 0, "unverified": 0}
+    for position in np.flatnonzero(is_total):
+        components = None
+        referenced = _relation_components(relations[position], position, sheets, ref_columns,
+                                          ref_rows, scope_array)
+        if referenced is not None:
+            components, signs = referenced
+            computed = np.nansum(value_array[components] * signs)
+        elif position in children.index:
+            components = np.asarray(children[position])
+            signs = np.ones(len(components))
+            computed = child_sums[position]
+        reported = value_array[position]
+        if components is None or np.isnan(reported):
+            explanations[position] = "Sin componentes identificados para validar"
+            summary["unverified"] += 1
+            continue
+        equations[position] = _equation(names[components], value_array[components], signs, computed)
+        if abs(computed - reported) > tolerance * max(abs(reported), 1.0):
+            explanations[position] = (
+                f"ADVERTENCIA: Suma calculada {_format_number(computed)} "
+                f"vs Valor reportado {_format_number(reported)}"
+            )
+            summary["discrepancies"] += 1
+        else:
+            explanations[position] = "Suma validada"
+            summary["validated"] += 1
+
+    empty_explanation = pd.Series(explanations).fillna("").astype(str).str.strip().isin(["", "nan"]).to_numpy()
+    explanations[~is_total & empty_explanation] = "Valor base reportado"
+    df["Ecuacion_Validacion"] = pd.Series(equations, index=df.index).fillna("")
+    df["Explicacion_Validacion"] = explanations
+
+    outliers = _flag_outliers(df, values)
+    df["Es_Outlier"] = np.where(outliers, "SI", "NO")
+    summary["outliers"] = int(outliers.sum())
+    return df, summary